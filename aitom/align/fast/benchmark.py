@@ -0,0 +1,275 @@
+"""
+benchmark of the subtomogram alignment engines of aitom.align.fast.util on synthetic data
+
+Pairs are generated from aitom.model.util.generate_toy_model(): the template v1 is the noise free model, and the
+subtomogram v2 is the model rotated and shifted by a known random rigid transform (aitom.geometry.rotate), with
+gaussian noise of a given SNR (signal variance / noise variance) and a missing wedge
+(aitom.image.vol.wedge.util.wedge_mask()) applied.
+
+Since rotating v2 by the alignment result (angle, loc) should give v1, the recovered transform is compared with the
+reverse of the ground truth transform:
+    ang_err:    geodesic distance between the two rotations, in degrees
+    loc_err:    euclidean distance between the two translations, in voxels
+
+For every combination of box size, bandwidth L, SNR and engine, the benchmark reports the throughput (pairs per
+second, data generation excluded), the peak memory, and the error statistics. The records can be saved as json lines
+or csv, for tracking regressions across versions.
+
+Memory is reported as
+    peak_rss_mb:        peak resident memory of the process that ran the configuration. ru_maxrss never decreases
+                        during the life of a process, so by default every configuration runs in a fresh process
+    peak_rss_delta_mb:  increase of that peak during the alignments, 0 if they stayed below the earlier peak
+    peak_traced_mb:     peak of the allocations seen by tracemalloc, i.e. numpy and python objects only, the
+                        buffers of the compiled core are not included
+
+usage:
+    python -m aitom.align.fast.benchmark --sizes 32 64 --L 16 36 --snr 1000 0.5 --pairs 10 --out bench.jsonl
+"""
+
+import os
+import sys
+import csv
+import json
+import time
+import platform
+import resource
+import multiprocessing
+import argparse
+import tracemalloc
+
+import numpy as N
+from numpy.fft import fftn, ifftn, fftshift, ifftshift
+
+import aitom.model.util as MU
+import aitom.geometry.rotate as GR
+import aitom.geometry.ang_loc as AA
+import aitom.image.vol.wedge.util as IVWU
+import aitom.align.fast.util as AFU
+
+
+def engine_align_vols(v1, m1, v2, m2, L):
+    """combined rotational and translational search"""
+    return AFU.align_vols(v1=v1, m1=m1, v2=v2, m2=m2, L=L)
+
+
+def engine_two_stage(v1, m1, v2, m2, L):
+    """fast_rotation_align() candidates followed by translation_align_given_rotation_angles()"""
+    angs = AFU.fast_rotation_align(v1=v1, m1=m1, v2=v2, m2=m2, max_l=L)
+    al = AFU.translation_align_given_rotation_angles(v1=v1, m1=m1, v2=v2, m2=m2, angs=angs)
+    al = max(al, key=lambda _: _['score'])
+    return {'score': al['score'], 'loc': al['loc'], 'angle': al['ang']}
+
+
+def engine_two_stage_batch(v1, m1, v2, m2, L):
+    """fast_rotation_align() candidates followed by translation_align_given_rotation_angles__batch()"""
+    angs = AFU.fast_rotation_align(v1=v1, m1=m1, v2=v2, m2=m2, max_l=L)
+    al = AFU.translation_align_given_rotation_angles__batch(v1=v1, m1=m1, v2=v2, m2=m2, angs=angs)
+    al = max(al, key=lambda _: _['score'])
+    return {'score': al['score'], 'loc': al['loc'], 'angle': al['ang']}
+
+
+engines = {'align_vols': engine_align_vols, 'two_stage': engine_two_stage, 'two_stage_batch': engine_two_stage_batch}
+
+
+def random_rotation_angle(rs):
+    """uniformly distributed random rotation, in zyz convention"""
+    q, r = N.linalg.qr(rs.normal(size=(3, 3)))
+    q = q * N.sign(N.diag(r))
+    if N.linalg.det(q) < 0:
+        q[:, 0] = -q[:, 0]
+    return AA.rotation_matrix_zyz_normalized_angle(q)
+
+
+def apply_wedge(v, m):
+    """remove the Fourier coefficients outside the (fftshifted) mask m"""
+    return N.real(ifftn(ifftshift(fftshift(fftn(v)) * m)))
+
+
+def generate_pair(v, rs, snr=None, wedge_ang=30, max_shift=None):
+    """
+    rotate and shift the model v by a random transform, then add noise and a missing wedge.
+    snr=None means noise free.
+    returns the subtomogram v2, its wedge mask m2, and the reverse transform that aligns v2 back to v
+    """
+    if max_shift is None:
+        max_shift = v.shape[0] / 8.0
+
+    ang = random_rotation_angle(rs)
+    loc = rs.uniform(-max_shift, max_shift, size=3)
+    v2 = GR.rotate_pad_mean(v, angle=ang, loc_r=loc)
+
+    if snr is not None:
+        v2 = v2 + rs.normal(scale=N.sqrt(v.var() / snr), size=v2.shape)
+
+    if wedge_ang > 0:
+        m2 = IVWU.wedge_mask(v2.shape, wedge_ang)
+        v2 = apply_wedge(v2, m2)
+    else:
+        m2 = MU.sphere_mask(v2.shape)
+
+    ang_rev, loc_rev = AA.reverse_transform_ang_loc(ang, loc)
+    return {'v': v2, 'm': m2, 'angle': ang_rev, 'loc': loc_rev}
+
+
+def angle_error(ang1, ang2):
+    """geodesic distance, in degrees, between the rotations of two zyz angles"""
+    rm = N.dot(AA.rotation_matrix_zyz(ang1).T, AA.rotation_matrix_zyz(ang2))
+    return N.degrees(N.arccos(N.clip((N.trace(rm) - 1.0) / 2.0, -1.0, 1.0)))
+
+
+def peak_rss_mb():
+    """peak resident memory of this process since it started, it never decreases"""
+    r = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, kilobytes elsewhere
+    return r / (1024.0 * 1024.0) if sys.platform == 'darwin' else r / 1024.0
+
+
+def run_config(siz, L, snr, engine, pairs=10, wedge_ang=30, dtype=N.float64, seed=0, model_id=0):
+    """
+    align a set of generated pairs with one engine.
+    the pairs only depend on siz, snr, wedge_ang and seed, so different L and engines see the same data.
+    returns the summary record, and the per pair errors
+    """
+    rs = N.random.RandomState(seed)
+    v1 = MU.generate_toy_model(dim_siz=siz, model_id=model_id)
+    m1 = MU.sphere_mask(v1.shape)
+    ps = [generate_pair(v1, rs, snr=snr, wedge_ang=wedge_ang) for _ in range(pairs)]
+
+    v1 = v1.astype(dtype)
+    m1 = m1.astype(dtype)
+    for p in ps:
+        p['v'] = p['v'].astype(dtype)
+        p['m'] = p['m'].astype(dtype)
+
+    f = engines[engine]
+    rss0 = peak_rss_mb()
+    tracemalloc.start()
+    errs = []
+    duration = 0.0
+    for p in ps:
+        t = time.time()
+        al = f(v1, m1, p['v'], p['m'], L)
+        duration += time.time() - t
+
+        ok = N.isfinite(al['score'])
+        errs.append({'ang_err': angle_error(al['angle'], p['angle']) if ok else float('nan'),
+                     'loc_err': N.linalg.norm(N.array(al['loc']) - p['loc']) if ok else float('nan'),
+                     'score': float(al['score'])})
+    traced_peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    rss = peak_rss_mb()
+
+    ang_err = N.array([_['ang_err'] for _ in errs])
+    loc_err = N.array([_['loc_err'] for _ in errs])
+    ok = N.isfinite(ang_err)
+
+    # the angular sampling of the rotation search is 180 / L degrees
+    hit = ok.copy()
+    hit[ok] = (ang_err[ok] <= (2 * 180.0 / L)) & (loc_err[ok] <= 2.0)
+
+    re = {'engine': engine, 'size': siz, 'L': L, 'snr': snr, 'wedge_ang': wedge_ang, 'dtype': N.dtype(dtype).name,
+          'pairs': pairs, 'seed': seed, 'failed': int((~ok).sum()),
+          'duration': duration, 'pairs_per_sec': pairs / duration if duration > 0 else float('nan'),
+          'peak_traced_mb': traced_peak / (1024.0 * 1024.0), 'peak_rss_mb': rss, 'peak_rss_delta_mb': rss - rss0,
+          'success_rate': float(hit.mean())}
+    for k, e in (('ang_err', ang_err), ('loc_err', loc_err)):
+        e = e[ok]
+        re[k + '_mean'] = float(e.mean()) if len(e) > 0 else float('nan')
+        re[k + '_median'] = float(N.median(e)) if len(e) > 0 else float('nan')
+        re[k + '_max'] = float(e.max()) if len(e) > 0 else float('nan')
+
+    return re, errs
+
+
+def run_config__process(**kwargs):
+    """run_config() in a new process, so that peak_rss_mb is not the peak of the configurations run before"""
+    with multiprocessing.get_context('spawn').Pool(1) as pool:
+        return pool.apply(run_config, kwds=kwargs)
+
+
+def environment():
+    """versions and settings that affect the results, stored with every record"""
+    try:
+        import aitom.tomominer.core.cython.core as core
+        core_threads = core.get_num_threads()
+    except ImportError:
+        # the compiled core is not built, only the engines that do not use it can run
+        core_threads = None
+    return {'python': platform.python_version(), 'numpy': N.__version__, 'machine': platform.machine(),
+            'cpu_count': os.cpu_count(), 'core_threads': core_threads}
+
+
+def run(sizes=(32, 64, 96, 128), Ls=(16, 36), snrs=(None, 1.0, 0.1), engine_names=None, pairs=10, wedge_ang=30,
+        dtype=N.float64, seed=0, isolate=True, verbose=True):
+    """
+    run every configuration, return the list of summary records. engine_names defaults to all engines.
+    isolate=True runs every configuration in its own process, see run_config__process()
+    """
+    if engine_names is None:
+        engine_names = list(engines.keys())
+    env = environment()
+    records = []
+    for siz in sizes:
+        for snr in snrs:
+            for L in Ls:
+                for engine in engine_names:
+                    f = run_config__process if isolate else run_config
+                    re, _ = f(siz=siz, L=L, snr=snr, engine=engine, pairs=pairs, wedge_ang=wedge_ang, dtype=dtype,
+                              seed=seed)
+                    re.update(env)
+                    records.append(re)
+                    if verbose:
+                        print_record(re)
+    return records
+
+
+def print_record(re):
+    print('%-10s size %4d  L %3d  snr %8s  %8.3f pairs/s  ang_err %7.2f deg  loc_err %6.2f  success %5.2f  '
+          'rss %8.1f MB' % (re['engine'], re['size'], re['L'], re['snr'], re['pairs_per_sec'], re['ang_err_median'],
+                            re['loc_err_median'], re['success_rate'], re['peak_rss_mb']))
+    sys.stdout.flush()
+
+
+def save(records, path):
+    """save the records as csv if path ends with .csv, otherwise as json lines"""
+    if path.endswith('.csv'):
+        keys = []
+        for r in records:
+            keys.extend(_ for _ in r if _ not in keys)
+        with open(path, 'w', newline='') as f:
+            w = csv.DictWriter(f, fieldnames=keys)
+            w.writeheader()
+            w.writerows(records)
+    else:
+        with open(path, 'w') as f:
+            for r in records:
+                f.write(json.dumps(r) + '\n')
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description='benchmark of the alignment engines on synthetic data')
+    p.add_argument('--sizes', type=int, nargs='+', default=[32, 64, 96, 128])
+    p.add_argument('--L', type=int, nargs='+', default=[16, 36])
+    p.add_argument('--snr', type=float, nargs='+', default=[float('inf'), 1.0, 0.1],
+                   help='signal to noise ratios, inf means noise free')
+    p.add_argument('--engines', nargs='+', default=list(engines.keys()), choices=list(engines.keys()))
+    p.add_argument('--pairs', type=int, default=10, help='number of pairs per configuration')
+    p.add_argument('--wedge-ang', type=float, default=30, help='half angle of the missing wedge, 0 for no wedge')
+    p.add_argument('--float32', action='store_true', help='use single precision volumes')
+    p.add_argument('--seed', type=int, default=0)
+    p.add_argument('--out', help='output file, .csv or json lines')
+    p.add_argument('--no-isolate', action='store_true',
+                   help='run all configurations in this process, peak_rss_mb is then the peak over all of them so far')
+    a = p.parse_args(argv)
+
+    snrs = [None if N.isinf(_) else _ for _ in a.snr]
+    records = run(sizes=a.sizes, Ls=a.L, snrs=snrs, engine_names=a.engines, pairs=a.pairs, wedge_ang=a.wedge_ang,
+                  dtype=N.float32 if a.float32 else N.float64, seed=a.seed, isolate=not a.no_isolate)
+    if a.out is not None:
+        save(records, a.out)
+
+    return records
+
+
+if __name__ == '__main__':
+    main()
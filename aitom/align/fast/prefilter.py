@@ -0,0 +1,127 @@
+"""
+Rotation invariant screening of subtomogram to template alignments
+
+The descriptor of a volume is its Fourier power spectrum averaged on each frequency shell, over the voxels that are
+observed according to its fftshifted missing wedge mask. It does not change with the rotation or the translation of
+the structure, so it is computed once per subtomogram and once per template. Templates are ranked by the correlation
+of their profile with the profile of the subtomogram, and only the top_m templates of each subtomogram need the full
+alignment. recall() measures, on subtomograms that are also aligned exhaustively, how often the best template is
+kept, which is used to choose top_m.
+
+usage:
+    ps = [fourier_shell_profile(v=avgs[k]['v'], m=avgs[k]['m']) for k in avg_keys]
+    ks = rank_templates(fourier_shell_profile(v=v, m=m), ps)[:top_m]
+or, as one task per subtomogram
+    re = align_vols__top_m(v1s=[avgs[k]['v'] for k in avg_keys], m1s=[avgs[k]['m'] for k in avg_keys], v2=v, m2=m,
+                           p1s=ps, top_m=top_m)
+"""
+
+import numpy as N
+from numpy.fft import fftn, fftshift
+
+import aitom.image.vol.util as IVU
+import aitom.align.fast.util as AU
+
+shell_index_cache = {}
+
+
+def shell_index(shape):
+    """the rounded distance of every voxel to the zero frequency of a fftshifted volume"""
+    shape = tuple(shape)
+    if shape not in shell_index_cache:
+        g = IVU.grid_displacement_to_center(shape, IVU.fft_mid_co(shape))
+        shell_index_cache[shape] = N.round(IVU.grid_distance_to_center(g)).astype(N.int64)
+    return shell_index_cache[shape]
+
+
+def fourier_shell_profile(v, m=None, r_max=None, mask_cutoff=0.5):
+    """
+    mean Fourier power of v on the shells 0 .. r_max, where the fftshifted mask m is at least mask_cutoff,
+    shells without observed voxels are nan. the default r_max is half of the Nyquist frequency
+    """
+    if r_max is None:
+        r_max = int(min(v.shape) / 4)
+    p = N.abs(fftshift(fftn(v - v.mean()))) ** 2
+    r = shell_index(v.shape)
+    ind = r <= r_max
+    if m is not None:
+        ind = N.logical_and(ind, m >= mask_cutoff)
+    s = N.bincount(r[ind], weights=p[ind], minlength=r_max + 1)
+    c = N.bincount(r[ind], minlength=r_max + 1)
+    re = N.zeros(r_max + 1) + N.nan
+    re[c > 0] = s[c > 0] / c[c > 0]
+    return re
+
+
+def profile_score(p1, p2):
+    """
+    similarity of two profiles, the correlation of their powers over the shells 1 .. r_max.
+    it does not depend on the scale of the volumes, nor on the white noise power added to a subtomogram
+    """
+    n = min(len(p1), len(p2))
+    p1 = p1[1:n]
+    p2 = p2[1:n]
+    ind = N.logical_and(N.isfinite(p1), N.isfinite(p2))
+    if ind.sum() < 3:
+        return float('nan')
+    p1 = p1[ind] - p1[ind].mean()
+    p2 = p2[ind] - p2[ind].mean()
+    d = N.sqrt(N.sum(p1 ** 2) * N.sum(p2 ** 2))
+    if d <= 0:
+        return float('nan')
+    return float(N.sum(p1 * p2) / d)
+
+
+def rank_templates(p, ps):
+    """indices of the template profiles ps, from the most to the least similar to the profile p"""
+    s = N.array([profile_score(p, _) for _ in ps])
+    s[N.logical_not(N.isfinite(s))] = -N.inf
+    return [int(_) for _ in N.argsort(-s, kind='stable')]
+
+
+def recall(ranks, best):
+    """
+    top_m recall of the screening for every top_m: the fraction of subtomograms whose best template in the
+    exhaustive search is among the top_m templates of its ranking. ranks and best are lists over the subtomograms
+    of the screening rankings and the indices of the exhaustively best templates
+    """
+    if len(ranks) == 0:
+        return {}
+    n = len(ranks[0])
+    pos = N.array([r.index(b) for r, b in zip(ranks, best)])
+    return {m: float(N.mean(pos < m)) for m in range(1, n + 1)}
+
+
+def recall__results(res):
+    """recall() of the results of align_vols__top_m() with exhaustive=True"""
+    ranks = []
+    best = []
+    for r in res:
+        s = N.array([_['score'] for _ in r['align']], dtype=N.float64)
+        if not N.any(N.isfinite(s)):
+            continue
+        s[N.logical_not(N.isfinite(s))] = -N.inf
+        ranks.append(r['rank'])
+        best.append(int(N.argmax(s)))
+    return recall(ranks, best)
+
+
+def align_vols__top_m(v1s, m1s, v2, m2, p1s, top_m, L=36, exhaustive=False):
+    """
+    align v2 against the templates v1s whose profiles p1s rank among the top_m, in the format of
+    align_vols__batch__best() for a single subtomogram. the other templates get a nan score and are marked as pruned.
+    with exhaustive=True all templates are aligned, so that the ranking can be checked by recall__results()
+    """
+    rank = rank_templates(fourier_shell_profile(v=v2, m=m2, r_max=len(p1s[0]) - 1), p1s)
+    sel = rank if exhaustive else rank[:top_m]
+    al = AU.align_vols__batch__best(v1s=[v1s[_] for _ in sel], m1s=[m1s[_] for _ in sel], v2s=[v2], m2s=[m2], L=L)
+
+    re = [None] * len(v1s)
+    for j, i in enumerate(sel):
+        re[i] = al[j][0]
+    for i in range(len(v1s)):
+        if re[i] is None:
+            re[i] = {'score': float('nan'), 'loc': N.zeros(3), 'angle': N.random.random(3) * (N.pi * 2),
+                     'pruned': True}
+
+    return {'align': re, 'rank': rank, 'exhaustive': exhaustive}
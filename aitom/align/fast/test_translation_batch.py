@@ -0,0 +1,60 @@
+"""
+check that translation_align_given_rotation_angles__batch() gives the same result as the loop of
+translation_align_given_rotation_angles(), on random volumes with missing wedge masks, for odd and even box sizes
+
+usage:
+    python -m pytest aitom/align/fast/test_translation_batch.py
+or
+    python -m aitom.align.fast.test_translation_batch
+"""
+
+import numpy as N
+
+import aitom.geometry.rotate as GR
+import aitom.geometry.ang_loc as AA
+import aitom.image.vol.wedge.util as IVWU
+import aitom.align.fast.util as AFU
+
+
+def random_rotation_angle(rs):
+    """uniformly distributed random rotation, in zyz convention"""
+    q, r = N.linalg.qr(rs.normal(size=(3, 3)))
+    q = q * N.sign(N.diag(r))
+    if N.linalg.det(q) < 0:
+        q[:, 0] = -q[:, 0]
+    return AA.rotation_matrix_zyz_normalized_angle(q)
+
+
+def translation_batch_difference(siz, angle_num=10, wedge_ang=30, seed=0):
+    """the largest relative score difference and the largest loc difference over angle_num random angles"""
+    rs = N.random.RandomState(seed)
+    v1 = rs.normal(size=(siz, siz, siz))
+    v2 = rs.normal(size=(siz, siz, siz))
+    m1 = IVWU.wedge_mask(v1.shape, wedge_ang)
+    m2 = GR.rotate_mask(IVWU.wedge_mask(v2.shape, wedge_ang), angle=random_rotation_angle(rs))
+    angs = [random_rotation_angle(rs) for _ in range(angle_num)]
+    a = AFU.translation_align_given_rotation_angles(v1=v1, m1=m1, v2=v2, m2=m2, angs=angs)
+    b = AFU.translation_align_given_rotation_angles__batch(v1=v1, m1=m1, v2=v2, m2=m2, angs=angs, batch_size=4)
+    return {'score': max(abs(x['score'] - y['score']) / abs(x['score']) for x, y in zip(a, b)),
+            'loc': max(N.abs(N.array(x['loc']) - N.array(y['loc'])).max() for x, y in zip(a, b))}
+
+
+def check_size(siz):
+    d = translation_batch_difference(siz)
+    assert d['score'] < 1e-8, (siz, d)
+    assert d['loc'] == 0, (siz, d)
+
+
+def test_translation_batch_odd_size():
+    check_size(21)
+
+
+def test_translation_batch_even_size():
+    check_size(20)
+    check_size(32)
+
+
+if __name__ == '__main__':
+    test_translation_batch_odd_size()
+    test_translation_batch_even_size()
+    print('translation search, batched and plain agree')
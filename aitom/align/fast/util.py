@@ -1,8 +1,10 @@
 """
 Functions for subtomogram alignment
+
+the compiled core is imported by the functions that use it, so that the others, e.g.
+translation_align_given_rotation_angles__batch(), also work where it is not built
 """
 
-import aitom.tomominer.core.cython.core as core
 import traceback
 import sys
 import numpy as N
@@ -16,11 +18,19 @@ import aitom.model.util as MU
 import aitom.image.vol.util as IVU
 
 
-def align_vols(v1, m1, v2, m2, L=36):
+def align_vols(v1, m1, v2, m2, L=36, multires=None):
+    """
+    best alignment of v2 against v1, the rotational search uses the bandwidth L.
+    multires: optional dict of the keyword arguments of align_vols__multires(), e.g. {'L': 16, 'top_n': 4},
+        to search the rotations on a Fourier cropped grid, and refine the best candidates at full resolution
+    """
     fail = False
 
     try:
-        al = align_vols__multiple_rotations(v1=v1, m1=m1, v2=v2, m2=m2, L=L)
+        if multires is None:
+            al = align_vols__multiple_rotations(v1=v1, m1=m1, v2=v2, m2=m2, L=L)
+        else:
+            al = align_vols__multires(v1=v1, m1=m1, v2=v2, m2=m2, **multires)
 
         # extract the score/displacement/angle from the first entry ret[0]
         score = al[0]['score']
@@ -53,6 +63,7 @@ def align_vols(v1, m1, v2, m2, L=36):
 
 
 def align_vols__multiple_rotations(v1, m1, v2, m2, L):
+    import aitom.tomominer.core.cython.core as core
     if m1 is None: m1 = MU.sphere_mask(v1.shape)
     if m2 is None: m2 = MU.sphere_mask(v2.shape)
 
@@ -63,8 +74,13 @@ def align_vols__multiple_rotations(v1, m1, v2, m2, L):
         print(v2.shape)
         assert (v1.shape == v2.shape)
 
-    cs = core.combined_search(v1.astype(N.float64), m1.astype(N.float64),
-                              v2.astype(N.float64), m2.astype(N.float64), L)
+    # float32 subtomograms are aligned in single precision, without conversion
+    if core_dtype(v1, v2) == N.float32:
+        cs = core.combined_search_float(v1.astype(N.float32), m1.astype(N.float32),
+                                        v2.astype(N.float32), m2.astype(N.float32), L)
+    else:
+        cs = core.combined_search(v1.astype(N.float64), m1.astype(N.float64),
+                                  v2.astype(N.float64), m2.astype(N.float64), L)
 
     al = [{}] * len(cs)
     for i in range(len(cs)):
@@ -78,6 +94,178 @@ def align_vols__multiple_rotations(v1, m1, v2, m2, L):
     return al
 
 
+def align_vols__multires(v1, m1, v2, m2, size=None, L=16, top_n=2, step=None, rounds=4, fine_rounds=0, threads=1):
+    """
+    coarse to fine alignment. the volumes are Fourier cropped to size (default half of the box, at least 16), and
+    the rotations are searched there with the small bandwidth L. each of the top_n candidates is refined by
+    align_vols__local_refine(), first on the cropped volumes until step (default half of the angular sampling of the
+    coarse search) has been halved rounds times, then at full resolution for fine_rounds more halvings, which also
+    gives the full resolution translation and score. full resolution rounds are expensive, with fine_rounds=0 only the
+    translation and score of the refined angle are computed at full resolution.
+    returns a list of {'score', 'loc', 'angle'} in decreasing order of score, like align_vols__multiple_rotations()
+    """
+    if m1 is None: m1 = MU.sphere_mask(v1.shape)
+    if m2 is None: m2 = MU.sphere_mask(v2.shape)
+    assert v1.shape == v2.shape
+
+    if size is None:
+        size = [max(int(_ / 2), 16) for _ in v1.shape]
+    size = [min(int(_), s) for _, s in zip(size, v1.shape)]
+
+    v1c = IVU.fourier_crop(v1, size)
+    m1c = IVU.fourier_crop_mask(m1, size)
+    v2c = IVU.fourier_crop(v2, size)
+    m2c = IVU.fourier_crop_mask(m2, size)
+    al = align_vols__multiple_rotations(v1=v1c, m1=m1c, v2=v2c, m2=m2c, L=L)
+    if top_n > 0:
+        al = al[:top_n]
+
+    if step is None:
+        # the angles of the rotational search are sampled every pi / L
+        step = N.pi / (2 * L)
+
+    re = []
+    for a in al:
+        r = align_vols__local_refine(v1=v1c, m1=m1c, v2=v2c, m2=m2c, angle=a['angle'], step=step, rounds=rounds,
+                                     order=1, threads=threads)
+        r = align_vols__local_refine(v1=v1, m1=m1, v2=v2, m2=m2, angle=r['angle'], step=(step / (2 ** rounds)),
+                                     rounds=fine_rounds, order=3, threads=threads)
+        re.append(r)
+
+    return sorted(re, key=lambda x: x['score'], reverse=True)
+
+
+def align_vols__local_refine(v1, m1, v2, m2, angle, step, rounds=4, max_rounds=None, order=3, threads=1):
+    """
+    local rotational search around angle, with a full translational search for every rotation.
+    each round tries the rotations by +-step about the three axes after the current best one, and moves to the best of
+    them if it improves the score. step is halved only when no move improves, the search ends after rounds halvings,
+    i.e. at a precision of step / 2 ** rounds, or after max_rounds rounds in total (default 4 * rounds).
+    order is the spline order of the rotations.
+    returns {'score', 'loc', 'angle'}, the score is the masked correlation, as the score of align_vols()
+    """
+    import aitom.geometry.ang_loc as AAL
+
+    def search(angs):
+        a = translation_align_given_rotation_angles__batch(v1=v1, m1=m1, v2=v2, m2=m2, angs=angs, order=order,
+                                                           threads=threads)
+        return max(a, key=lambda x: x['score'])
+
+    if max_rounds is None:
+        max_rounds = 4 * rounds
+
+    best = search([N.array(angle, dtype=N.float64)])
+    halvings = 0
+    round_i = 0
+    while (halvings < rounds) and (round_i < max_rounds):
+        round_i += 1
+        rm = AAL.rotation_matrix_zyz(best['ang'])
+        angs = [AAL.rotation_matrix_zyz_normalized_angle(rm.dot(AAL.rotation_matrix_axis(dim, d * step)))
+                for dim in range(3) for d in (-1, 1)]
+        a = search(angs)
+        if a['score'] > best['score']:
+            best = a
+        else:
+            step /= 2.0
+            halvings += 1
+
+    # the translation search returns the correlation divided by the number of voxels
+    return {'score': float(best['score']) * v1.size, 'loc': N.array(best['loc'], dtype=N.float64),
+            'angle': N.array(best['ang'], dtype=N.float64)}
+
+
+def align_vols__batch(v1s, m1s, v2s, m2s, L=36, top_n=0):
+    """
+    batched align_vols__multiple_rotations(), aligns every v2s[j] (the rotated one) against every v1s[i].
+    the FFT and spherical harmonic expansions of each volume are computed only once, so aligning one subtomogram
+    against K templates (v2s has one entry), or K subtomograms against one template (v1s has one entry),
+    is much cheaper than K calls of align_vols()
+
+    m1s, m2s, or their entries, can be None, in which case a sphere mask is used.
+    returns al[i][j], a list of {'score', 'loc', 'angle'} in decreasing order of score, with at most top_n entries
+    if top_n > 0. pairs involving a constant volume get an empty list.
+    if all volumes are float32, the single precision core functions are used.
+    """
+    import aitom.tomominer.core.cython.core as core
+    if m1s is None: m1s = [None] * len(v1s)
+    if m2s is None: m2s = [None] * len(v2s)
+    assert len(m1s) == len(v1s)
+    assert len(m2s) == len(v2s)
+
+    al = [[[] for _ in v2s] for _ in v1s]
+
+    # the alignment gets stuck for constant volumes
+    i1 = [_ for _ in range(len(v1s)) if v1s[_].max() > v1s[_].min()]
+    i2 = [_ for _ in range(len(v2s)) if v2s[_].max() > v2s[_].min()]
+    if (len(i1) == 0) or (len(i2) == 0):
+        return al
+
+    dtype = core_dtype(*(list(v1s) + list(v2s)))
+
+    def stack(vs, ms, inds):
+        vs_t = N.zeros(vs[inds[0]].shape + (len(inds),), dtype=dtype, order='F')
+        ms_t = N.zeros(vs_t.shape, dtype=dtype, order='F')
+        for k, i in enumerate(inds):
+            assert vs[i].shape == vs_t.shape[:3]
+            vs_t[:, :, :, k] = vs[i]
+            ms_t[:, :, :, k] = MU.sphere_mask(vs[i].shape) if ms[i] is None else ms[i]
+        return vs_t, ms_t
+
+    v1s_t, m1s_t = stack(v1s, m1s, i1)
+    v2s_t, m2s_t = stack(v2s, m2s, i2)
+
+    if dtype == N.float32:
+        cs = core.combined_search_batch_float(v1s_t, m1s_t, v2s_t, m2s_t, L, top_n)
+    else:
+        cs = core.combined_search_batch(v1s_t, m1s_t, v2s_t, m2s_t, L, top_n)
+
+    for k1, i in enumerate(i1):
+        for k2, j in enumerate(i2):
+            al[i][j] = [{'score': r[0], 'loc': N.copy(r[1:4]), 'angle': N.copy(r[4:7])} for r in cs[k1][k2]]
+
+    return al
+
+
+def align_vols__batch__best(v1s, m1s, v2s, m2s, L=36):
+    """
+    best alignment of every pair of align_vols__batch(), in the same format as align_vols(),
+    failed pairs get a nan score and a random angle
+    """
+    try:
+        al = align_vols__batch(v1s=v1s, m1s=m1s, v2s=v2s, m2s=m2s, L=L, top_n=1)
+    except Exception as err:
+        print(traceback.format_exc(), file=sys.stderr)
+        al = [[[] for _ in v2s] for _ in v1s]
+
+    re = [[None] * len(v2s) for _ in v1s]
+    for i in range(len(v1s)):
+        for j in range(len(v2s)):
+            if (len(al[i][j]) > 0) and N.isfinite(al[i][j][0]['score']):
+                re[i][j] = al[i][j][0]
+            else:
+                re[i][j] = {'score': float('nan'),
+                            'loc': N.zeros(3),
+                            'angle': N.random.random(3) * (N.pi * 2)}
+
+    return re
+
+
+def core_dtype(*vs):
+    """
+    the precision of the core functions used for the volumes vs:
+    float32 if all of them are float32, otherwise float64
+    """
+    return N.float32 if all(v.dtype == N.float32 for v in vs) else N.float64
+
+
+def rot_search_cor(v1, v2, radii, L):
+    """core.rot_search_cor(), in single precision if both volumes are float32"""
+    import aitom.tomominer.core.cython.core as core
+    if core_dtype(v1, v2) == N.float32:
+        return core.rot_search_cor_float(v1, v2, radii, L)
+    return core.rot_search_cor(v1.astype(N.float64, copy=False), v2.astype(N.float64, copy=False), radii, L)
+
+
 def align_vols_no_mask(v1, v2, L=36):
     m = MU.sphere_mask(v1.shape)
     return align_vols(v1=v1, m1=m, v2=v2, m2=m, L=L)
@@ -89,6 +277,7 @@ def fast_rotation_align(v1, m1, v2, m2, max_l=36):
     given two subtomograms and their masks, perform populate all candidate rotational angles,
     with missing wedge correction
     """
+    import aitom.tomominer.core.cython.core as core
     radius = int(max(v1.shape) / 2)
 
     # radii must start from 1, not 0!
@@ -109,12 +298,12 @@ def fast_rotation_align(v1, m1, v2, m2, max_l=36):
     a1t = v1fa * m1sq
     a2t = v2fa * m2sq
 
-    cor12 = core.rot_search_cor(a1t, a2t, radii, max_l)
+    cor12 = rot_search_cor(a1t, a2t, radii, max_l)
 
     sqt_cor11 = N.sqrt(N.real(
-        core.rot_search_cor(N.square(v1fa) * m1sq, m2sq, radii, max_l)))
+        rot_search_cor(N.square(v1fa) * m1sq, m2sq, radii, max_l)))
     sqt_cor22 = N.sqrt(N.real(
-        core.rot_search_cor(m1sq, N.square(v2fa) * m2sq, radii, max_l)))
+        rot_search_cor(m1sq, N.square(v2fa) * m2sq, radii, max_l)))
 
     cors = cor12 / (sqt_cor11 * sqt_cor22)
 
@@ -151,8 +340,9 @@ def translation_align_given_rotation_angles(v1, m1, v2, m2, angs):
         v2rf[0, 0, 0] = 0.0
         v2rf = fftshift(v2rf)
 
-        m2r = GR.rotate_pad_zero(m2, angle=ang)
-        m1_m2r = m1 * m2
+        # the masks are fftshifted, they are rotated around the zero frequency
+        m2r = GR.rotate_mask(m2, angle=ang)
+        m1_m2r = m1 * m2r
 
         # masked images
         v1fm = v1f * m1_m2r
@@ -168,3 +358,57 @@ def translation_align_given_rotation_angles(v1, m1, v2, m2, angs):
         a[i] = {'ang': ang, 'loc': lc['loc'], 'score': lc['cor']}
 
     return a
+
+
+def translation_align_given_rotation_angles__batch(v1, m1, v2, m2, angs, batch_size=8, order=3, threads=1):
+    """
+    batched translation_align_given_rotation_angles(), e.g. for all the candidate angles of fast_rotation_align().
+    the Fourier transform of v1 is computed only once, and v2 rotated by batch_size angles at a time is transformed
+    as one stack with real to complex FFTs. the rotations of a batch share the spline coefficients of v2, see
+    GR.rotate_batch(), order is their spline order. with threads > 1, the rotations and the FFTs run on that many
+    threads.
+    returns the same list of {'ang', 'loc', 'score'}, in the order of angs
+    """
+    import scipy.fft as SF
+
+    siz = v1.shape
+    mid_co = IVU.fft_mid_co(siz)
+    # real to complex transforms only keep the last axis up to the Nyquist frequency, the other coefficients
+    # are the complex conjugates of kept ones, so they are weighted twice in the norm of the spectrum
+    half = siz[2] // 2 + 1
+    w = N.full(half, 2.0)
+    w[0] = 1.0
+    if siz[2] % 2 == 0:
+        w[-1] = 1.0
+
+    v1f = SF.rfftn(v1, workers=threads)
+    v1f[0, 0, 0] = 0.0
+    v1fa = N.square(N.abs(v1f))
+    m1u = ifftshift(m1)
+
+    a = []
+    for i in range(0, len(angs), batch_size):
+        angs_t = angs[i:i + batch_size]
+
+        v2rf = SF.rfftn(GR.rotate_batch(v2, angles=angs_t, order=order, threads=threads), axes=(1, 2, 3),
+                        workers=threads)
+        v2rf[:, 0, 0, 0] = 0.0
+        m2r = GR.rotate_mask_batch(m2, angs_t, order=order, threads=threads)
+        msq = N.square(m1u[N.newaxis] * ifftshift(m2r, axes=(1, 2, 3)))
+        # the masks are rotated around fft_mid_co, for even sizes the product is not symmetric under k -> -k.
+        # the spectra are, so the real correlation and the norms of translation_align_given_rotation_angles()
+        # only see the symmetric part of the squared mask, which is what the half spectrum can represent
+        msq = 0.5 * (msq + N.roll(msq[:, ::-1, ::-1, ::-1], 1, axis=(1, 2, 3)))
+        msq = msq[:, :, :, :half]
+
+        # masked and normalized spectra
+        n1 = N.sqrt((v1fa[N.newaxis] * msq * w).sum(axis=(1, 2, 3)))
+        n2 = N.sqrt((N.square(N.abs(v2rf)) * msq * w).sum(axis=(1, 2, 3)))
+
+        cor = SF.irfftn(v1f[N.newaxis] * N.conj(v2rf) * msq, s=siz, axes=(1, 2, 3), workers=threads)
+        for k, ang in enumerate(angs_t):
+            c = fftshift(cor[k]) / (n1[k] * n2[k])
+            loc = N.unravel_index(c.argmax(), c.shape)
+            a.append({'ang': ang, 'loc': (loc - mid_co), 'score': c[loc]})
+
+    return a
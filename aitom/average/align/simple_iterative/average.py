@@ -7,10 +7,9 @@ import os
 import uuid
 
 import numpy as N
-import numpy.fft as NF
 
-import aitom.geometry.rotate as GR
 import aitom.io.file as AIF
+from aitom.tomominer.average.accumulator import VolumeAccumulator
 
 
 def average(dj_init=None, img_db=None, djs_file=None,
@@ -89,37 +88,11 @@ def vol_avg(dj, op, img_db):
     if len(dj) < op['mask_count_threshold']:
         return None
 
-    vol_sum = None
-    mask_sum = None
-
-    # temporary collection of local volume, and mask.
+    a = VolumeAccumulator()
     for d in dj:
-        v = img_db[d['subtomogram']]
-        vm = img_db[d['mask']]
-
-        v_r = GR.rotate_pad_mean(v, angle=d['angle'], loc_r=d['loc'])
-        assert N.all(N.isfinite(v_r))
-        vm_r = GR.rotate_mask(vm, angle=d['angle'])
-        assert N.all(N.isfinite(vm_r))
-
-        if vol_sum is None:
-            vol_sum = N.zeros(v_r.shape, dtype=N.float64, order='F')
-        vol_sum += v_r
-
-        if mask_sum is None:
-            mask_sum = N.zeros(vm_r.shape, dtype=N.float64, order='F')
-        mask_sum += vm_r
-
-    ind = mask_sum >= op['mask_count_threshold']
-    if ind.sum() <= 0:
-        return None
+        a.add(v=img_db[d['subtomogram']], m=img_db[d['mask']], angle=d['angle'], loc=d['loc'])
 
-    vol_sum = NF.fftshift(NF.fftn(vol_sum))
-    avg = N.zeros(vol_sum.shape, dtype=N.complex)
-    avg[ind] = vol_sum[ind] / mask_sum[ind]
-    avg = N.real(NF.ifftn(NF.ifftshift(avg)))
-
-    return {'v': avg, 'm': mask_sum / float(len(dj))}
+    return a.average(mask_count_threshold=op['mask_count_threshold'])
 
 
 def align_all_pairs(avgs, dj, img_db, n_chunk=1000, redis_host=None):
@@ -128,33 +101,30 @@ def align_all_pairs(avgs, dj, img_db, n_chunk=1000, redis_host=None):
     large amount of tasks, whose prameters points to a small numbers of images
     """
     # print 'align_all_pairs'
-    ts = {}
-    for d in dj:
-        v = img_db[d['subtomogram']]
-        m = img_db[d['mask']]
 
-        for k in avgs:
-            t = dict()
-            t['uuid'] = str(uuid.uuid4())
-            # t['module'] = 'tomominer.align.util'
-            t['module'] = 'aitom.align.fast.util'
-            t['method'] = 'align_vols'
+    # one task per subtomogram, aligned against all averages at once, so that the
+    # FFT and spherical harmonic expansion of each volume is computed only once per task
+    avg_keys = list(avgs.keys())
 
-            t['subtomogram_id'] = d['subtomogram']
-            t['template_id'] = k
+    ts = {}
+    for d in dj:
+        t = dict()
+        t['uuid'] = str(uuid.uuid4())
+        # t['module'] = 'tomominer.align.util'
+        t['module'] = 'aitom.align.fast.util'
+        t['method'] = 'align_vols__batch__best'
 
-            a_t = dict()
-            a_t['v1'] = avgs[k]['v']
-            a_t['m1'] = avgs[k]['m']
-            a_t['v2'] = v
-            a_t['m2'] = m
-            a_t['L'] = 36
+        t['subtomogram_id'] = d['subtomogram']
 
-            t['kwargs'] = a_t
-            ts[t['uuid']] = t
+        a_t = dict()
+        a_t['v1s'] = [avgs[k]['v'] for k in avg_keys]
+        a_t['m1s'] = [avgs[k]['m'] for k in avg_keys]
+        a_t['v2s'] = [img_db[d['subtomogram']]]
+        a_t['m2s'] = [img_db[d['mask']]]
+        a_t['L'] = 36
 
-            # al[i][k] = TAU.align_vols(v1=avgs[k]['v'], m1=avgs[k]['m'], v2=v, m2=m, L=36)
-            # al[i][k]['template_id'] = k
+        t['kwargs'] = a_t
+        ts[t['uuid']] = t
 
     from collections import defaultdict
     al = defaultdict(dict)
@@ -168,8 +138,9 @@ def align_all_pairs(avgs, dj, img_db, n_chunk=1000, redis_host=None):
     for tr in tr_s:
         i = tr['id']
         r = tr['result']
-        al[ts[i]['subtomogram_id']][ts[i]['template_id']] = r
-        al[ts[i]['subtomogram_id']][ts[i]['template_id']]['template_id'] = ts[i]['template_id']
+        for c, k in enumerate(avg_keys):
+            al[ts[i]['subtomogram_id']][k] = r[c][0]
+            al[ts[i]['subtomogram_id']][k]['template_id'] = k
 
     return al
 
@@ -13,7 +13,7 @@ from aitom.pick.dog.particle_picking_dog__filter import do_filter
 import os
 import json
 import aitom.io.file as io_file
-import aitom.image.vol.util as im_vol_util
+import numpy as N
 from bisect import bisect
 from pprint import pprint
 
@@ -50,18 +50,13 @@ def picking(path, s1, s2, t, find_maxima=True, partition_op=None,
         'x' is the center of the peak in the tomogram.
         'uuid' is an unique id for each peak.
     """
-    a = io_file.read_mrc_data(path)
-    print("file has been read")
-    temp = im_vol_util.cub_img(a)
-    # image data
-    a_im = temp['im']
-    # volume data
-    a_vt = temp['vt']
-
-    # using DoG to detect all peaks, may contain peaks caused by noise
-    peaks = peak__partition(a_vt, s1=s1, s2=s2, find_maxima=find_maxima,
-                            partition_op=partition_op,
-                            multiprocessing_process_num=multiprocessing_process_num)
+    # the tomogram is memory mapped, each partition only reads its own part of the file
+    with io_file.read_mrc_data_lazy(path, dtype=N.float32) as a:
+        print("file has been opened")
+        # using DoG to detect all peaks, may contain peaks caused by noise
+        peaks = peak__partition(a, s1=s1, s2=s2, find_maxima=find_maxima,
+                                partition_op=partition_op,
+                                multiprocessing_process_num=multiprocessing_process_num)
     '''
     calculate threshold T and delete peaks whose val are smaller than threshold
     Related paper: Pei L, Xu M, Frazier Z, Alber F. Simulating Cryo-Electron
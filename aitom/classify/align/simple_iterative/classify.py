@@ -8,10 +8,10 @@ import sys
 import uuid
 
 import numpy as N
-import numpy.fft as NF
 
 import aitom.geometry.rotate as GR
 import aitom.io.file as AIF
+from aitom.tomominer.average.accumulator import VolumeAccumulator
 
 
 def classify(dj_init=None, img_db=None, djs_file=None, avgs_file=None,
@@ -100,7 +100,7 @@ def classify(dj_init=None, img_db=None, djs_file=None, avgs_file=None,
         #     print(avgs[key]['pass_i'],avgs[key]['id'])
 
         # re-align subtomograms
-        al = align_all_pairs(avgs=avgs, dj=dj, img_db=img_db)
+        al = align_all_pairs(avgs=avgs, dj=dj, img_db=img_db, prefilter=op.get('align', {}).get('prefilter'))
         a = align_all_pairs__select_best(al)
         for d in dj:
             i = d['subtomogram']
@@ -228,72 +228,64 @@ def vol_avg(dj, op, img_db):
     if len(dj) < op['mask_count_threshold']:
         return None
 
-    vol_sum = None
-    mask_sum = None
-
-    # temporary collection of local volume, and mask.
+    a = VolumeAccumulator()
     for d in dj:
-        v = img_db[d['subtomogram']]
-        vm = img_db[d['mask']]
-
-        v_r = GR.rotate_pad_mean(v, angle=d['angle'], loc_r=d['loc'])
-        assert N.all(N.isfinite(v_r))
-        vm_r = GR.rotate_mask(vm, angle=d['angle'])
-        assert N.all(N.isfinite(vm_r))
-
-        if vol_sum is None:
-            vol_sum = N.zeros(v_r.shape, dtype=N.float64, order='F')
-        vol_sum += v_r
-
-        if mask_sum is None:
-            mask_sum = N.zeros(vm_r.shape, dtype=N.float64, order='F')
-        mask_sum += vm_r
-
-    ind = mask_sum >= op['mask_count_threshold']
-    if ind.sum() <= 0:
-        return None
+        a.add(v=img_db[d['subtomogram']], m=img_db[d['mask']], angle=d['angle'], loc=d['loc'])
 
-    vol_sum = NF.fftshift(NF.fftn(vol_sum))
-    avg = N.zeros(vol_sum.shape, dtype=N.complex)
-    avg[ind] = vol_sum[ind] / mask_sum[ind]
-    avg = N.real(NF.ifftn(NF.ifftshift(avg)))
+    return a.average(mask_count_threshold=op['mask_count_threshold'])
 
-    return {'v': avg, 'm': mask_sum / float(len(dj))}
 
-
-def align_all_pairs(avgs, dj, img_db, n_chunk=1000, redis_host=None):
+def align_all_pairs(avgs, dj, img_db, n_chunk=1000, redis_host=None, prefilter=None):
     """
     because python variables are references, it is fine to prepare large amount of tasks, whose prameters points to a small numbers of images
+
+    prefilter: optional screening of the averages with aitom.align.fast.prefilter, a dict with
+        top_m: number of averages aligned against each subtomogram, the others get a nan score
+        recall_sample_num: number of randomly chosen subtomograms that are aligned against all averages, the recall of
+            the screening on them is printed and stored in prefilter['recall']
+        r_max: largest frequency shell of the descriptors, default half of the Nyquist frequency
     """
     # print 'align_all_pairs'
 
-    ts = {}
-    for d in dj:
-        v = img_db[d['subtomogram']]
-        m = img_db[d['mask']]
-
-        for k in avgs:
-            t = dict()
-            t['uuid'] = str(uuid.uuid4())
-            # t['module'] = 'tomominer.align.util'
-            t['module'] = 'aitom.align.fast.util'
-            t['method'] = 'align_vols'
+    # one task per subtomogram, aligned against all averages at once, so that the
+    # FFT and spherical harmonic expansion of each volume is computed only once per task
+    avg_keys = list(avgs.keys())
 
-            t['subtomogram_id'] = d['subtomogram']
-            t['template_id'] = k
+    if prefilter is not None:
+        import aitom.align.fast.prefilter as AFP
+        p1s = [AFP.fourier_shell_profile(v=avgs[k]['v'], m=avgs[k]['m'], r_max=prefilter.get('r_max'))
+               for k in avg_keys]
+        sample_num = min(prefilter.get('recall_sample_num', 0), len(dj))
+        exhaustive = set(N.random.permutation(len(dj))[:sample_num].tolist())
 
-            a_t = dict()
-            a_t['v1'] = avgs[k]['v']
-            a_t['m1'] = avgs[k]['m']
-            a_t['v2'] = v
-            a_t['m2'] = m
-            a_t['L'] = 36
-
-            t['kwargs'] = a_t
-            ts[t['uuid']] = t
-
-            # al[i][k] = TAU.align_vols(v1=avgs[k]['v'], m1=avgs[k]['m'], v2=v, m2=m, L=36)
-            # al[i][k]['template_id'] = k
+    ts = {}
+    for di, d in enumerate(dj):
+        t = dict()
+        t['uuid'] = str(uuid.uuid4())
+        # t['module'] = 'tomominer.align.util'
+        t['module'] = 'aitom.align.fast.util'
+        t['method'] = 'align_vols__batch__best'
+
+        t['subtomogram_id'] = d['subtomogram']
+
+        a_t = dict()
+        a_t['v1s'] = [avgs[k]['v'] for k in avg_keys]
+        a_t['m1s'] = [avgs[k]['m'] for k in avg_keys]
+        a_t['v2s'] = [img_db[d['subtomogram']]]
+        a_t['m2s'] = [img_db[d['mask']]]
+        a_t['L'] = 36
+
+        if prefilter is not None:
+            t['module'] = 'aitom.align.fast.prefilter'
+            t['method'] = 'align_vols__top_m'
+            a_t['v2'] = a_t.pop('v2s')[0]
+            a_t['m2'] = a_t.pop('m2s')[0]
+            a_t['p1s'] = p1s
+            a_t['top_m'] = prefilter['top_m']
+            a_t['exhaustive'] = di in exhaustive
+
+        t['kwargs'] = a_t
+        ts[t['uuid']] = t
 
     from collections import defaultdict
     al = defaultdict(dict)
@@ -307,8 +299,15 @@ def align_all_pairs(avgs, dj, img_db, n_chunk=1000, redis_host=None):
     for tr in tr_s:
         i = tr['id']
         r = tr['result']
-        al[ts[i]['subtomogram_id']][ts[i]['template_id']] = r
-        al[ts[i]['subtomogram_id']][ts[i]['template_id']]['template_id'] = ts[i]['template_id']
+        if prefilter is not None:
+            r = [[_] for _ in r['align']]
+        for c, k in enumerate(avg_keys):
+            al[ts[i]['subtomogram_id']][k] = r[c][0]
+            al[ts[i]['subtomogram_id']][k]['template_id'] = k
+
+    if prefilter is not None:
+        prefilter['recall'] = AFP.recall__results([_['result'] for _ in tr_s if _['result']['exhaustive']])
+        print('prefilter recall of the best average among the top m:', prefilter['recall'])
 
     return al
 
@@ -318,9 +317,11 @@ def align_all_pairs__select_best(al):
     for i in al:
         km = None
         for k in al[i]:
-            if km is None:
+            # failed and pruned alignments have a nan score
+            if (km is None) or (not N.isfinite(al[i][km]['score'])):
                 km = k
-            if al[i][k]['score'] < al[i][km]['score']:
+                continue
+            if not (al[i][k]['score'] >= al[i][km]['score']):
                 continue
             km = k
         a[i] = al[i][km]
@@ -71,6 +71,44 @@ def peaks_to_subvolumes(v, peaks, subvol_size=32):
     return d
 
 
+def peaks_to_subvolumes__file(path, peaks, subvol_size=32, worker_num=1):
+    """
+    Same result as peaks_to_subvolumes() on the loaded tomogram, but the subvolumes are extracted in batches directly
+    from the tomogram file at path (see aitom.io.mrc.extract), without loading the whole tomogram into memory.
+    """
+    import aitom.io.file as AIF
+    import aitom.io.mrc.extract as AIME
+
+    d = dict()
+    d['v_siz'] = N.array([subvol_size, subvol_size, subvol_size])
+    d['vs'] = {}
+    for p in peaks:
+        d['vs'][p['uuid']] = {'center': p['x'], 'id': p['uuid'], 'v': None}
+
+    with AIF.read_mrc_data_lazy(path) as v:
+        map_siz = N.array(v.shape)
+
+    # cut_from_whole_map() truncates the start c - ceil(subvol_size / 2), and rejects subvolumes that are not
+    # strictly inside the tomogram. extract_batches() rounds the centers, so it is given integer centers that
+    # give the same start
+    h = N.ceil(subvol_size / 2.0)
+    centers = []
+    uuids = []
+    for p in peaks:
+        start = N.array(p['x'], dtype=N.float64) - h
+        if N.any(start < 0) or N.any(start + subvol_size >= map_siz):
+            continue
+        centers.append(N.trunc(start) + h)
+        uuids.append(p['uuid'])
+    if len(centers) == 0:
+        return d
+
+    for b in AIME.extract_batches(path, centers, subvol_size, ids=uuids, worker_num=worker_num):
+        for i, uuid in enumerate(b['ids']):
+            d['vs'][uuid]['v'] = b['vs'][i]
+    return d
+
+
 def read_mrc_numpy_vol(path):
     with mrcfile.open(path) as mrc:
         v = mrc.data
@@ -15,6 +15,7 @@ from tqdm.auto import tqdm
 from torchvision.transforms import Normalize
 
 from aitom.classify.deep.unsupervised.disca.util import *
+from aitom.parallel.multiprocessing.util import run_iterator, run_batch, call_func
 
 import matplotlib.pyplot as plt
 from torch.optim.lr_scheduler import MultiStepLR
@@ -278,74 +279,6 @@ def pickle_dump(o, path, protocol=2):
 
 
 
-def run_iterator(tasks, worker_num=multiprocessing.cpu_count(), verbose=False):
-
-    if verbose:		print('parallel_multiprocessing()', 'start', time.time())
-
-    worker_num = min(worker_num, multiprocessing.cpu_count())
-
-    for i,t in tasks.items():
-        if 'args' not in t:     t['args'] = ()
-        if 'kwargs' not in t:     t['kwargs'] = {}
-        if 'id' not in t:   t['id'] = i
-        assert t['id'] == i
-
-    completed_count = 0 
-    if worker_num > 1:
-
-        pool = Pool(processes = worker_num)
-        pool_apply = []
-        for i,t in tasks.items():
-            aa = pool.apply_async(func=call_func, kwds={'t':t})
-
-            pool_apply.append(aa)
-
-
-        for pa in pool_apply:
-            yield pa.get(99999)
-            completed_count += 1
-
-            if verbose:
-                print('\r', completed_count, '/', len(tasks), end=' ')
-                sys.stdout.flush()
-
-        pool.close()
-        pool.join()
-        del pool
-
-    else:
-
-        for i,t in tasks.items():
-            yield call_func(t)
-            completed_count += 1
-
-            if verbose:
-                print('\r', completed_count, '/', len(tasks), end=' ')
-                sys.stdout.flush()
-	
-    if verbose:		print('parallel_multiprocessing()', 'end', time.time())
-
-
-    
-run_batch = run_iterator #alias
-
-
-
-def call_func(t):
-
-    if 'func' in t:
-        assert 'module' not in t
-        assert 'method' not in t
-        func = t['func']
-    else:
-        modu = importlib.import_module(t['module'])
-        func = getattr(modu, t['method'])
-
-    r = func(*t['args'], **t['kwargs'])
-    return {'id':t['id'], 'result':r}
-
-
-
 def random_rotation_matrix():
     m = np.random.random( (3,3) )
     u,s,v = np.linalg.svd(m)
@@ -404,7 +337,7 @@ def data_augmentation(x_train, factor = 2):
                 t['kwargs'] = args_t                                                  
                 ts[i] = t                                                       
                                                                       
-            rs = run_batch(ts, worker_num=48)
+            rs = run_batch(ts, worker_num=48, ordered=True)
             x_train_f = np.expand_dims(np.array([_['result'] for _ in rs]), -1)
             
             x_train_augmented.append(x_train_f)
@@ -5,65 +5,57 @@ from ..image.vol import util as IVU
 
 
 def rotate(v, angle=None, rm=None, c1=None, c2=None, loc_r=None, siz2=None, default_val=float('NaN')):
+    rm, c, siz2 = affine_params(v.shape, angle=angle, rm=rm, c1=c1, c2=c2, loc_r=loc_r, siz2=siz2)
+    vr = SNI.affine_transform(input=v, matrix=rm, offset=c, output_shape=siz2, cval=default_val)
+    return vr
+
+
+def affine_params(siz1, angle=None, rm=None, c1=None, c2=None, loc_r=None, siz2=None):
+    """the matrix, offset and output shape of scipy.ndimage.affine_transform() for the arguments of rotate()"""
     if angle is not None:
         assert (rm is None)
-        angle = N.array(angle, dtype=N.float).flatten()
+        angle = N.array(angle, dtype=N.float64).flatten()
         rm = AA.rotation_matrix_zyz(angle)
     if rm is None:
-        rm = N.eye(v.ndim)
-    siz1 = N.array(v.shape, dtype=N.float)
+        rm = N.eye(len(siz1))
+    siz1 = N.array(siz1, dtype=N.float64)
     if c1 is None:
         c1 = ((siz1 - 1) / 2.0)
     else:
-        c1 = c1.flatten()
+        c1 = N.array(c1, dtype=N.float64).flatten()
     assert (c1.shape == (3,))
     if siz2 is None:
         siz2 = siz1
-    siz2 = N.array(siz2, dtype=N.float)
+    siz2 = N.array(siz2, dtype=N.float64)
     if c2 is None:
         c2 = ((siz2 - 1) / 2.0)
     else:
-        c2 = c2.flatten()
+        c2 = N.array(c2, dtype=N.float64).flatten()
     assert (c2.shape == (3,))
     if loc_r is not None:
-        loc_r = N.array(loc_r, dtype=N.float).flatten()
+        loc_r = N.array(loc_r, dtype=N.float64).flatten()
         assert (loc_r.shape == (3,))
         c2 += loc_r
     c = ((- rm.dot(c2)) + c1)
-    vr = SNI.affine_transform(input=v, matrix=rm, offset=c, output_shape=siz2.astype(N.int), cval=default_val)
-    return vr
+    return rm, c, tuple(int(_) for _ in siz2)
 
 
 def rotate3d_zyz(data, angle=None, rm=None, center=None, order=2, cval=0.0):
     """Rotate a 3D data using ZYZ convention (phi: z1, the: x, psi: z2)."""
-    from scipy import mgrid
     # Figure out the rotation center
     if center is None:
-        cx = data.shape[0] / 2
-        cy = data.shape[1] / 2
-        cz = data.shape[2] / 2
+        center = N.array(data.shape, dtype=N.float64) / 2
     else:
         assert len(center) == 3
-        (cx, cy, cz) = center
+        center = N.array(center, dtype=N.float64)
 
     if rm is None:
         Inv_R = AA.rotation_matrix_zyz(angle)
     else:
         Inv_R = rm
 
-    grid = mgrid[-cx:data.shape[0] - cx, -cy:data.shape[1] - cy, -cz:data.shape[2] - cz]
-    temp = grid.reshape((3, N.int(grid.size / 3)))
-    temp = N.dot(Inv_R, temp)
-    grid = N.reshape(temp, grid.shape)
-    grid[0] += cx
-    grid[1] += cy
-    grid[2] += cz
-
-    # Interpolation
-    from scipy.ndimage import map_coordinates
-    d = map_coordinates(data, grid, order=order, cval=cval)
-
-    return d
+    # the voxel at x is interpolated at Inv_R (x - center) + center, computed on the fly without a coordinate grid
+    return SNI.affine_transform(data, Inv_R, offset=(center - Inv_R.dot(center)), order=order, cval=cval)
 
 
 def translate3d_zyz(data, dx=0, dy=0, dz=0, order=2, cval=0.0):
@@ -76,21 +68,11 @@ def translate3d_zyz(data, dx=0, dy=0, dz=0, order=2, cval=0.0):
     
     @return: the data after translation.
     """
-    from scipy import mgrid
     if dx == 0 and dy == 0 and dz == 0:
         return data
 
-    # from scipy.ndimage.interpolation import shift
-    # res = shift(data, [dx, dy, dz])
-    # return res
-    grid = mgrid[0.:data.shape[0], 0.:data.shape[1], 0.:data.shape[2]]
-    grid[0] -= dx
-    grid[1] -= dy
-    grid[2] -= dz
-    from scipy.ndimage import map_coordinates
-    d = map_coordinates(data, grid, order=order, cval=cval)
-
-    return d
+    # same as interpolating at the shifted coordinate grid, without building the grid
+    return SNI.shift(data, [dx, dy, dz], order=order, cval=cval)
 
 
 def rotate_interpolate_pad_mean(v, angle=None, rm=None, loc_r=None):
@@ -126,3 +108,117 @@ def rotate_mask(v, angle=None, rm=None):
     vr = rotate(v, angle=angle, rm=rm, c1=c1, c2=c2, default_val=float('NaN'))
     vr[N.logical_not(N.isfinite(vr))] = 0.0
     return vr
+
+
+def rotate_vol_pad_mean(v, angle, loc_r=None):
+    """
+    rotation using the cubic interpolation of the tomominer core, missing values are filled with the mean.
+    float32 volumes are rotated in single precision and stay float32, other volumes are rotated as float64
+    """
+    return core_rotate('rotate_vol_pad_mean', v, angle, loc_r)
+
+
+def rotate_vol_pad_zero(v, angle, loc_r=None):
+    """same as rotate_vol_pad_mean(), missing values are filled with zero"""
+    return core_rotate('rotate_vol_pad_zero', v, angle, loc_r)
+
+
+def rotate_vol_mask(m, angle):
+    """rotation of a mask using the linear interpolation of the tomominer core, negative values are set to zero"""
+    return core_rotate('rotate_mask', m, angle)
+
+
+def core_rotate(op, v, angle, loc_r=None):
+    import aitom.tomominer.core.core as core
+    if v.dtype == N.float32:
+        op += '_float'
+    else:
+        v = v.astype(N.float64, copy=False)
+    args = [N.array(angle, dtype=N.float64).flatten()]
+    if op.startswith('rotate_vol'):
+        args.append(N.zeros(3) if loc_r is None else N.array(loc_r, dtype=N.float64).flatten())
+    return getattr(core, op)(v, *args)
+
+
+def rotate_batch(v, angles=None, locs=None, rms=None, c1=None, c2=None, siz2=None, order=3, fill='mean', dtype=None,
+                 threads=1):
+    """
+    apply many rigid transforms to one volume, with the conventions of rotate(): the i-th output is v rotated by
+    angles[i] (or by the rotation matrix rms[i]) and shifted by locs[i].
+    the spline coefficients of v are computed only once, and shared by all transforms.
+    order: interpolation order, 3 is the cubic spline of rotate(), 1 (linear) is several times faster
+    fill: value of the voxels that come from outside of v, 'mean' (as rotate_pad_mean()), 'zero' (as
+        rotate_pad_zero()), 'nan' (as rotate()) or a number
+    dtype: output dtype, e.g. N.float32 to halve the memory, default is the dtype of v if it is float32 or float64
+    threads: number of threads the transforms are distributed on
+    returns an array of shape (n,) + output shape
+    """
+    n = len(angles) if angles is not None else len(rms)
+    if locs is None:
+        locs = [None] * n
+    dtype = output_dtype(v, dtype)
+    cval = fill_value(v, fill)
+    siz = tuple(v.shape) if siz2 is None else tuple(int(_) for _ in siz2)
+    coef = SNI.spline_filter(v, order=order, output=dtype) if order > 1 else v
+
+    re = N.empty((n,) + siz, dtype=dtype)
+
+    def transform(i):
+        rm, c, _ = affine_params(v.shape, angle=(None if angles is None else angles[i]),
+                                 rm=(None if rms is None else rms[i]), c1=c1, c2=c2, loc_r=locs[i], siz2=siz)
+        SNI.affine_transform(coef, rm, offset=c, output_shape=siz, output=re[i], order=order, cval=cval,
+                             prefilter=False)
+
+    map_threads(transform, range(n), threads)
+    return re
+
+
+def rotate_stack(vs, angle=None, rm=None, loc_r=None, c1=None, c2=None, order=3, fill='mean', dtype=None, threads=1):
+    """
+    apply one rigid transform to every volume of the stack vs (volumes along the first axis), see rotate_batch().
+    with fill='mean', each volume is padded with its own mean
+    """
+    vs = N.asarray(vs)
+    dtype = output_dtype(vs, dtype)
+    rm, c, siz = affine_params(vs.shape[1:], angle=angle, rm=rm, c1=c1, c2=c2, loc_r=loc_r)
+    re = N.empty(vs.shape, dtype=dtype)
+
+    def transform(i):
+        SNI.affine_transform(vs[i], rm, offset=c, output_shape=siz, output=re[i], order=order,
+                             cval=fill_value(vs[i], fill))
+
+    map_threads(transform, range(len(vs)), threads)
+    return re
+
+
+def rotate_mask_batch(m, angles, order=3, dtype=None, threads=1):
+    """rotate_mask() for many angles, the fftshifted mask m is rotated around the zero frequency"""
+    c = IVU.fft_mid_co(m.shape)
+    return rotate_batch(m, angles=angles, c1=c, c2=c, order=order, fill='zero', dtype=dtype, threads=threads)
+
+
+def output_dtype(v, dtype=None):
+    if dtype is not None:
+        return N.dtype(dtype)
+    if v.dtype in (N.float32, N.float64):
+        return v.dtype
+    return N.dtype(N.float64)
+
+
+def fill_value(v, fill):
+    if fill == 'mean':
+        return float(v.mean())
+    if fill == 'zero':
+        return 0.0
+    if fill == 'nan':
+        return float('NaN')
+    return float(fill)
+
+
+def map_threads(f, items, threads=1):
+    """call f on every item, on a pool of threads if threads > 1"""
+    if threads <= 1:
+        return [f(_) for _ in items]
+    from concurrent.futures import ThreadPoolExecutor
+    with ThreadPoolExecutor(threads) as pool:
+        return list(pool.map(f, items))
@@ -23,18 +23,18 @@ class ParticlePicking():
         return max(7 / voxel_spacing_in_nm, 2)
 
     def dump_subvol(self, picking_result):
-        from aitom.classify.deep.unsupervised.autoencoder.autoencoder_util import peaks_to_subvolumes
+        from aitom.classify.deep.unsupervised.autoencoder.autoencoder_util import peaks_to_subvolumes__file
         subvols_loc = os.path.join(self.dump_path, "demo_single_particle_subvolumes.pickle")
-        a = io_file.read_mrc_data(self.path)
-        d = peaks_to_subvolumes(im_vol_util.cub_img(a)['vt'], picking_result, 32)
+        # only the slabs around the peaks are read from the tomogram
+        d = peaks_to_subvolumes__file(self.path, picking_result, 32)
         io_file.pickle_dump(d, subvols_loc)
         print("Save subvolumes .pickle file to:", subvols_loc)
 
-    def view_tomo(self, sigma=2, R=10):
+    def view_tomo(self, sigma=2, R=10, slab_depth=32):
         # d = {v_siz:(32,32,32), vs:{uuid0:{center, v, id}, uuid1:{center, v, id} ... }}
         subvols_loc = os.path.join(self.dump_path, "demo_single_particle_subvolumes.pickle")
         d = io_file.pickle_load(subvols_loc)
-        a = io_file.read_mrc_data(self.path)
+        a = io_file.read_mrc_data_lazy(self.path, dtype=np.float32)
 
         if 'self.centers' not in dir():
             centers = []
@@ -46,14 +46,14 @@ class ParticlePicking():
             self.centers = centers
             self.uuids = uuids
 
-        # denoise
-        a_smooth = smooth(a, sigma)
-
-        for slice_num in range(a_smooth.shape[2]):
+        for slice_num in range(a.shape[2]):
+            # denoise, the smoothed slices are computed one slab at a time
+            if slice_num % slab_depth == 0:
+                a_smooth = smooth_slices(a, sigma, slice_num, min(slice_num + slab_depth, a.shape[2]))
             centers = np.array(centers)
 
             slice_centers = centers[(centers[:, 2] - slice_num) ** 2 < R ** 2]
-            img = a_smooth[:, :, slice_num]
+            img = a_smooth[:, :, slice_num % slab_depth]
             plt.rcParams['figure.figsize'] = (15.0, 12.0)
             fig = plt.figure()
             ax = fig.add_subplot(111)
@@ -64,14 +64,11 @@ class ParticlePicking():
                 circle = plt.Circle((x, y), r, color='b', fill=False)
                 plt.gcf().gca().add_artist(circle)
             ax_u = ax.imshow(img, cmap='gray')
+        a.close()
 
     def view_subtom(self, subvol_num, sigma=2, R=10):
         subvols_loc = os.path.join(self.dump_path, "demo_single_particle_subvolumes.pickle")
         d = io_file.pickle_load(subvols_loc)
-        a = io_file.read_mrc_data(self.path)
-
-        # denoise
-        a_smooth = smooth(a, sigma)
 
         if 'self.centers' not in dir():
             centers = []
@@ -84,7 +81,9 @@ class ParticlePicking():
             self.uuids = uuids
 
         y, x, z = self.centers[subvol_num]
-        img = a_smooth[:, :, z]
+        # denoise, only the slab within the filter radius of slice z is read from the tomogram
+        with io_file.read_mrc_data_lazy(self.path, dtype=np.float32) as a:
+            img = smooth_slices(a, sigma, z, z + 1)[:, :, 0]
         plt.rcParams['figure.figsize'] = (10.0, 8.0)
         fig = plt.figure()
         ax = fig.add_subplot(111)
@@ -121,6 +120,15 @@ class ParticlePicking():
         print("Save subvolumes .pickle file to:", subvols_loc)
 
 
+def smooth_slices(v, sigma, z0, z1):
+    """smooth(v, sigma)[:, :, z0:z1], computed from the slab of v within the filter radius around the slices"""
+    # radius of scipy.ndimage.gaussian_filter with its default truncate=4.0
+    r = int(4.0 * sigma + 0.5)
+    s0 = max(z0 - r, 0)
+    s1 = min(z1 + r, v.shape[2])
+    return smooth(v[:, :, s0:s1], sigma)[:, :, (z0 - s0):(z1 - s0)]
+
+
 def mkdir(path):
     if os.path.exists(path):
         shutil.rmtree(path)
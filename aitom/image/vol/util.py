@@ -30,6 +30,28 @@ def fft_mid_co(siz):
     return mid_co
 
 
+def fourier_crop_slices(siz, siz_c):
+    """the region of a fftshifted spectrum of size siz that is kept by fourier_crop() to size siz_c"""
+    mid = fft_mid_co(siz).astype(int)
+    mid_c = fft_mid_co(siz_c).astype(int)
+    return tuple(slice(mid[i] - mid_c[i], mid[i] - mid_c[i] + siz_c[i]) for i in range(len(siz)))
+
+
+def fourier_crop(v, siz_c):
+    """
+    downsample v to size siz_c by keeping only the low frequencies of its spectrum,
+    the intensities are scaled so that the mean of the volume is preserved
+    """
+    from numpy.fft import fftn, ifftn, fftshift, ifftshift
+    f = fftshift(fftn(v))[fourier_crop_slices(v.shape, siz_c)]
+    return N.real(ifftn(ifftshift(f))) * (float(N.prod(siz_c)) / v.size)
+
+
+def fourier_crop_mask(m, siz_c):
+    """the part of a fftshifted Fourier space mask, e.g. a missing wedge mask, that matches fourier_crop()"""
+    return N.array(m[fourier_crop_slices(m.shape, siz_c)], order='F')
+
+
 def cub_img(v, view_dir=2):
     if view_dir == 0:
         vt = N.transpose(v, [1, 2, 0])
@@ -12,6 +12,17 @@ def read_mrc_data(path, show_progress=False):
     return TIM.read_data(path)
 
 
+def read_mrc_data_lazy(path, dtype=None):
+    """
+    open a tomogram as a lazy, read-only, memory mapped volume.
+    the returned object keeps the (x, y, z) axis convention of read_mrc_data() and supports numpy style
+    slicing, which only reads the touched part of the file. Use it for volumes larger than memory,
+    e.g. v[x0:x1, y0:y1, z0:z1] or cut_from_whole_map(v, c, siz).
+    if dtype is given (e.g. numpy.float32), every slice is converted when accessed.
+    """
+    return TIM.open_data(path, dtype=dtype)
+
+
 def read_mrc_header(path):
     return ATIF.read_mrc(path=path, read_data=False)['header']
 
@@ -0,0 +1,238 @@
+"""
+batched extraction of subtomograms around picked peaks, directly from an mrc file
+
+The tomogram is memory mapped (see aitom.io.file.read_mrc_data_lazy()). Peaks are grouped by the cubic tile of the
+tomogram they fall into, and for each group only the bounding box of the group is read, which is at most
+(tile_size + siz) voxels along every axis. So neither the whole tomogram nor a whole xy slab of it needs to fit in
+memory. Groups are independent tasks that can be processed by a pool of workers. The results can be streamed as
+batches, or written as mrc files or into a pack.
+
+The subvolume of size siz centered at c starts at round(c) - ceil(siz / 2), and subvolumes that are partly outside the
+tomogram are padded. aitom.image.vol.util.cut_from_whole_map() instead truncates c - ceil(siz / 2), and rejects
+subvolumes that reach the last voxel of the tomogram, see
+aitom.classify.deep.unsupervised.autoencoder.autoencoder_util.peaks_to_subvolumes__file() for how to get its results.
+"""
+
+import os
+import uuid
+
+import numpy as N
+
+import aitom.io.file as AIF
+
+
+def extract_batches(path, centers, siz, batch_size=1000, tile_size=None, cval=None, normalize=False, bin=1,
+                    dtype=N.float32, worker_num=1, ids=None):
+    """
+    extract subvolumes of size siz around centers (an (N,3) array) from the tomogram at path.
+
+    parameters:
+        batch_size: max number of subvolumes extracted from one tile
+        tile_size: edge (in voxels) of the cubic tiles the peaks are grouped by, default 4*siz
+        cval: value for the parts outside the tomogram. None pads with the mean of the inside part,
+            NaN marks the subvolume as invalid and leaves the padding as NaN
+        normalize: if True, each subvolume is shifted and scaled to zero mean and unit standard deviation
+        bin: integer binning factor, siz must be divisible by bin
+        worker_num: number of processes, each group of peaks is a separate task
+        ids: optional ids for the centers, default is the row index
+
+    yields batches in the form of {'ids': list, 'centers': (n,3) array, 'vs': (n, s, s, s) array, 'valid': bool array}
+    where s = siz / bin. Batches are yielded in the order they are completed.
+    """
+    tasks = extract_tasks(path=path, centers=centers, siz=siz, batch_size=batch_size, tile_size=tile_size,
+                          cval=cval, normalize=normalize, bin=bin, dtype=dtype, ids=ids)
+    if worker_num <= 1:
+        for t in tasks.values():
+            yield extract_slab(*t['args'], **t['kwargs'])
+        return
+
+    import aitom.parallel.multiprocessing.util as TPMU
+    for r in TPMU.run_iterator(tasks, worker_num=worker_num):
+        yield r['result']
+
+
+def extract(path, centers, siz, **kwargs):
+    """
+    convenience wrapper of extract_batches(), returns a single (n, s, s, s) array in the order of centers,
+    together with the valid flag of each subvolume
+    """
+    centers = N.array(centers, dtype=N.float64)
+    vs = None
+    valid = N.zeros(len(centers), dtype=bool)
+    for b in extract_batches(path=path, centers=centers, siz=siz, ids=list(range(len(centers))), **kwargs):
+        if vs is None:
+            vs = N.zeros((len(centers),) + b['vs'].shape[1:], dtype=b['vs'].dtype)
+        vs[b['ids']] = b['vs']
+        valid[b['ids']] = b['valid']
+    return {'vs': vs, 'valid': valid}
+
+
+def extract_to_dir(path, centers, siz, out_dir, ids=None, mask_path=None, skip_invalid=True, **kwargs):
+    """
+    extract subvolumes and save each of them as an mrc file inside out_dir.
+    returns the records in data_json format, i.e. {'id', 'center', 'subtomogram', 'mask'}
+    """
+    import aitom.tomominer.io.file as TIF
+
+    if not os.path.isdir(out_dir):
+        os.makedirs(out_dir)
+    centers = N.array(centers, dtype=N.float64)
+    if ids is None:
+        ids = [str(uuid.uuid4()) for _ in range(len(centers))]
+
+    dj = []
+    for b in extract_batches(path=path, centers=centers, siz=siz, ids=ids, **kwargs):
+        for i, id_t in enumerate(b['ids']):
+            if skip_invalid and (not b['valid'][i]):
+                continue
+            r = {'id': id_t, 'center': b['centers'][i].tolist()}
+            r['subtomogram'] = os.path.join(out_dir, '%s.mrc' % (id_t,))
+            TIF.put_mrc(b['vs'][i], r['subtomogram'], overwrite=True)
+            if mask_path is not None:
+                r['mask'] = mask_path
+            dj.append(r)
+    return dj
+
+
+def extract_to_pack(path, centers, siz, pack_dir, ids=None, mask=None, skip_invalid=True, compress_level=0,
+                    **kwargs):
+    """
+    extract subvolumes and store them in a pack (see aitom.tomominer.io.pack) instead of one file per subvolume.
+    if mask (a 3D array) is given, it is stored once and referred by every record.
+    returns the records in data_json format, i.e. {'id', 'center', 'subtomogram', 'mask'}
+    """
+    import aitom.tomominer.io.pack as TIP
+
+    centers = N.array(centers, dtype=N.float64)
+    if ids is None:
+        ids = [str(uuid.uuid4()) for _ in range(len(centers))]
+
+    dj = []
+    with TIP.Pack(pack_dir, mode='a', compress_level=compress_level) as p:
+        mask_path = None
+        if mask is not None:
+            mask_path = p.put('mask', mask)
+        for b in extract_batches(path=path, centers=centers, siz=siz, ids=ids, **kwargs):
+            for i, id_t in enumerate(b['ids']):
+                if skip_invalid and (not b['valid'][i]):
+                    continue
+                r = {'id': id_t, 'center': b['centers'][i].tolist()}
+                r['subtomogram'] = p.put(str(id_t), b['vs'][i])
+                if mask_path is not None:
+                    r['mask'] = mask_path
+                dj.append(r)
+            # make finished batches visible to readers
+            p.flush()
+    return dj
+
+
+def extract_tasks(path, centers, siz, batch_size=1000, tile_size=None, ids=None, **kwargs):
+    """
+    group centers by the cubic tiles of size tile_size that contain them, one task per group of at most batch_size
+    centers, in the task format of aitom.parallel.multiprocessing.util
+    """
+    centers = N.array(centers, dtype=N.float64)
+    assert centers.ndim == 2
+    assert centers.shape[1] == 3
+    if ids is None:
+        ids = list(range(len(centers)))
+    assert len(ids) == len(centers)
+    if tile_size is None:
+        tile_size = 4 * siz
+
+    tiles = N.floor(N.round(centers) / tile_size).astype(int)
+    # tiles in z, y, x order, so that consecutive tasks read nearby parts of the file
+    order = N.lexsort((tiles[:, 0], tiles[:, 1], tiles[:, 2]))
+    tasks = {}
+    i = 0
+    while i < len(order):
+        j = i + 1
+        while (j < len(order)) and ((j - i) < batch_size) and N.all(tiles[order[j]] == tiles[order[i]]):
+            j += 1
+        inds = order[i:j]
+        tid = len(tasks)
+        tasks[tid] = {'func': extract_slab,
+                      'args': (path, centers[inds], siz),
+                      'kwargs': dict(ids=[ids[_] for _ in inds], **kwargs)}
+        i = j
+    return tasks
+
+
+def extract_slab(path, centers, siz, ids=None, cval=None, normalize=False, bin=1, dtype=N.float32):
+    """read the bounding box of all subvolumes of one group of extract_tasks(), then cut each subvolume from it"""
+    assert siz % bin == 0
+
+    centers = N.array(centers, dtype=N.float64)
+    n = len(centers)
+    if ids is None:
+        ids = list(range(n))
+
+    starts = N.round(centers).astype(int) - int(N.ceil(siz / 2.0))
+    vs = N.zeros((n, siz // bin, siz // bin, siz // bin), dtype=dtype)
+    valid = N.ones(n, dtype=bool)
+
+    with AIF.read_mrc_data_lazy(path) as v:
+        map_siz = N.array(v.shape)
+
+        # bounding box of the group, clipped to the tomogram
+        b0 = N.maximum(starts.min(axis=0), 0)
+        b1 = N.minimum(starts.max(axis=0) + siz, map_siz)
+        if N.all(b1 > b0):
+            slab = v.read((slice(b0[0], b1[0]), slice(b0[1], b1[1]), slice(b0[2], b1[2])), dtype=dtype)
+        else:
+            slab = None
+
+        for i in range(n):
+            vs[i] = cut_from_slab(slab=slab, slab_start=b0, map_siz=map_siz, start=starts[i], siz=siz, cval=cval,
+                                  normalize=normalize, bin=bin)
+            if not N.all(N.isfinite(vs[i])):
+                valid[i] = False
+
+    return {'ids': ids, 'centers': centers, 'vs': vs, 'valid': valid}
+
+
+def cut_from_slab(slab, slab_start, map_siz, start, siz, cval=None, normalize=False, bin=1):
+    end = start + siz
+    # part of the subvolume inside the tomogram
+    s0 = N.maximum(start, 0)
+    s1 = N.minimum(end, map_siz)
+
+    if (slab is not None) and N.all(s1 > s0):
+        inner = slab[s0[0] - slab_start[0]:s1[0] - slab_start[0],
+                     s0[1] - slab_start[1]:s1[1] - slab_start[1],
+                     s0[2] - slab_start[2]:s1[2] - slab_start[2]]
+    else:
+        inner = None
+
+    if (inner is not None) and (inner.shape == (siz, siz, siz)):
+        vr = N.array(inner, dtype=N.float64)
+    else:
+        if cval is not None:
+            fill = cval
+        elif inner is not None:
+            fill = inner.mean()
+        else:
+            fill = float('NaN')
+        vr = N.full((siz, siz, siz), fill, dtype=N.float64)
+        if inner is not None:
+            d0 = s0 - start
+            d1 = s1 - start
+            vr[d0[0]:d1[0], d0[1]:d1[1], d0[2]:d1[2]] = inner
+
+    if normalize:
+        vr -= vr.mean()
+        sd = vr.std()
+        if sd > 0:
+            vr /= sd
+
+    if bin > 1:
+        vr = bin_vol(vr, bin)
+
+    return vr
+
+
+def bin_vol(v, bin):
+    """average over non-overlapping bin x bin x bin blocks"""
+    s = N.array(v.shape) // bin
+    v = v[:s[0] * bin, :s[1] * bin, :s[2] * bin]
+    return v.reshape(s[0], bin, s[1], bin, s[2], bin).mean(axis=(1, 3, 5))
@@ -19,15 +19,84 @@ def read(path):
 
 
 def read_data(path):
-    mrc = mrcfile.open(path, mode='r+', permissive=True)
-    a = mrc.data
-    assert a.shape[0] > 0
-    a = a.astype(np.float32)
-    a = a.transpose([2, 1, 0])
+    with mrcfile.open(path, mode='r', permissive=True) as mrc:
+        a = mrc.data
+        assert a.shape[0] > 0
+        a = a.astype(np.float32)
+        a = a.transpose([2, 1, 0])
 
     return a
 
 
+class MrcVolume(object):
+    """
+    lazy, read-only, memory mapped access to the 3D volume of an mrc file.
+    the axes follow the same (x, y, z) convention as read_data(), so that v[x0:x1, y0:y1, z0:z1] gives the
+    same values as read_data(path)[x0:x1, y0:y1, z0:z1], but only the pages touched by the slice are read.
+    if dtype is given, each slice is converted to dtype when it is accessed, otherwise the stored dtype is kept
+    and the returned arrays are read-only views of the file.
+    """
+
+    def __init__(self, path, dtype=None):
+        self.path = path
+        self.dtype = None if dtype is None else np.dtype(dtype)
+        self.mrc = mrcfile.mmap(path, mode='r', permissive=True)
+        # only for 3D array
+        assert self.mrc.data.ndim == 3
+        # transpose is only a view, no data is read here
+        self.data = self.mrc.data.transpose([2, 1, 0])
+
+    @property
+    def shape(self):
+        return self.data.shape
+
+    @property
+    def ndim(self):
+        return self.data.ndim
+
+    @property
+    def size(self):
+        return self.data.size
+
+    @property
+    def header(self):
+        return self.mrc.header
+
+    @property
+    def voxel_size(self):
+        return self.mrc.voxel_size
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, key):
+        return self.read(key, dtype=self.dtype)
+
+    def read(self, key=Ellipsis, dtype=None):
+        """read the region given by key, optionally converting it to dtype"""
+        a = self.data[key]
+        if dtype is not None:
+            a = np.asarray(a, dtype=dtype)
+        return a
+
+    def __array__(self, dtype=None, copy=None):
+        # materializes the whole volume, use slicing whenever possible
+        return np.array(self.read(dtype=(self.dtype if dtype is None else dtype)))
+
+    def close(self):
+        self.mrc.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def open_data(path, dtype=None):
+    return MrcVolume(path=path, dtype=dtype)
+
+
 def read_header(path):
     from mrcfile.mrcinterpreter import MrcInterpreter
 
@@ -0,0 +1,83 @@
+"""
+passing objects between local processes through shared memory
+
+An object is pickled with protocol 5, large contiguous buffers inside it (e.g. numpy arrays) are kept out of band and
+copied into shared memory blocks, so that only the pickle stream and the block names go through the pool pipe.
+The receiving side maps a block, unlinks its name right away, and the unpickled arrays use the mapping as their
+memory, so the block is freed together with the last array that refers to it.
+"""
+
+import os
+import mmap
+import pickle
+from multiprocessing import shared_memory, resource_tracker
+
+SHM_DIR = '/dev/shm'
+
+
+def shm_dumps(obj, shm_min_bytes):
+    """
+    pickle obj, buffers of at least shm_min_bytes are put into shared memory.
+    the result must be passed to exactly one of shm_loads() or shm_free(), otherwise the blocks leak
+    """
+    buffers = []
+    payload = pickle.dumps(obj, protocol=5, buffer_callback=buffers.append)
+    bs = []
+    for b in buffers:
+        v = b.raw()
+        if v.nbytes >= shm_min_bytes:
+            bs.append(('shm', shm_put(v), v.nbytes))
+        else:
+            bs.append(('inline', v.tobytes(), v.nbytes))
+    return payload, bs
+
+
+def shm_loads(d):
+    payload, bs = d
+    buffers = [(shm_attach(name, size) if kind == 'shm' else bytearray(name)) for kind, name, size in bs]
+    return pickle.loads(payload, buffers=buffers)
+
+
+def shm_free(d):
+    """release the blocks of a shm_dumps() result that is not going to be loaded"""
+    payload, bs = d
+    for kind, name, size in bs:
+        if kind != 'shm':
+            continue
+        path = os.path.join(SHM_DIR, name.lstrip('/'))
+        if os.path.isfile(path):
+            os.unlink(path)
+            continue
+        try:
+            shm = shared_memory.SharedMemory(name=name)
+        except FileNotFoundError:
+            continue
+        shm.close()
+        shm.unlink()
+
+
+def shm_put(v):
+    """copy a buffer into a new shared memory block, the receiver of the block name is responsible for freeing it"""
+    shm = shared_memory.SharedMemory(create=True, size=v.nbytes)
+    shm.buf[:v.nbytes] = v
+    # the block outlives this process, do not let the resource tracker remove it at exit
+    resource_tracker.unregister(shm._name, 'shared_memory')
+    name = shm.name
+    shm.close()
+    return name
+
+
+def shm_attach(name, size):
+    """map a block created by shm_put() and unlink it, the mapping lives as long as the arrays that use it"""
+    path = os.path.join(SHM_DIR, name.lstrip('/'))
+    if os.path.isfile(path):
+        with open(path, 'r+b') as f:
+            m = mmap.mmap(f.fileno(), size)
+        os.unlink(path)
+        return m
+    # no file system view of shared memory on this platform, copy the block
+    shm = shared_memory.SharedMemory(name=name)
+    b = bytearray(shm.buf[:size])
+    shm.close()
+    shm.unlink()
+    return b
@@ -2,62 +2,55 @@
 utility functions for multi processing
 """
 
+import atexit
 import importlib
 import multiprocessing
+import queue
 import sys
 import time
 from multiprocessing.pool import Pool
 import random
 
+from aitom.parallel.multiprocessing.shm import shm_dumps, shm_loads, shm_free
 
-def run_iterator(tasks, worker_num=multiprocessing.cpu_count(), verbose=False):
+
+def run_iterator(tasks, worker_num=multiprocessing.cpu_count(), verbose=False, max_in_flight=None, chunk_size=1,
+                 ordered=False, shm_min_bytes=2 ** 20, persistent=True):
     """
-    given a list of tasks, using multiprocessing to run and collect results
+    given a dict (or an iterable) of tasks, using multiprocessing to run them and collect results
     if worker_num <= 1, just go for single processing
+
+    the results, in the form of {'id', 'result'}, are yielded as soon as they complete,
+    or in the order of the tasks if ordered=True.
+    see Executor.run_iterator() for max_in_flight, chunk_size and shm_min_bytes.
+    if persistent, the process pool is kept and reused by later calls with the same worker_num, see get_executor()
     """
     if verbose:
         print('tomominer.parallel.multiprocessing.util.run_iterator()', 'start', time.time())
 
     worker_num = min(worker_num, multiprocessing.cpu_count())
 
-    for i, t in tasks.items():
-        if 'args' not in t:
-            t['args'] = ()
-        if 'kwargs' not in t:
-            t['kwargs'] = {}
-        if 'id' not in t:
-            t['id'] = i
-        assert t['id'] == i
-
-    completed_count = 0
     if worker_num > 1:
-        pool = Pool(processes=worker_num)
-        pool_apply = []
-        for i, t in tasks.items():
-            # aa = pool.apply_async(func=t['func'], args=t['args'], kwds=t['kwargs'])
-            aa = pool.apply_async(func=call_func, kwds={'t': t})
-
-            pool_apply.append(aa)
-
-        for pa in pool_apply:
-            yield pa.get(99999)
-            completed_count += 1
-
-            if verbose:
-                print('\r', completed_count, '/', len(tasks), end=' ')
-                sys.stdout.flush()
-
-        pool.close()
-        pool.join()
-        del pool
+        if persistent:
+            executor = get_executor(worker_num)
+        else:
+            executor = Executor(worker_num)
+        try:
+            for r in executor.run_iterator(tasks, max_in_flight=max_in_flight, chunk_size=chunk_size,
+                                           ordered=ordered, shm_min_bytes=shm_min_bytes, verbose=verbose):
+                yield r
+        finally:
+            if not persistent:
+                executor.close()
 
     else:
-        for i, t in tasks.items():
+        completed_count = 0
+        for t in prepare_tasks(tasks):
             yield call_func(t)
             completed_count += 1
 
             if verbose:
-                print('\r', completed_count, '/', len(tasks), end=' ')
+                print('\r', completed_count, end=' ')
                 sys.stdout.flush()
 
     if verbose:
@@ -68,6 +61,146 @@ def run_iterator(tasks, worker_num=multiprocessing.cpu_count(), verbose=False):
 run_batch = run_iterator
 
 
+def prepare_tasks(tasks):
+    """fill in the default args, kwargs and id of the tasks, which are consumed lazily if not given as a dict"""
+    items = tasks.items() if isinstance(tasks, dict) else enumerate(tasks)
+    for i, t in items:
+        if 'args' not in t:
+            t['args'] = ()
+        if 'kwargs' not in t:
+            t['kwargs'] = {}
+        if 'id' not in t:
+            t['id'] = i
+        if isinstance(tasks, dict):
+            assert t['id'] == i
+        yield t
+
+
+def chunk_tasks(tasks, chunk_size):
+    chunk = []
+    for t in tasks:
+        chunk.append(t)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if len(chunk) > 0:
+        yield chunk
+
+
+class Executor:
+    """a process pool that is kept between run_iterator() calls, so that the pool startup is paid only once"""
+
+    def __init__(self, worker_num=multiprocessing.cpu_count()):
+        self.worker_num = worker_num
+        self.pool = Pool(processes=worker_num)
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def submit(self, i, chunk, shm_min_bytes, done):
+        d = shm_dumps(chunk, shm_min_bytes)
+        self.pool.apply_async(func=call_chunk, args=(d, shm_min_bytes), callback=(lambda r: done.put((i, r))),
+                              error_callback=(lambda e: done.put((i, e))))
+
+    def run_iterator(self, tasks, max_in_flight=None, chunk_size=1, ordered=False, shm_min_bytes=2 ** 20,
+                     verbose=False):
+        """
+        tasks are sent to the pool in chunks of chunk_size tasks, a chunk is executed by one process.
+        at most max_in_flight chunks (default 2 * worker_num) are submitted and not yet yielded, and tasks are only
+        pickled when their chunk is submitted, so the memory use does not grow with the number of tasks.
+        numpy arrays of at least shm_min_bytes, in task arguments and results, are passed through shared memory.
+        if a task raises, its exception is raised here once the chunks still running have finished
+        """
+        if max_in_flight is None:
+            max_in_flight = 2 * self.worker_num
+
+        chunks = chunk_tasks(prepare_tasks(tasks), chunk_size)
+        done = queue.Queue()
+        submitted_count = 0
+        # chunks submitted and not yet yielded, and chunks still inside the pool
+        in_flight = 0
+        running = 0
+        # in ordered mode, completed chunks waiting for an earlier one
+        pending = {}
+        next_chunk = 0
+        completed_count = 0
+        try:
+            while True:
+                while in_flight < max_in_flight:
+                    chunk = next(chunks, None)
+                    if chunk is None:
+                        break
+                    self.submit(submitted_count, chunk, shm_min_bytes, done)
+                    submitted_count += 1
+                    in_flight += 1
+                    running += 1
+
+                if in_flight == 0:
+                    break
+
+                i, r = done.get()
+                running -= 1
+                if isinstance(r, BaseException):
+                    raise r
+                pending[i] = shm_loads(r)
+
+                while len(pending) > 0:
+                    if ordered:
+                        if next_chunk not in pending:
+                            break
+                        i = next_chunk
+                        next_chunk += 1
+                    rs = pending.pop(i)
+                    for r in rs:
+                        yield r
+                    in_flight -= 1
+                    completed_count += len(rs)
+
+                    if verbose:
+                        print('\r', completed_count, end=' ')
+                        sys.stdout.flush()
+        finally:
+            # a task failed or the caller stopped early, release the results of the chunks still running
+            while running > 0:
+                i, r = done.get()
+                running -= 1
+                if not isinstance(r, BaseException):
+                    shm_free(r)
+
+
+executors = {}
+
+
+def get_executor(worker_num=multiprocessing.cpu_count()):
+    """the persistent Executor of worker_num processes, created at the first call"""
+    if (worker_num not in executors) or (executors[worker_num].pool is None):
+        executors[worker_num] = Executor(worker_num)
+    return executors[worker_num]
+
+
+def close_executors():
+    for e in executors.values():
+        e.close()
+    executors.clear()
+
+
+atexit.register(close_executors)
+
+
+def call_chunk(d, shm_min_bytes):
+    """run a chunk of tasks encoded by shm_dumps(), inside a pool process"""
+    return shm_dumps([call_func(t) for t in shm_loads(d)], shm_min_bytes)
+
+
 def call_func(t):
     '''
     Generate random seeds for numpy, so that different cores have different random seeds, see
@@ -0,0 +1,134 @@
+'''
+Accumulator for Fourier space averaging of aligned subtomograms.
+
+Every subtomogram v is rotated with its alignment (angle, loc) and added to vol_sum, its missing wedge mask m is rotated
+and added to mask_sum. The average divides, in Fourier space, the coefficients of vol_sum by mask_sum where at least
+mask_count_threshold subtomograms have observed them, the other coefficients are set to zero.
+
+The state is only the two sums and the number of subtomograms, so an accumulator is small to pickle and the partial
+accumulators of different tasks can be merged by adding them (merge(), +=, or the 'add' op of
+parallel.reduce.run__reduce() on to_dict()). remove() takes a subtomogram out again, e.g. for leave one out averages, or
+to move a subtomogram between two clusters without averaging them again from scratch.
+
+usage:
+    a = VolumeAccumulator()
+    for d in dj:        a.add(v=img_db[d['subtomogram']], m=img_db[d['mask']], angle=d['angle'], loc=d['loc'])
+    avg = a.average(mask_count_threshold=op['mask_count_threshold'])
+'''
+
+import numpy as N
+import numpy.fft as NF
+
+import aitom.geometry.rotate as GR
+
+
+class VolumeAccumulator:
+
+    def __init__(self, vol_sum=None, mask_sum=None, count=0):
+        self.vol_sum = vol_sum
+        self.mask_sum = mask_sum
+        self.count = count
+
+    def rotate(self, v, m, angle, loc=None):
+        v_r = GR.rotate_pad_mean(v, angle=angle, loc_r=loc)
+        assert N.all(N.isfinite(v_r))
+        m_r = GR.rotate_mask(m, angle=angle)
+        assert N.all(N.isfinite(m_r))
+        return (v_r, m_r)
+
+    def add_rotated(self, v_r, m_r, weight=1):
+        '''add a subtomogram and a mask that are already rotated, weight=(-1) removes them'''
+        if (self.vol_sum is None):
+            self.vol_sum = N.zeros(v_r.shape, dtype=N.float64, order='F')
+            self.mask_sum = N.zeros(m_r.shape, dtype=N.float64, order='F')
+        if (weight == 1):
+            self.vol_sum += v_r
+            self.mask_sum += m_r
+        elif (weight == (-1)):
+            self.vol_sum -= v_r
+            self.mask_sum -= m_r
+        else:
+            self.vol_sum += (weight * v_r)
+            self.mask_sum += (weight * m_r)
+        self.count += weight
+
+    def add(self, v, m, angle, loc=None):
+        (v_r, m_r) = self.rotate(v, m, angle=angle, loc=loc)
+        self.add_rotated(v_r, m_r)
+
+    def remove(self, v, m, angle, loc=None):
+        '''take out a subtomogram that has been added with the same alignment'''
+        (v_r, m_r) = self.rotate(v, m, angle=angle, loc=loc)
+        self.add_rotated(v_r, m_r, weight=(-1))
+
+    def add_batch(self, items, threads=1):
+        '''add the (v, m, angle, loc) tuples of items, rotating threads of them at a time'''
+        items = list(items)
+        n = max(threads, 1)
+        # at most n rotated subtomograms are held at a time
+        for i in range(0, len(items), n):
+            for (v_r, m_r) in GR.map_threads((lambda _: self.rotate(*_)), items[i:(i + n)], threads=threads):
+                self.add_rotated(v_r, m_r)
+
+    def merge(self, other, weight=1):
+        '''add the sums of another accumulator, weight=(-1) subtracts them'''
+        if (other.vol_sum is None):
+            return self
+        if (self.vol_sum is None):
+            self.vol_sum = N.zeros(other.vol_sum.shape, dtype=N.float64, order='F')
+            self.mask_sum = N.zeros(other.mask_sum.shape, dtype=N.float64, order='F')
+        self.vol_sum += (weight * other.vol_sum)
+        self.mask_sum += (weight * other.mask_sum)
+        self.count += (weight * other.count)
+        return self
+
+    def __iadd__(self, other):
+        return self.merge(other)
+
+    def __isub__(self, other):
+        return self.merge(other, weight=(-1))
+
+    def copy(self):
+        if (self.vol_sum is None):
+            return VolumeAccumulator()
+        return VolumeAccumulator(vol_sum=self.vol_sum.copy(order='F'), mask_sum=self.mask_sum.copy(order='F'), count=self.count)
+
+    def to_dict(self):
+        return {'vol_sum': self.vol_sum, 'mask_sum': self.mask_sum, 'vol_count': self.count, }
+
+    @staticmethod
+    def from_dict(d):
+        return VolumeAccumulator(vol_sum=d['vol_sum'], mask_sum=d['mask_sum'], count=d['vol_count'])
+
+    def __getstate__(self):
+        return self.to_dict()
+
+    def __setstate__(self, d):
+        self.vol_sum = d['vol_sum']
+        self.mask_sum = d['mask_sum']
+        self.count = d['vol_count']
+
+    def average_vol(self, mask_count_threshold):
+        '''the Fourier space average, None if no coefficient has been observed mask_count_threshold times'''
+        ind = (self.mask_sum >= mask_count_threshold)
+        if (ind.sum() <= 0):
+            return None
+        vol_sum_fft = NF.fftshift(NF.fftn(self.vol_sum))
+        avg = N.zeros(vol_sum_fft.shape, dtype=N.complex128)
+        avg[ind] = (vol_sum_fft[ind] / self.mask_sum[ind])
+        return N.real(NF.ifftn(NF.ifftshift(avg)))
+
+    def average(self, mask_count_threshold):
+        '''{'v': the average, 'm': the average of the rotated masks}, or None, see average_vol()'''
+        if (self.vol_sum is None):
+            return None
+        avg = self.average_vol(mask_count_threshold)
+        if (avg is None):
+            return None
+        return {'v': avg, 'm': (self.mask_sum / float(self.count)), }
+
+    def leave_one_out(self, v, m, angle, loc=None, mask_count_threshold=1):
+        '''the average without one of the added subtomograms, the accumulator is not changed'''
+        a = self.copy()
+        a.remove(v, m, angle=angle, loc=loc)
+        return a.average(mask_count_threshold)
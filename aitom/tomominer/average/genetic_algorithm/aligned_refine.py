@@ -8,38 +8,25 @@ import json
 import os
 import pickle as pickle
 
-import aitom.geometry.rotate as GR
 import numpy as N
-import numpy.fft as NF
 
 import aitom.tomominer.io.file as IF
+from aitom.tomominer.average.accumulator import VolumeAccumulator
 import aitom.tomominer.pursuit.multi.pattern_generate.genetic_algorithm_ssnr_fsc as PMPG
 
 
 def average(dj, mask_count_threshold):
-    vol_sum = None
-    mask_sum = None
+    a = VolumeAccumulator()
     for d in dj:
         v = IF.read_mrc_vol(d['subtomogram'])
         if not N.all(N.isfinite(v)):
             raise Exception('error loading', d['subtomogram'])
-        vm = IF.read_mrc_vol(d['mask'])
-        v_r = GR.rotate_pad_mean(v, angle=d['angle'], loc_r=d['loc'])
-        assert N.all(N.isfinite(v_r))
-        vm_r = GR.rotate_mask(vm, angle=d['angle'])
-        assert N.all(N.isfinite(vm_r))
-        if vol_sum is None:
-            vol_sum = N.zeros(v_r.shape, dtype=N.float64, order='F')
-        vol_sum += v_r
-        if mask_sum is None:
-            mask_sum = N.zeros(vm_r.shape, dtype=N.float64, order='F')
-        mask_sum += vm_r
-    ind = (mask_sum >= mask_count_threshold)
-    vol_sum_fft = NF.fftshift(NF.fftn(vol_sum))
-    avg = N.zeros(vol_sum_fft.shape, dtype=N.complex)
-    avg[ind] = (vol_sum_fft[ind] / mask_sum[ind])
-    avg = N.real(NF.ifftn(NF.ifftshift(avg)))
-    return {'v': avg, 'm': (mask_sum / len(dj)), }
+        a.add(v=v, m=IF.read_mrc_vol(d['mask']), angle=d['angle'], loc=d['loc'])
+    re = a.average(mask_count_threshold=mask_count_threshold)
+    if re is None:
+        raise Exception('no Fourier coefficient observed by at least', mask_count_threshold, 'of the', len(dj),
+                        'selected subtomograms')
+    return re
 
 
 def main():
@@ -2,5 +2,5 @@
 #from aitom.tomominer.core.core import *
 from core import *
 del core
-__all__ = ['combined_search', 'write_mrc', 'read_mrc', 'rotate_vol_pad_mean', 'rotate_vol_pad_zero', 'rotate_mask', 'ac_distance_transform_3d', 'ac_div_AOS_3D', 'connected_regions', 'local_max_angles', 'rot_search_cor', 'segment_boundary', 'vol_label_count', 'watershed_segmentation', 'zy_binary_boundary_detection']
+__all__ = ['combined_search', 'combined_search_batch', 'write_mrc', 'read_mrc', 'rotate_vol_pad_mean', 'rotate_vol_pad_zero', 'rotate_mask', 'combined_search_float', 'combined_search_batch_float', 'write_mrc_float', 'read_mrc_float', 'rotate_vol_pad_mean_float', 'rotate_vol_pad_zero_float', 'rotate_mask_float', 'rot_search_cor_float', 'ac_distance_transform_3d', 'ac_div_AOS_3D', 'connected_regions', 'local_max_angles', 'rot_search_cor', 'segment_boundary', 'vol_label_count', 'watershed_segmentation', 'zy_binary_boundary_detection', 'fft_plan_rigor', 'fft_plan_cache_clear', 'fft_plan_cache_size', 'fft_wisdom_export', 'fft_wisdom_import', 'set_num_threads', 'get_num_threads']
 
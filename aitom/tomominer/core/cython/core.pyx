@@ -1,20 +1,40 @@
+import os
 import numpy as np
 cimport numpy as np
 cimport cython
 
 from libcpp.string cimport string
+from libcpp cimport bool
 
 cdef extern from "wrap_core.hpp":
     cdef void wrap_write_mrc(double *, unsigned int, unsigned int, unsigned int, string) except +
     cdef void *wrap_read_mrc(string, double **, unsigned int *, unsigned int *, unsigned int *) except +
-    cdef void *wrap_combined_search(unsigned int, unsigned int, unsigned int, double *, double *, double *, double *, unsigned int, unsigned int *, double **) except +
-    cdef void *wrap_rot_search_cor(unsigned int n_r, unsigned int n_c, unsigned int n_s, double *v1_data, double *v2_data, unsigned int n_radii, double *radii_data, unsigned int L, unsigned int *n_cor_r, unsigned int *n_cor_c, unsigned int *n_cor_s, double **cor) except +
-    cdef void *wrap_local_max_angles(unsigned int n_r, unsigned int n_c, unsigned int n_s, double *cor_data, unsigned int peak_spacing, unsigned int *n_res, double **res_data) except +
-    cdef void wrap_rotate_vol_pad_mean(unsigned int, unsigned int, unsigned int, double *, double *, double *, double *) except +
-    cdef void wrap_rotate_vol_pad_zero(unsigned int, unsigned int, unsigned int, double *, double *, double *, double *) except +
-    cdef void wrap_rotate_mask(unsigned int, unsigned int, unsigned int, double *, double *, double *) except +
+    cdef void *wrap_combined_search(unsigned int, unsigned int, unsigned int, double *, double *, double *, double *, unsigned int, unsigned int *, double **) except + nogil
+    cdef void *wrap_combined_search_batch(unsigned int, unsigned int, unsigned int, unsigned int, double *, double *, unsigned int, double *, double *, unsigned int, unsigned int, unsigned int *, double **) except + nogil
+    cdef void *wrap_rot_search_cor(unsigned int n_r, unsigned int n_c, unsigned int n_s, double *v1_data, double *v2_data, unsigned int n_radii, double *radii_data, unsigned int L, unsigned int *n_cor_r, unsigned int *n_cor_c, unsigned int *n_cor_s, double **cor) except + nogil
+    cdef void *wrap_local_max_angles(unsigned int n_r, unsigned int n_c, unsigned int n_s, double *cor_data, unsigned int peak_spacing, unsigned int *n_res, double **res_data) except + nogil
+    cdef void wrap_rotate_vol_pad_mean(unsigned int, unsigned int, unsigned int, double *, double *, double *, double *) except + nogil
+    cdef void wrap_rotate_vol_pad_zero(unsigned int, unsigned int, unsigned int, double *, double *, double *, double *) except + nogil
+    cdef void wrap_rotate_mask(unsigned int, unsigned int, unsigned int, double *, double *, double *) except + nogil
+    cdef void wrap_write_mrc_float(float *, unsigned int, unsigned int, unsigned int, string) except +
+    cdef void *wrap_read_mrc_float(string, float **, unsigned int *, unsigned int *, unsigned int *) except +
+    cdef void *wrap_combined_search_float(unsigned int, unsigned int, unsigned int, float *, float *, float *, float *, unsigned int, unsigned int *, double **) except + nogil
+    cdef void *wrap_combined_search_batch_float(unsigned int, unsigned int, unsigned int, unsigned int, float *, float *, unsigned int, float *, float *, unsigned int, unsigned int, unsigned int *, double **) except + nogil
+    cdef void *wrap_rot_search_cor_float(unsigned int n_r, unsigned int n_c, unsigned int n_s, float *v1_data, float *v2_data, unsigned int n_radii, double *radii_data, unsigned int L, unsigned int *n_cor_r, unsigned int *n_cor_c, unsigned int *n_cor_s, double **cor) except + nogil
+    cdef void wrap_rotate_vol_pad_mean_float(unsigned int, unsigned int, unsigned int, float *, double *, double *, float *) except + nogil
+    cdef void wrap_rotate_vol_pad_zero_float(unsigned int, unsigned int, unsigned int, float *, double *, double *, float *) except + nogil
+    cdef void wrap_rotate_mask_float(unsigned int, unsigned int, unsigned int, float *, double *, float *) except + nogil
     cdef void wrap_del_cube(void *c) except +
+    cdef void wrap_del_fcube(void *c) except +
     cdef void wrap_del_mat(void *c) except +
+    cdef void wrap_fft_set_plan_rigor(string rigor) except +
+    cdef string wrap_fft_get_plan_rigor() except +
+    cdef void wrap_fft_plan_cache_clear() except +
+    cdef size_t wrap_fft_plan_cache_size() except +
+    cdef bool wrap_fft_wisdom_export(string filename) except +
+    cdef bool wrap_fft_wisdom_import(string filename) except +
+    cdef void wrap_set_num_threads(int n) except +
+    cdef int wrap_get_num_threads() except +
     cdef void wrap_ac_distance_transform_3d(const unsigned int n_r, const unsigned int n_c, const unsigned int n_s, const char *lbl_v, double *dist_v) except +
     cdef void wrap_BinaryBoundaryDetection(char *pI, int width, int height, int depth, int type, char *pOut) except + 
     cdef void wrap_ac_div_AOS_3D_dll(const unsigned int* dims, double *g_v, double *phi_v, double *phi_n_v, const double delta_t) except +
@@ -44,7 +64,7 @@ def write_mrc(np.ndarray[np.double_t, ndim=3] vol, str filename):
     n_c = vol.shape[1]
     n_s = vol.shape[2]
 
-    wrap_write_mrc(vol_data, n_r, n_c, n_s, filename)
+    wrap_write_mrc(vol_data, n_r, n_c, n_s, filename.encode())
     return
 
 @cython.boundscheck(False)
@@ -59,7 +79,7 @@ def read_mrc(str filename):
     cdef np.ndarray[np.double_t, ndim=3] vol
     cdef void *cube_ptr
 
-    cube_ptr = wrap_read_mrc(filename, &v_data, &n_r, &n_c, &n_s)
+    cube_ptr = wrap_read_mrc(filename.encode(), &v_data, &n_r, &n_c, &n_s)
 
     vol = np.empty( (n_r, n_c, n_s), dtype=np.double, order='F')
 
@@ -74,6 +94,51 @@ def read_mrc(str filename):
     return vol
 
 
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def write_mrc_float(np.ndarray[np.float32_t, ndim=3] vol, str filename):
+    """
+    single precision write_mrc(), the float32 values are written without conversion
+    """
+
+    if not vol.flags.f_contiguous:
+        vol = vol.copy(order='F')
+
+    cdef float *vol_data = <float *>vol.data
+    cdef unsigned int n_r = vol.shape[0]
+    cdef unsigned int n_c = vol.shape[1]
+    cdef unsigned int n_s = vol.shape[2]
+
+    wrap_write_mrc_float(vol_data, n_r, n_c, n_s, filename.encode())
+    return
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def read_mrc_float(str filename):
+    """
+    single precision read_mrc(), returns the float32 values of the file as a float32 array
+    """
+
+    cdef float *v_data
+    cdef unsigned int n_r, n_c, n_s
+    cdef np.ndarray[np.float32_t, ndim=3] vol
+    cdef void *cube_ptr
+
+    cube_ptr = wrap_read_mrc_float(filename.encode(), &v_data, &n_r, &n_c, &n_s)
+
+    vol = np.empty( (n_r, n_c, n_s), dtype=np.float32, order='F')
+
+    cdef float *np_data = <float*> vol.data
+
+    cdef size_t i
+    for i in range(n_r*n_c*n_s):
+        np_data[i] = v_data[i]
+
+    wrap_del_fcube(cube_ptr)
+
+    return vol
+
+
 @cython.boundscheck(False)
 @cython.wraparound(False)
 def combined_search(np.ndarray[np.double_t, ndim=3] vol1, np.ndarray[np.double_t, ndim=3] mask1, np.ndarray[np.double_t, ndim=3] vol2, np.ndarray[np.double_t, ndim=3] mask2, unsigned int L):
@@ -116,9 +181,60 @@ def combined_search(np.ndarray[np.double_t, ndim=3] vol1, np.ndarray[np.double_t
     n_c = vol1.shape[1]
     n_s = vol1.shape[2]
 
-    mat_ptr = wrap_combined_search(n_r, n_c, n_s, v1_data, m1_data, v2_data, m2_data, L, &n_res, &res_data)
+    with nogil:
+        mat_ptr = wrap_combined_search(n_r, n_c, n_s, v1_data, m1_data, v2_data, m2_data, L, &n_res, &res_data)
+
+
+    res = np.empty( (n_res, 7), dtype=np.double, order='F')
+
+    cdef double *np_data = <double*> res.data
+
+    cdef size_t i
+    for i in range(n_res*7):
+        np_data[i] = res_data[i]
+
+    wrap_del_mat(mat_ptr)
+
+    R = []
+
+    for i in range(n_res):
+        R.append((res[i,0], np.array(res[i,1:4]), np.array(res[i,4:])))
+    return R
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def combined_search_float(np.ndarray[np.float32_t, ndim=3] vol1, np.ndarray[np.float32_t, ndim=3] mask1, np.ndarray[np.float32_t, ndim=3] vol2, np.ndarray[np.float32_t, ndim=3] mask2, unsigned int L):
+    """
+    single precision combined_search(). The volumes, their FFTs and the translational search stay in float32,
+    the rotational search is done in double. Returns the same format as combined_search().
+    """
+
+    if vol1.max() == vol1.min():    raise RuntimeError('vol1.max() == vol1.min()')          # in such case, the alignment will stuck
+    if vol2.max() == vol2.min():    raise RuntimeError('vol2.max() == vol2.min()')          # in such case, the alignment will stuck
 
+    if not vol1.flags.f_contiguous:     vol1 = vol1.copy(order='F')
+    if not mask1.flags.f_contiguous:    mask1 = mask1.copy(order='F')
+    if not vol2.flags.f_contiguous:     vol2 = vol2.copy(order='F')
+    if not mask2.flags.f_contiguous:    mask2 = mask2.copy(order='F')
 
+    cdef float *v1_data = <float *> vol1.data
+    cdef float *m1_data = <float *>mask1.data
+    cdef float *v2_data = <float *> vol2.data
+    cdef float *m2_data = <float *>mask2.data
+
+    cdef unsigned int n_r = vol1.shape[0]
+    cdef unsigned int n_c = vol1.shape[1]
+    cdef unsigned int n_s = vol1.shape[2]
+
+    cdef double *res_data
+    cdef unsigned int n_res
+    cdef void   *mat_ptr
+
+    with nogil:
+        mat_ptr = wrap_combined_search_float(n_r, n_c, n_s, v1_data, m1_data, v2_data, m2_data, L, &n_res, &res_data)
+
+    cdef np.ndarray[np.double_t, ndim=2] res
     res = np.empty( (n_res, 7), dtype=np.double, order='F')
 
     cdef double *np_data = <double*> res.data
@@ -139,6 +255,111 @@ def combined_search(np.ndarray[np.double_t, ndim=3] vol1, np.ndarray[np.double_t
 
 
 
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def combined_search_batch(np.ndarray[np.double_t, ndim=4] vol1s, np.ndarray[np.double_t, ndim=4] mask1s, np.ndarray[np.double_t, ndim=4] vol2s, np.ndarray[np.double_t, ndim=4] mask2s, unsigned int L, unsigned int top_n=0):
+    """
+    combined_search() of every pair (vol1s[:,:,:,i], vol2s[:,:,:,j]), the volumes are stacked along the last axis.
+    The FFT and spherical harmonic expansions of every volume are computed only once, so aligning one subtomogram
+    against K templates, or K subtomograms against one template, costs much less than K calls of combined_search().
+
+    returns R[i][j], an (n, 7) array of the best top_n (all if top_n == 0) transformations of the pair, each row is
+    (score, loc, angle), in decreasing order of score
+    """
+
+    if (vol1s.shape[3] != mask1s.shape[3]) or (vol2s.shape[3] != mask2s.shape[3]):     raise RuntimeError('number of volumes and masks differ')
+    for d in range(3):
+        if (vol2s.shape[d] != vol1s.shape[d]) or (mask1s.shape[d] != vol1s.shape[d]) or (mask2s.shape[d] != vol1s.shape[d]):      raise RuntimeError('volumes and masks must all be same size')
+
+    if not vol1s.flags.f_contiguous:        vol1s = vol1s.copy(order='F')
+    if not mask1s.flags.f_contiguous:       mask1s = mask1s.copy(order='F')
+    if not vol2s.flags.f_contiguous:        vol2s = vol2s.copy(order='F')
+    if not mask2s.flags.f_contiguous:       mask2s = mask2s.copy(order='F')
+
+    cdef unsigned int n_r, n_c, n_s, n_1, n_2
+    n_r = vol1s.shape[0]
+    n_c = vol1s.shape[1]
+    n_s = vol1s.shape[2]
+    n_1 = vol1s.shape[3]
+    n_2 = vol2s.shape[3]
+
+    cdef double *res_data
+    cdef unsigned int n_res
+    cdef void *mat_ptr
+
+    cdef double *v1_data = <double *> vol1s.data
+    cdef double *m1_data = <double *> mask1s.data
+    cdef double *v2_data = <double *> vol2s.data
+    cdef double *m2_data = <double *> mask2s.data
+
+    with nogil:
+        mat_ptr = wrap_combined_search_batch(n_r, n_c, n_s, n_1, v1_data, m1_data, n_2, v2_data, m2_data, L, top_n, &n_res, &res_data)
+
+    return combined_search_batch__result(mat_ptr, res_data, n_res, n_1, n_2)
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def combined_search_batch_float(np.ndarray[np.float32_t, ndim=4] vol1s, np.ndarray[np.float32_t, ndim=4] mask1s, np.ndarray[np.float32_t, ndim=4] vol2s, np.ndarray[np.float32_t, ndim=4] mask2s, unsigned int L, unsigned int top_n=0):
+    """
+    single precision combined_search_batch(), see combined_search_float()
+    """
+
+    if (vol1s.shape[3] != mask1s.shape[3]) or (vol2s.shape[3] != mask2s.shape[3]):     raise RuntimeError('number of volumes and masks differ')
+    for d in range(3):
+        if (vol2s.shape[d] != vol1s.shape[d]) or (mask1s.shape[d] != vol1s.shape[d]) or (mask2s.shape[d] != vol1s.shape[d]):      raise RuntimeError('volumes and masks must all be same size')
+
+    if not vol1s.flags.f_contiguous:        vol1s = vol1s.copy(order='F')
+    if not mask1s.flags.f_contiguous:       mask1s = mask1s.copy(order='F')
+    if not vol2s.flags.f_contiguous:        vol2s = vol2s.copy(order='F')
+    if not mask2s.flags.f_contiguous:       mask2s = mask2s.copy(order='F')
+
+    cdef unsigned int n_r, n_c, n_s, n_1, n_2
+    n_r = vol1s.shape[0]
+    n_c = vol1s.shape[1]
+    n_s = vol1s.shape[2]
+    n_1 = vol1s.shape[3]
+    n_2 = vol2s.shape[3]
+
+    cdef double *res_data
+    cdef unsigned int n_res
+    cdef void *mat_ptr
+
+    cdef float *v1_data = <float *> vol1s.data
+    cdef float *m1_data = <float *> mask1s.data
+    cdef float *v2_data = <float *> vol2s.data
+    cdef float *m2_data = <float *> mask2s.data
+
+    with nogil:
+        mat_ptr = wrap_combined_search_batch_float(n_r, n_c, n_s, n_1, v1_data, m1_data, n_2, v2_data, m2_data, L, top_n, &n_res, &res_data)
+
+    return combined_search_batch__result(mat_ptr, res_data, n_res, n_1, n_2)
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef combined_search_batch__result(void *mat_ptr, double *res_data, unsigned int n_res, unsigned int n_1, unsigned int n_2):
+    # copy the (i, j, score, loc, angle) rows returned by wrap_combined_search_batch() into R[i][j]
+    cdef np.ndarray[np.double_t, ndim=2] res
+    res = np.empty( (n_res, 9), dtype=np.double, order='F')
+
+    cdef double *np_data = <double*> res.data
+
+    cdef size_t i
+    for i in range(n_res*9):
+        np_data[i] = res_data[i]
+
+    wrap_del_mat(mat_ptr)
+
+    R = [[None] * n_2 for _ in range(n_1)]
+    ij = res[:,0].astype(np.int64) * n_2 + res[:,1].astype(np.int64)
+    for i in range(n_1):
+        for j in range(n_2):
+            R[i][j] = np.array(res[ij == (i * n_2 + j), 2:], order='C')
+
+    return R
+
+
 @cython.boundscheck(False)
 @cython.wraparound(False)
 def rot_search_cor(np.ndarray[np.double_t, ndim=3] v1, np.ndarray[np.double_t, ndim=3] v2, np.ndarray[np.double_t, ndim=1] radii, unsigned int L=36):
@@ -175,7 +396,53 @@ def rot_search_cor(np.ndarray[np.double_t, ndim=3] v1, np.ndarray[np.double_t, n
     cdef double *cor_data
     cdef void *cor_ptr
 
-    cor_ptr = wrap_rot_search_cor(n_r, n_c, n_s, v1_data, v2_data, n_radii, radii_data, L, &n_cor_r, &n_cor_c, &n_cor_s, &cor_data)
+    with nogil:
+        cor_ptr = wrap_rot_search_cor(n_r, n_c, n_s, v1_data, v2_data, n_radii, radii_data, L, &n_cor_r, &n_cor_c, &n_cor_s, &cor_data)
+
+    cdef np.ndarray[np.double_t, ndim=3] cor
+    cor = np.empty( (n_cor_r, n_cor_c, n_cor_s), dtype=np.double, order='F')
+
+    cdef double *cor_data_np = <double*> cor.data
+
+    cdef size_t i
+    for i in range(n_cor_r * n_cor_c * n_cor_s):
+        cor_data_np[i] = cor_data[i]
+
+    wrap_del_cube(cor_ptr)
+
+    return cor
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def rot_search_cor_float(np.ndarray[np.float32_t, ndim=3] v1, np.ndarray[np.float32_t, ndim=3] v2, np.ndarray[np.double_t, ndim=1] radii, unsigned int L=36):
+    """
+    rot_search_cor() of float32 volumes, the volumes are interpolated without conversion to double.
+    the returned correlation array is double.
+    """
+
+    if v1.max() == v1.min():    raise RuntimeError('v1.max() == v1.min()')          # in such case, the calcualtion may stuck
+    if v2.max() == v2.min():    raise RuntimeError('v2.max() == v2.min()')          # in such case, the calcualtion may stuck
+
+    if not v1.flags.f_contiguous:     v1 = v1.copy(order='F')
+    if not v2.flags.f_contiguous:     v2 = v2.copy(order='F')
+    if not radii.flags.f_contiguous:        radii = radii.copy(order='F')
+
+    cdef float *v1_data = <float *> v1.data
+    cdef float *v2_data = <float *> v2.data
+    cdef double *radii_data = <double *> radii.data
+
+    cdef unsigned int n_r = v1.shape[0]
+    cdef unsigned int n_c = v1.shape[1]
+    cdef unsigned int n_s = v1.shape[2]
+    cdef unsigned int n_radii = len(radii)
+
+    cdef unsigned int n_cor_r, n_cor_c, n_cor_s
+    cdef double *cor_data
+    cdef void *cor_ptr
+
+    with nogil:
+        cor_ptr = wrap_rot_search_cor_float(n_r, n_c, n_s, v1_data, v2_data, n_radii, radii_data, L, &n_cor_r, &n_cor_c, &n_cor_s, &cor_data)
 
     cdef np.ndarray[np.double_t, ndim=3] cor
     cor = np.empty( (n_cor_r, n_cor_c, n_cor_s), dtype=np.double, order='F')
@@ -210,8 +477,10 @@ def local_max_angles(np.ndarray[np.double_t, ndim=3] cor, unsigned int peak_spac
 
     cdef unsigned int n_res
     cdef double *res_data
+    cdef void *res_ptr
 
-    res_ptr = wrap_local_max_angles(n_r, n_c, n_s, cor_data, peak_spacing, &n_res, &res_data)
+    with nogil:
+        res_ptr = wrap_local_max_angles(n_r, n_c, n_s, cor_data, peak_spacing, &n_res, &res_data)
 
     cdef np.ndarray[np.double_t, ndim=2] res
     res = np.empty( (n_res, 4), dtype=np.double, order='F')
@@ -261,7 +530,34 @@ def rotate_vol_pad_mean(np.ndarray[np.double_t, ndim=3] vol, np.ndarray[np.doubl
     dx_data  = <double *> dx.data
     res_data = <double *>res.data
 
-    wrap_rotate_vol_pad_mean(n_r, n_c, n_s, vol_data, ea_data, dx_data, res_data);
+    with nogil:
+        wrap_rotate_vol_pad_mean(n_r, n_c, n_s, vol_data, ea_data, dx_data, res_data)
+    return res
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def rotate_vol_pad_mean_float(np.ndarray[np.float32_t, ndim=3] vol, np.ndarray[np.double_t, ndim=1] ea, np.ndarray[np.double_t, ndim=1] dx):
+    """
+    single precision rotate_vol_pad_mean(), returns a float32 volume
+    """
+
+    if not vol.flags.f_contiguous:
+        vol = vol.copy(order='F')
+
+    cdef unsigned int n_r = vol.shape[0]
+    cdef unsigned int n_c = vol.shape[1]
+    cdef unsigned int n_s = vol.shape[2]
+
+    cdef np.ndarray[np.float32_t, ndim=3] res = np.empty((n_r, n_c, n_s), dtype=np.float32, order='F')
+
+    cdef float *vol_data = <float *>vol.data
+    cdef double *ea_data = <double *> ea.data
+    cdef double *dx_data = <double *> dx.data
+    cdef float *res_data = <float *>res.data
+
+    with nogil:
+        wrap_rotate_vol_pad_mean_float(n_r, n_c, n_s, vol_data, ea_data, dx_data, res_data)
     return res
 
 
@@ -296,7 +592,34 @@ def rotate_vol_pad_zero(np.ndarray[np.double_t, ndim=3] vol, np.ndarray[np.doubl
     dx_data  = <double *> dx.data
     res_data = <double *>res.data
 
-    wrap_rotate_vol_pad_zero(n_r, n_c, n_s, vol_data, ea_data, dx_data, res_data);
+    with nogil:
+        wrap_rotate_vol_pad_zero(n_r, n_c, n_s, vol_data, ea_data, dx_data, res_data)
+    return res
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def rotate_vol_pad_zero_float(np.ndarray[np.float32_t, ndim=3] vol, np.ndarray[np.double_t, ndim=1] ea, np.ndarray[np.double_t, ndim=1] dx):
+    """
+    single precision rotate_vol_pad_zero(), returns a float32 volume
+    """
+
+    if not vol.flags.f_contiguous:
+        vol = vol.copy(order='F')
+
+    cdef unsigned int n_r = vol.shape[0]
+    cdef unsigned int n_c = vol.shape[1]
+    cdef unsigned int n_s = vol.shape[2]
+
+    cdef np.ndarray[np.float32_t, ndim=3] res = np.empty((n_r, n_c, n_s), dtype=np.float32, order='F')
+
+    cdef float *vol_data = <float *>vol.data
+    cdef double *ea_data = <double *> ea.data
+    cdef double *dx_data = <double *> dx.data
+    cdef float *res_data = <float *>res.data
+
+    with nogil:
+        wrap_rotate_vol_pad_zero_float(n_r, n_c, n_s, vol_data, ea_data, dx_data, res_data)
     return res
 
 @cython.boundscheck(False)
@@ -327,7 +650,33 @@ def rotate_mask(np.ndarray[np.double_t, ndim=3] mask, np.ndarray[np.double_t, nd
     ea_data  = <double *> ea.data
     res_data = <double *>res.data
 
-    wrap_rotate_mask(n_r, n_c, n_s, mask_data, ea_data, res_data);
+    with nogil:
+        wrap_rotate_mask(n_r, n_c, n_s, mask_data, ea_data, res_data)
+    return res
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def rotate_mask_float(np.ndarray[np.float32_t, ndim=3] mask, np.ndarray[np.double_t, ndim=1] ea):
+    """
+    single precision rotate_mask(), returns a float32 mask
+    """
+
+    if not mask.flags.f_contiguous:
+        mask = mask.copy(order='F')
+
+    cdef unsigned int n_r = mask.shape[0]
+    cdef unsigned int n_c = mask.shape[1]
+    cdef unsigned int n_s = mask.shape[2]
+
+    cdef np.ndarray[np.float32_t, ndim=3] res = np.empty((n_r, n_c, n_s), dtype=np.float32, order='F')
+
+    cdef float *mask_data = <float *>mask.data
+    cdef double *ea_data = <double *> ea.data
+    cdef float *res_data = <float *>res.data
+
+    with nogil:
+        wrap_rotate_mask_float(n_r, n_c, n_s, mask_data, ea_data, res_data)
     return res
 
 
@@ -490,3 +839,57 @@ def vol_label_count(np.ndarray[np.int32_t, ndim=3] lbl):
 
 
 
+'''
+FFTW plan cache and wisdom.
+The core caches one FFTW plan per transform shape, so repeated alignments of same sized volumes only plan once.
+With a planning rigor other than 'estimate' the first transform of each shape is slower but the following ones are
+faster, the cost of planning can be saved across processes by exporting and importing the FFTW wisdom.
+'''
+def fft_plan_rigor(rigor=None):
+    """
+    set the FFTW planning rigor of new plans, one of 'estimate' (default), 'measure', 'patient', 'exhaustive'.
+    returns the rigor in effect.
+    """
+    if rigor is not None:
+        wrap_fft_set_plan_rigor(rigor.encode())
+    return wrap_fft_get_plan_rigor().decode()
+
+
+def fft_plan_cache_clear():
+    wrap_fft_plan_cache_clear()
+
+
+def fft_plan_cache_size():
+    return wrap_fft_plan_cache_size()
+
+
+def fft_wisdom_export(str filename):
+    """save the accumulated FFTW wisdom to filename, returns True on success"""
+    return wrap_fft_wisdom_export(filename.encode())
+
+
+def fft_wisdom_import(str filename):
+    """load FFTW wisdom from filename, returns True on success"""
+    return wrap_fft_wisdom_import(filename.encode())
+
+
+# planning defaults for worker processes
+if os.environ.get('TOMOMINER_FFTW_PLAN_RIGOR'):
+    fft_plan_rigor(os.environ['TOMOMINER_FFTW_PLAN_RIGOR'])
+
+if os.environ.get('TOMOMINER_FFTW_WISDOM') and os.path.isfile(os.environ['TOMOMINER_FFTW_WISDOM']):
+    fft_wisdom_import(os.environ['TOMOMINER_FFTW_WISDOM'])
+
+
+
+'''
+Threads used by the alignment and rotation kernels. The wrappers of these kernels release the GIL, so python threads
+can run alignments concurrently with each other and with I/O.
+'''
+def set_num_threads(int n):
+    """set the number of threads of the core kernels, n <= 0 uses all cores. The default is 1, or TOMOMINER_CORE_THREADS"""
+    wrap_set_num_threads(n)
+
+
+def get_num_threads():
+    return wrap_get_num_threads()
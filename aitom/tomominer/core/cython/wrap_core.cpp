@@ -3,6 +3,8 @@
 #include <iostream>
 
 #include "align.hpp"
+#include "fft.hpp"
+#include "parallel.hpp"
 #include "io.hpp"
 
 #include "segmentation/active_contour/ac_distance_transform_3d.hpp"
@@ -10,12 +12,24 @@
 #include "segmentation/active_contour/ac_div_AOS_3D_dll.hpp"
 #include "segmentation/watershed/watershed_segmentation.hpp"
 
+/*
+    The wrappers of the alignment and rotation functions are written once as
+    templates over the element type of the volumes, and exported as a double
+    and a single precision (_float) version.
+*/
+
 void wrap_write_mrc(double *vol, unsigned int n_r, unsigned int n_c, unsigned int n_s, std::string filename)
 {
     arma::cube V(vol, n_r, n_c, n_s, false, true);
     write_mrc(V, filename.c_str());
 }
 
+void wrap_write_mrc_float(float *vol, unsigned int n_r, unsigned int n_c, unsigned int n_s, std::string filename)
+{
+    arma::fcube V(vol, n_r, n_c, n_s, false, true);
+    write_mrc(V, filename.c_str());
+}
+
 void *wrap_read_mrc(std::string filename, double **vol, unsigned int *n_r, unsigned int *n_c, unsigned int *n_s)
 {
 
@@ -33,12 +47,24 @@ void *wrap_read_mrc(std::string filename, double **vol, unsigned int *n_r, unsig
     return (void *)v;
 }
 
-void *wrap_combined_search(unsigned int n_r, unsigned int n_c, unsigned int n_s, double *v1_data, double *m1_data, double *v2_data, double *m2_data, unsigned int L, unsigned int *n_res, double **res_data)
+void *wrap_read_mrc_float(std::string filename, float **vol, unsigned int *n_r, unsigned int *n_c, unsigned int *n_s)
 {
-    arma::cube v1(v1_data, n_r, n_c, n_s, false, true);
-    arma::cube m1(m1_data, n_r, n_c, n_s, false, true);
-    arma::cube v2(v2_data, n_r, n_c, n_s, false, true);
-    arma::cube m2(m2_data, n_r, n_c, n_s, false, true);
+    arma::fcube *v = new arma::fcube(read_mrc_float(filename.c_str()));
+
+    *vol = v->memptr();
+    *n_r = v->n_rows;
+    *n_c = v->n_cols;
+    *n_s = v->n_slices;
+    return (void *)v;
+}
+
+template<class eT>
+void *wrap_combined_search_t(unsigned int n_r, unsigned int n_c, unsigned int n_s, eT *v1_data, eT *m1_data, eT *v2_data, eT *m2_data, unsigned int L, unsigned int *n_res, double **res_data)
+{
+    arma::Cube<eT> v1(v1_data, n_r, n_c, n_s, false, true);
+    arma::Cube<eT> m1(m1_data, n_r, n_c, n_s, false, true);
+    arma::Cube<eT> v2(v2_data, n_r, n_c, n_s, false, true);
+    arma::Cube<eT> m2(m2_data, n_r, n_c, n_s, false, true);
 
     std::vector<std::tuple<double, arma::vec3, euler_angle> > res = combined_search(v1, m1, v2, m2, L);
     //std::vector<boost::tuple<double, arma::vec3, euler_angle> > res = combined_search(v1, m1, v2, m2, L);
@@ -61,11 +87,92 @@ void *wrap_combined_search(unsigned int n_r, unsigned int n_c, unsigned int n_s,
     return (void *)ret;
 }
 
+void *wrap_combined_search(unsigned int n_r, unsigned int n_c, unsigned int n_s, double *v1_data, double *m1_data, double *v2_data, double *m2_data, unsigned int L, unsigned int *n_res, double **res_data)
+{
+    return wrap_combined_search_t(n_r, n_c, n_s, v1_data, m1_data, v2_data, m2_data, L, n_res, res_data);
+}
 
-void *wrap_rot_search_cor(unsigned int n_r, unsigned int n_c, unsigned int n_s, double *v1_data, double *v2_data, unsigned int n_radii, double *radii_data, unsigned int L, unsigned int *n_cor_r, unsigned int *n_cor_c, unsigned int *n_cor_s, double **cor)
+void *wrap_combined_search_float(unsigned int n_r, unsigned int n_c, unsigned int n_s, float *v1_data, float *m1_data, float *v2_data, float *m2_data, unsigned int L, unsigned int *n_res, double **res_data)
 {
-    arma::cube v1(v1_data, n_r, n_c, n_s, false, true);
-    arma::cube v2(v2_data, n_r, n_c, n_s, false, true);
+    return wrap_combined_search_t(n_r, n_c, n_s, v1_data, m1_data, v2_data, m2_data, L, n_res, res_data);
+}
+
+
+template<class eT>
+void *wrap_combined_search_batch_t(unsigned int n_r, unsigned int n_c, unsigned int n_s, unsigned int n_1, eT *v1_data, eT *m1_data, unsigned int n_2, eT *v2_data, eT *m2_data, unsigned int L, unsigned int top_n, unsigned int *n_res, double **res_data)
+{
+    // volumes of each set are stored one after another.
+    size_t n_vox = (size_t)n_r * n_c * n_s;
+
+    std::vector<combined_search_volume_t<eT> > s1(n_1), s2(n_2);
+
+    // volumes are prepared in parallel, volumes of the second set follow those of the first.
+    parallel_error err;
+    #pragma omp parallel for num_threads(get_num_threads()) schedule(dynamic)
+    for(int i = 0; i < (int)(n_1 + n_2); i++)
+    {
+        try
+        {
+            bool first = (i < (int)n_1);
+            size_t k = first ? i : i - n_1;
+            arma::Cube<eT> v((first ? v1_data : v2_data) + k*n_vox, n_r, n_c, n_s, false, true);
+            arma::Cube<eT> m((first ? m1_data : m2_data) + k*n_vox, n_r, n_c, n_s, false, true);
+            (first ? s1 : s2)[k] = combined_search_prepare(v, m, L);
+        }
+        catch(...)
+        {
+            err.capture();
+        }
+    }
+    err.rethrow();
+
+    std::vector<std::vector<std::tuple<double, arma::vec3, euler_angle> > > res = combined_search_batch(s1, s2, L, top_n);
+
+    size_t n = 0;
+    for(size_t p = 0; p < res.size(); p++)
+        n += res[p].size();
+
+    // one row per result: (i, j, score, loc, angle)
+    arma::mat *ret = new arma::mat(n, 9);
+
+    *res_data = ret->memptr();
+    *n_res    = n;
+
+    size_t r = 0;
+    for(size_t p = 0; p < res.size(); p++)
+    {
+        for(size_t k = 0; k < res[p].size(); k++, r++)
+        {
+            (*ret)(r,0) = p / n_2;
+            (*ret)(r,1) = p % n_2;
+            (*ret)(r,2) = std::get<0>(res[p][k]);
+            (*ret)(r,3) = std::get<1>(res[p][k])(0);
+            (*ret)(r,4) = std::get<1>(res[p][k])(1);
+            (*ret)(r,5) = std::get<1>(res[p][k])(2);
+            (*ret)(r,6) = std::get<2>(res[p][k])(0);
+            (*ret)(r,7) = std::get<2>(res[p][k])(1);
+            (*ret)(r,8) = std::get<2>(res[p][k])(2);
+        }
+    }
+    return (void *)ret;
+}
+
+void *wrap_combined_search_batch(unsigned int n_r, unsigned int n_c, unsigned int n_s, unsigned int n_1, double *v1_data, double *m1_data, unsigned int n_2, double *v2_data, double *m2_data, unsigned int L, unsigned int top_n, unsigned int *n_res, double **res_data)
+{
+    return wrap_combined_search_batch_t(n_r, n_c, n_s, n_1, v1_data, m1_data, n_2, v2_data, m2_data, L, top_n, n_res, res_data);
+}
+
+void *wrap_combined_search_batch_float(unsigned int n_r, unsigned int n_c, unsigned int n_s, unsigned int n_1, float *v1_data, float *m1_data, unsigned int n_2, float *v2_data, float *m2_data, unsigned int L, unsigned int top_n, unsigned int *n_res, double **res_data)
+{
+    return wrap_combined_search_batch_t(n_r, n_c, n_s, n_1, v1_data, m1_data, n_2, v2_data, m2_data, L, top_n, n_res, res_data);
+}
+
+
+template<class eT>
+void *wrap_rot_search_cor_t(unsigned int n_r, unsigned int n_c, unsigned int n_s, eT *v1_data, eT *v2_data, unsigned int n_radii, double *radii_data, unsigned int L, unsigned int *n_cor_r, unsigned int *n_cor_c, unsigned int *n_cor_s, double **cor)
+{
+    arma::Cube<eT> v1(v1_data, n_r, n_c, n_s, false, true);
+    arma::Cube<eT> v2(v2_data, n_r, n_c, n_s, false, true);
 
     // Create wigner D-matrices, used later.
     //! @note consider precomputation and loading from disk, or saving across combined_search runs.
@@ -92,6 +199,16 @@ void *wrap_rot_search_cor(unsigned int n_r, unsigned int n_c, unsigned int n_s,
     return (void *)cor_p;
 }
 
+void *wrap_rot_search_cor(unsigned int n_r, unsigned int n_c, unsigned int n_s, double *v1_data, double *v2_data, unsigned int n_radii, double *radii_data, unsigned int L, unsigned int *n_cor_r, unsigned int *n_cor_c, unsigned int *n_cor_s, double **cor)
+{
+    return wrap_rot_search_cor_t(n_r, n_c, n_s, v1_data, v2_data, n_radii, radii_data, L, n_cor_r, n_cor_c, n_cor_s, cor);
+}
+
+void *wrap_rot_search_cor_float(unsigned int n_r, unsigned int n_c, unsigned int n_s, float *v1_data, float *v2_data, unsigned int n_radii, double *radii_data, unsigned int L, unsigned int *n_cor_r, unsigned int *n_cor_c, unsigned int *n_cor_s, double **cor)
+{
+    return wrap_rot_search_cor_t(n_r, n_c, n_s, v1_data, v2_data, n_radii, radii_data, L, n_cor_r, n_cor_c, n_cor_s, cor);
+}
+
 void *wrap_local_max_angles(unsigned int n_r, unsigned int n_c, unsigned int n_s, double *cor_data, unsigned int peak_spacing, unsigned int *n_res, double **res_data)
 {
     arma::cube cor(cor_data, n_r, n_c, n_s, false, true);
@@ -128,56 +245,94 @@ void *wrap_local_max_angles(unsigned int n_r, unsigned int n_c, unsigned int n_s
 
 }
 
-void wrap_rotate_vol_pad_mean(unsigned int n_r, unsigned int n_c, unsigned int n_s, double *v_data, double *ea_data, double *dx_data, double *res_data)
+template<class eT>
+void wrap_rotate_vol_pad_mean_t(unsigned int n_r, unsigned int n_c, unsigned int n_s, eT *v_data, double *ea_data, double *dx_data, eT *res_data)
 {
-    arma::cube   v(v_data, n_r, n_c, n_s,   false, true);
+    arma::Cube<eT> v(v_data, n_r, n_c, n_s,   false, true);
     arma::vec3  ea = arma::vec3(ea_data);
     arma::vec3  dx = arma::vec3(dx_data);
     
     arma::mat33 rm = rot_matrix(ea);
 
-    arma::cube rot = rotate_vol_pad_mean(v, rm, dx);
+    arma::Cube<eT> rot = rotate_vol_pad_mean(v, rm, dx);
 
     for(size_t i = 0; i < rot.n_elem; i++)
         res_data[i] = rot(i);
     return;
 }
 
+void wrap_rotate_vol_pad_mean(unsigned int n_r, unsigned int n_c, unsigned int n_s, double *v_data, double *ea_data, double *dx_data, double *res_data)
+{
+    wrap_rotate_vol_pad_mean_t(n_r, n_c, n_s, v_data, ea_data, dx_data, res_data);
+}
 
-void wrap_rotate_vol_pad_zero(unsigned int n_r, unsigned int n_c, unsigned int n_s, double *v_data, double *ea_data, double *dx_data, double *res_data)
+void wrap_rotate_vol_pad_mean_float(unsigned int n_r, unsigned int n_c, unsigned int n_s, float *v_data, double *ea_data, double *dx_data, float *res_data)
 {
-    arma::cube   v(v_data, n_r, n_c, n_s,   false, true);
+    wrap_rotate_vol_pad_mean_t(n_r, n_c, n_s, v_data, ea_data, dx_data, res_data);
+}
+
+
+template<class eT>
+void wrap_rotate_vol_pad_zero_t(unsigned int n_r, unsigned int n_c, unsigned int n_s, eT *v_data, double *ea_data, double *dx_data, eT *res_data)
+{
+    arma::Cube<eT> v(v_data, n_r, n_c, n_s,   false, true);
     arma::vec3  ea(ea_data);
     arma::vec3  dx(dx_data);
     arma::mat33 rm = rot_matrix(ea);
 
-    arma::cube rot = rotate_vol_pad_zero(v, rm, dx);
+    arma::Cube<eT> rot = rotate_vol_pad_zero(v, rm, dx);
 
     for(size_t i = 0; i < rot.n_elem; i++)
         res_data[i] = rot(i);
     return;
 }
 
+void wrap_rotate_vol_pad_zero(unsigned int n_r, unsigned int n_c, unsigned int n_s, double *v_data, double *ea_data, double *dx_data, double *res_data)
+{
+    wrap_rotate_vol_pad_zero_t(n_r, n_c, n_s, v_data, ea_data, dx_data, res_data);
+}
 
-void wrap_rotate_mask(unsigned int n_r, unsigned int n_c, unsigned int n_s, double *m_data, double *ea_data, double *res_data)
+void wrap_rotate_vol_pad_zero_float(unsigned int n_r, unsigned int n_c, unsigned int n_s, float *v_data, double *ea_data, double *dx_data, float *res_data)
 {
-    arma::cube   m(m_data, n_r, n_c, n_s,   false, true);
+    wrap_rotate_vol_pad_zero_t(n_r, n_c, n_s, v_data, ea_data, dx_data, res_data);
+}
+
+
+template<class eT>
+void wrap_rotate_mask_t(unsigned int n_r, unsigned int n_c, unsigned int n_s, eT *m_data, double *ea_data, eT *res_data)
+{
+    arma::Cube<eT> m(m_data, n_r, n_c, n_s,   false, true);
     arma::vec3  ea(ea_data);
     arma::mat33 rm = rot_matrix(ea);
 
-    arma::cube rot = rotate_mask(m, rm);
+    arma::Cube<eT> rot = rotate_mask(m, rm);
 
     for(size_t i = 0; i < rot.n_elem; i++)
         res_data[i] = rot(i);
     return;
 }
 
+void wrap_rotate_mask(unsigned int n_r, unsigned int n_c, unsigned int n_s, double *m_data, double *ea_data, double *res_data)
+{
+    wrap_rotate_mask_t(n_r, n_c, n_s, m_data, ea_data, res_data);
+}
+
+void wrap_rotate_mask_float(unsigned int n_r, unsigned int n_c, unsigned int n_s, float *m_data, double *ea_data, float *res_data)
+{
+    wrap_rotate_mask_t(n_r, n_c, n_s, m_data, ea_data, res_data);
+}
+
 
 void wrap_del_cube(void *v)
 {
     arma::cube *c = (arma::cube *)v;
     delete c;
 }
+void wrap_del_fcube(void *v)
+{
+    arma::fcube *c = (arma::fcube *)v;
+    delete c;
+}
 void wrap_del_mat(void *v)
 {
     arma::mat *m = (arma::mat *)v;
@@ -185,6 +340,47 @@ void wrap_del_mat(void *v)
 }
 
 
+void wrap_fft_set_plan_rigor(std::string rigor)
+{
+    fft_set_plan_rigor(rigor);
+}
+
+std::string wrap_fft_get_plan_rigor()
+{
+    return fft_get_plan_rigor();
+}
+
+void wrap_fft_plan_cache_clear()
+{
+    fft_plan_cache_clear();
+}
+
+size_t wrap_fft_plan_cache_size()
+{
+    return fft_plan_cache_size();
+}
+
+bool wrap_fft_wisdom_export(std::string filename)
+{
+    return fft_wisdom_export(filename);
+}
+
+bool wrap_fft_wisdom_import(std::string filename)
+{
+    return fft_wisdom_import(filename);
+}
+
+void wrap_set_num_threads(int n)
+{
+    set_num_threads(n);
+}
+
+int wrap_get_num_threads()
+{
+    return get_num_threads();
+}
+
+
 
 void wrap_ac_distance_transform_3d(const unsigned int n_r, const unsigned int n_c, const unsigned int n_s, const char *lbl_v, double *dist_v)
 {
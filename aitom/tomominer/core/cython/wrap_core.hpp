@@ -5,17 +5,37 @@
 
 void wrap_write_mrc(double *vol, unsigned int n_r, unsigned int n_c, unsigned int n_s, std::string filename);
 void *wrap_read_mrc(std::string filename, double **vol, unsigned int *n_r, unsigned int *n_c, unsigned int *n_s);
+void wrap_write_mrc_float(float *vol, unsigned int n_r, unsigned int n_c, unsigned int n_s, std::string filename);
+void *wrap_read_mrc_float(std::string filename, float **vol, unsigned int *n_r, unsigned int *n_c, unsigned int *n_s);
 
 void *wrap_combined_search(unsigned int n_r, unsigned int n_c, unsigned int n_s, double *v1_data, double *m1_data, double *v2_data, double *m2_data, unsigned int L, unsigned int *n_res, double **res_data);
+void *wrap_combined_search_batch(unsigned int n_r, unsigned int n_c, unsigned int n_s, unsigned int n_1, double *v1_data, double *m1_data, unsigned int n_2, double *v2_data, double *m2_data, unsigned int L, unsigned int top_n, unsigned int *n_res, double **res_data);
 void *wrap_rot_search_cor(unsigned int n_r, unsigned int n_c, unsigned int n_s, double *v1_data, double *v2_data, unsigned int n_radii, double *radii_data, unsigned int L, unsigned int *n_cor_r, unsigned int *n_cor_c, unsigned int *n_cor_s, double **cor);
+void *wrap_combined_search_float(unsigned int n_r, unsigned int n_c, unsigned int n_s, float *v1_data, float *m1_data, float *v2_data, float *m2_data, unsigned int L, unsigned int *n_res, double **res_data);
+void *wrap_combined_search_batch_float(unsigned int n_r, unsigned int n_c, unsigned int n_s, unsigned int n_1, float *v1_data, float *m1_data, unsigned int n_2, float *v2_data, float *m2_data, unsigned int L, unsigned int top_n, unsigned int *n_res, double **res_data);
+void *wrap_rot_search_cor_float(unsigned int n_r, unsigned int n_c, unsigned int n_s, float *v1_data, float *v2_data, unsigned int n_radii, double *radii_data, unsigned int L, unsigned int *n_cor_r, unsigned int *n_cor_c, unsigned int *n_cor_s, double **cor);
 void *wrap_local_max_angles(unsigned int n_r, unsigned int n_c, unsigned int n_s, double *cor_data, unsigned int peak_spacing, unsigned int *n_res, double **res_data);
 
 void wrap_rotate_vol_pad_mean(unsigned int n_r, unsigned int n_c, unsigned int n_s, double *v_data, double *rm_data, double *dx_data, double *res_data);
 void wrap_rotate_vol_pad_zero(unsigned int n_r, unsigned int n_c, unsigned int n_s, double *v_data, double *rm_data, double *dx_data, double *res_data);
 void wrap_rotate_mask(unsigned int n_r, unsigned int n_c, unsigned int n_s, double *v_data, double *rm_data, double *res_data);
+void wrap_rotate_vol_pad_mean_float(unsigned int n_r, unsigned int n_c, unsigned int n_s, float *v_data, double *rm_data, double *dx_data, float *res_data);
+void wrap_rotate_vol_pad_zero_float(unsigned int n_r, unsigned int n_c, unsigned int n_s, float *v_data, double *rm_data, double *dx_data, float *res_data);
+void wrap_rotate_mask_float(unsigned int n_r, unsigned int n_c, unsigned int n_s, float *v_data, double *rm_data, float *res_data);
 void wrap_del_cube(void *c);
+void wrap_del_fcube(void *c);
 void wrap_del_mat(void *v);
 
+void wrap_fft_set_plan_rigor(std::string rigor);
+std::string wrap_fft_get_plan_rigor();
+void wrap_fft_plan_cache_clear();
+size_t wrap_fft_plan_cache_size();
+bool wrap_fft_wisdom_export(std::string filename);
+bool wrap_fft_wisdom_import(std::string filename);
+
+void wrap_set_num_threads(int n);
+int wrap_get_num_threads();
+
 void wrap_ac_distance_transform_3d(const unsigned int n_r, const unsigned int n_c, const unsigned int n_s, const char *lbl_v, double *dist_v);
 void wrap_BinaryBoundaryDetection(char *pI, int width, int height, int depth, int type, char *pOut); 
 void wrap_ac_div_AOS_3D_dll(const unsigned int* dims, double *g_v, double *phi_v, double *phi_n_v, const double delta_t);
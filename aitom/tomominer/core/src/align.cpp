@@ -7,6 +7,7 @@
 #include <armadillo>
 
 #include "align.hpp"
+#include "parallel.hpp"
 
 using arma::span;
 
@@ -26,31 +27,51 @@ std::complex<double> trapz(const arma::vec &x, const arma::cx_vec &y)
 }
 
 
-std::tuple<arma::vec3, double> cons_corr_max(const arma::cube &vol1, const arma::cube &mask1, const arma::cube &vol2, const arma::cube &mask2, euler_angle ang)
+// sum of |x|^2, single precision coefficients are summed in double.
+inline double sum_abs_sq(const arma::cx_cube &x) { return arma::accu(arma::square(arma::abs(x))); }
+
+inline double sum_abs_sq(const arma::cx_fcube &x)
+{
+    double s = 0;
+    for(size_t i = 0; i < x.n_elem; i++)
+        s += std::norm(x(i));
+    return s;
+}
+
+
+template<class eT>
+std::tuple<arma::vec3, double> cons_corr_max(const arma::Cube<eT> &vol1, const arma::Cube<eT> &mask1, const arma::Cube<eT> &vol2, const arma::Cube<eT> &mask2, euler_angle ang)
 //boost::tuple<arma::vec3, double> cons_corr_max(const arma::cube &vol1, const arma::cube &mask1, const arma::cube &vol2, const arma::cube &mask2, euler_angle ang)
+{
+    arma::Cube< std::complex<eT> > vol1_fft = fft(vol1);
+    vol1_fft(0,0,0) = 0;
+
+    return cons_corr_max(fftshift(vol1_fft), mask1, vol2, mask2, ang);
+}
+
+template<class eT>
+std::tuple<arma::vec3, double> cons_corr_max(const arma::Cube< std::complex<eT> > &vol1_fft_shift, const arma::Cube<eT> &mask1, const arma::Cube<eT> &vol2, const arma::Cube<eT> &mask2, euler_angle ang)
 {
     rot_matrix rm = ang.as_rot_matrix();
 
-    arma::cube v2 = rotate_vol_pad_mean(vol2, rm);
-    arma::cube m2 = rotate_mask(mask2, rm);
+    arma::Cube<eT> v2 = rotate_vol_pad_mean(vol2, rm);
+    arma::Cube<eT> m2 = rotate_mask(mask2, rm);
 
-    arma::cube mask = mask1 % m2;
+    arma::Cube<eT> mask = mask1 % m2;
     
-    arma::cx_cube vol1_fft = fft(vol1);
-    arma::cx_cube vol2_fft = fft(v2);
+    arma::Cube< std::complex<eT> > vol2_fft = fft(v2);
     
-    vol1_fft(0,0,0) = 0;
     vol2_fft(0,0,0) = 0;
     
-    vol1_fft = fftshift(vol1_fft) % mask;
+    arma::Cube< std::complex<eT> > vol1_fft = vol1_fft_shift % mask;
     vol2_fft = fftshift(vol2_fft) % mask;
 
-    vol1_fft /= sqrt(arma::accu(arma::square(arma::abs(vol1_fft))));
-    vol2_fft /= sqrt(arma::accu(arma::square(arma::abs(vol2_fft))));
+    vol1_fft /= (eT)sqrt(sum_abs_sq(vol1_fft));
+    vol2_fft /= (eT)sqrt(sum_abs_sq(vol2_fft));
 
-    arma::cx_cube tmp = vol1_fft % arma::conj(vol2_fft);
+    arma::Cube< std::complex<eT> > tmp = vol1_fft % arma::conj(vol2_fft);
 
-    arma::cube corr = arma::real(fft(ifftshift( tmp )));
+    arma::Cube<eT> corr = arma::real(fft(ifftshift( tmp )));
 
     // search for maxima values in the correlation.
     arma::uvec3 max_loc;
@@ -70,86 +91,120 @@ std::tuple<arma::vec3, double> cons_corr_max(const arma::cube &vol1, const arma:
     //return boost::make_tuple(pos, max_val);
 }
 
-arma::cx_cube rot_search_cor(const arma::cube &vol1, const arma::cube &vol2, unsigned int L, const std::vector<double> &radius, const std::vector<arma::mat> &wig_d, arma::vec3 mid_co)
+template<class eT>
+arma::cx_cube rot_search_cor(const arma::Cube<eT> &vol1, const arma::Cube<eT> &vol2, unsigned int L, const std::vector<double> &radius, const std::vector<arma::mat> &wig_d, arma::vec3 mid_co)
 {
     // first generate representation of each volume as a set of spherical
     // harmonic coefficients at different radii from the center.
     std::vector<arma::cx_mat> coef1 = rot_search_expansion(vol1, L, radius, mid_co);
     std::vector<arma::cx_mat> coef2 = rot_search_expansion(vol2, L, radius, mid_co);
-    
-    arma::cx_cube I = arma::zeros<arma::cx_cube>(L+1, 2*L+1, 2*L+1);
 
-    arma::cx_cube It_old;
+    return rot_search_cor(coef1, coef2, L, radius, wig_d);
+}
 
-    for(size_t rad_i = 0; rad_i < radius.size(); rad_i++)
+arma::cx_cube rot_search_cor(const std::vector<arma::cx_mat> &coef1, const std::vector<arma::cx_mat> &coef2, unsigned int L, const std::vector<double> &radius, const std::vector<arma::mat> &wig_d)
+{
+    // integrate over the radius with the trapezoid rule: the term of each shell is added with the weight
+    // (r[i+1] - r[i-1]) / 2, or (r[1] - r[0]) / 2 and (r[n-1] - r[n-2]) / 2 at the ends, so that no more than one
+    // partial sum per thread is held in memory. a single shell has the weight 1/2, as it always had.
+    size_t rad_n = radius.size();
+    std::vector<double> rad_w(rad_n, 0.5);
+    if(rad_n > 1)
     {
-        arma::cx_cube It = arma::zeros<arma::cx_cube>(L+1, 2*L+1, 2*L+1);
-        double r2 = radius[rad_i]*radius[rad_i];
+        for(size_t rad_i = 0; rad_i < rad_n; rad_i++)
+            rad_w[rad_i] = 0.5 * (radius[std::min(rad_i+1, rad_n-1)] - radius[(rad_i > 0) ? (rad_i-1) : 0]);
+    }
 
-        size_t num_entries = std::min(coef1[rad_i].n_rows, coef2[rad_i].n_rows);
+    arma::cx_cube I = arma::zeros<arma::cx_cube>(L+1, 2*L+1, 2*L+1);
 
-        arma::cx_vec c1(2*L+1), c2(2*L+1);
+    // the products of the coefficients of each shell are independent, each thread sums the terms of its shells.
+    parallel_error err;
+    #pragma omp parallel num_threads(get_num_threads())
+    {
+        arma::cx_cube I_t;
+        try
+        {
+            I_t = arma::zeros<arma::cx_cube>(L+1, 2*L+1, 2*L+1);
+        }
+        catch(...)
+        {
+            err.capture();
+        }
 
-        //for l = 0 : L (here we use num_entries because our matrix may not be filled out to LxL and we need those numbers to be zero.)
-        for(arma::uword l = 0; l < num_entries; l++)
+        #pragma omp for schedule(dynamic)
+        for(int rad_i = 0; rad_i < (int)rad_n; rad_i++)
         {
-            c1.zeros();
-            c2.zeros();
+            try
+            {
+                double r2w = radius[rad_i]*radius[rad_i] * rad_w[rad_i];
 
-            c1(L) = coef1[rad_i](l, 0);
-            c2(L) = coef2[rad_i](l, 0);
+                size_t num_entries = std::min(coef1[rad_i].n_rows, coef2[rad_i].n_rows);
 
-            for(size_t m = 1; m <= l; m++)
-            {
-                std::complex<double> c;
-               
-                c = coef1[rad_i](l, m);
-
-                c1(L-m) = 1.0/sqrt(2.0) * conj(c);
-                c1(L+m) = 1.0/sqrt(2.0) * c       * ((m % 2 == 1) ? -1.0 : 1.0);
-                
-                c = coef2[rad_i](l, m);
-                
-                c2(L-m) = 1.0/sqrt(2.0) * conj(c);
-                c2(L+m) = 1.0/sqrt(2.0) * c       * ((m % 2 == 1) ? -1.0 : 1.0);
-                
-            }
+                arma::cx_vec c1(2*L+1), c2(2*L+1);
 
-            It(span(l), span(), span()) = c1 * c2.t() * r2;
-        }
+                //for l = 0 : L (here we use num_entries because our matrix may not be filled out to LxL and we need those numbers to be zero.)
+                for(arma::uword l = 0; l < num_entries; l++)
+                {
+                    c1.zeros();
+                    c2.zeros();
 
-        if(radius.size() == 1)
-        {
-            I = It;
-            break;
+                    c1(L) = coef1[rad_i](l, 0);
+                    c2(L) = coef2[rad_i](l, 0);
+
+                    for(size_t m = 1; m <= l; m++)
+                    {
+                        std::complex<double> c;
+
+                        c = coef1[rad_i](l, m);
+
+                        c1(L-m) = 1.0/sqrt(2.0) * conj(c);
+                        c1(L+m) = 1.0/sqrt(2.0) * c       * ((m % 2 == 1) ? -1.0 : 1.0);
+
+                        c = coef2[rad_i](l, m);
+
+                        c2(L-m) = 1.0/sqrt(2.0) * conj(c);
+                        c2(L+m) = 1.0/sqrt(2.0) * c       * ((m % 2 == 1) ? -1.0 : 1.0);
+
+                    }
+
+                    I_t(span(l), span(), span()) += c1 * c2.t() * r2w;
+                }
+            }
+            catch(...)
+            {
+                err.capture();
+            }
         }
 
-        if(rad_i > 0)
+        #pragma omp critical(rot_search_cor_radius_sum)
         {
-            arma::cx_cube temp = It_old + It;
-            I += (radius[rad_i] - radius[rad_i-1]) * (It_old + It);
+            if(I_t.n_elem == I.n_elem)
+                I += I_t;
         }
-
-        It_old = It;
-
     }
-
-    I /= 2.0;
+    err.rethrow();
 
     // angular spacing. 2*pi/(2*L). [0, 2*pi].
     arma::cx_cube TF = arma::zeros<arma::cx_cube>(2*L+1, 2*L+1, 2*L+1);
 
-    for(arma::uword l = 0; l <= (arma::uword)L; l++)
+    // each thread sums the terms of its orders l, the partial sums are added at the end.
+    #pragma omp parallel num_threads(get_num_threads())
     {
-        arma::cx_mat It = I(span(l), span(L-l, L+l), span(L-l,L+l));
-        
-        arma::mat    W  = wig_d[l];
-        arma::cx_cube TF_l = arma::zeros<arma::cx_cube>(2*L+1, 2*L+1,2*L+1);
-        
-        for(int h = -((int)l); h <= (int)l; h++)
-            TF_l(span(L-l,L+l), span(h+L), span(L-l,L+l)) = (W.row(h+l).t() * W.col(h+l).t()) % It;
-        
-        TF += TF_l;
+        arma::cx_cube TF_t = arma::zeros<arma::cx_cube>(2*L+1, 2*L+1, 2*L+1);
+
+        #pragma omp for schedule(dynamic)
+        for(int l = 0; l <= (int)L; l++)
+        {
+            arma::cx_mat It = I(span(l), span(L-l, L+l), span(L-l,L+l));
+            
+            const arma::mat &W = wig_d[l];
+            
+            for(int h = -l; h <= l; h++)
+                TF_t(span(L-l,L+l), span(h+L), span(L-l,L+l)) += (W.row(h+l).t() * W.col(h+l).t()) % It;
+        }
+
+        #pragma omp critical(rot_search_cor_sum)
+        TF += TF_t;
     }
 
     // Shrink for inverse FFT.
@@ -174,56 +229,68 @@ arma::cx_cube rot_search_cor(const arma::cube &vol1, const arma::cube &vol2, uns
 }
 
 
-std::vector<arma::cx_mat> rot_search_expansion(const arma::cube &vol, unsigned int max_l, const std::vector<double> &radius, arma::vec3 center)
+template<class eT>
+std::vector<arma::cx_mat> rot_search_expansion(const arma::Cube<eT> &vol, unsigned int max_l, const std::vector<double> &radius, arma::vec3 center)
 {
-    std::vector<arma::cx_mat> coefs;
+    std::vector<arma::cx_mat> coefs(radius.size());
 
     // fill with zero if out of bounds.
-    cubic_interpolater ci(vol, 0.0);
+    cubic_interpolater_t<eT> ci(vol, 0.0);
 
-    for(size_t i = 0; i < radius.size(); i++)
+    // shells are independent.
+    parallel_error err;
+    #pragma omp parallel for num_threads(get_num_threads()) schedule(dynamic)
+    for(int i = 0; i < (int)radius.size(); i++)
     {
-        /* We will represent the function values on the sphere, by sampling at
-        * equally spaced points in angle space.
+        try
+        {
+            /* We will represent the function values on the sphere, by sampling at
+            * equally spaced points in angle space.
 
-        Starting with theta in [0,pi] (latitude) and phi in [0,2*pi]
-        (longitude), we can discritize into grid of size Nx2N.
-        */
+            Starting with theta in [0,pi] (latitude) and phi in [0,2*pi]
+            (longitude), we can discritize into grid of size Nx2N.
+            */
 
-        /* The size of the matrix we will use.  Nx2N.  */
-        unsigned int nlat = ceil(    M_PI * radius[i]);
-        unsigned int nlon = ceil(2 * M_PI * radius[i]);
+            /* The size of the matrix we will use.  Nx2N.  */
+            unsigned int nlat = ceil(    M_PI * radius[i]);
+            unsigned int nlon = ceil(2 * M_PI * radius[i]);
 
-        // points on sphere are defined by two angles.
-        arma::vec theta = arma::linspace<arma::vec>(0.0,     M_PI, nlat);
-        arma::vec phi   = arma::linspace<arma::vec>(0.0, 2.0*M_PI, nlon);
+            // points on sphere are defined by two angles.
+            arma::vec theta = arma::linspace<arma::vec>(0.0,     M_PI, nlat);
+            arma::vec phi   = arma::linspace<arma::vec>(0.0, 2.0*M_PI, nlon);
 
-        arma::mat surface = arma::zeros<arma::mat>(nlat, nlon);
+            arma::mat surface = arma::zeros<arma::mat>(nlat, nlon);
 
-        // for each spherical coordinate (r, theta, phi) find the cartesian (x,y,z) coordiate.
-        //
-        // interpolate the function sampled by vol at that point.
-        arma::vec3 x;
-        for(size_t j = 0; j < nlat; j++)
-        {
-            double st = sin(theta[j]), ct = cos(theta[j]);
-            for(size_t k = 0; k < nlon; k++)
+            // for each spherical coordinate (r, theta, phi) find the cartesian (x,y,z) coordiate.
+            //
+            // interpolate the function sampled by vol at that point.
+            arma::vec3 x;
+            for(size_t j = 0; j < nlat; j++)
             {
-                double sp = sin(phi[k]), cp = cos(phi[k]);
-                x(0) = radius[i] * st * cp + center(0);
-                x(1) = radius[i] * st * sp + center(1);
-                x(2) = radius[i] * ct      + center(2);
-
-                surface(j,k) = ci(x);
+                double st = sin(theta[j]), ct = cos(theta[j]);
+                for(size_t k = 0; k < nlon; k++)
+                {
+                    double sp = sin(phi[k]), cp = cos(phi[k]);
+                    x(0) = radius[i] * st * cp + center(0);
+                    x(1) = radius[i] * st * sp + center(1);
+                    x(2) = radius[i] * ct      + center(2);
+
+                    surface(j,k) = ci(x);
+                }
             }
-        }
 
-        unsigned int Lnyq = std::min( ceil( (nlon - 1.0)/2.0),nlat - 1.0);
-        unsigned int L = std::min( Lnyq, max_l );
+            unsigned int Lnyq = std::min( ceil( (nlon - 1.0)/2.0),nlat - 1.0);
+            unsigned int L = std::min( Lnyq, max_l );
 
-        // do spherical harmonic transform and return the coefficients.
-        coefs.push_back(forward_sht(surface, L));
+            // do spherical harmonic transform and return the coefficients.
+            coefs[i] = forward_sht(surface, L);
+        }
+        catch(...)
+        {
+            err.capture();
+        }
     }
+    err.rethrow();
 
     return coefs;
 }
@@ -302,55 +369,76 @@ bool tup_compare(const std::tuple<double, arma::vec3, euler_angle> &a, const std
 }
 
 
-std::vector<std::tuple<double, arma::vec3, euler_angle> > combined_search( const arma::cube &vol1, const arma::cube &mask1, const arma::cube &vol2, const arma::cube &mask2, unsigned int L)
+template<class eT>
+std::vector<std::tuple<double, arma::vec3, euler_angle> > combined_search( const arma::Cube<eT> &vol1, const arma::Cube<eT> &mask1, const arma::Cube<eT> &vol2, const arma::Cube<eT> &mask2, unsigned int L)
 //std::vector<boost::tuple<double, arma::vec3, euler_angle> > combined_search( const arma::cube &vol1, const arma::cube &mask1, const arma::cube &vol2, const arma::cube &mask2, unsigned int L)
 {
     if( ! (arma::same_shape(vol1, vol2) && arma::same_shape(vol1, mask1) && arma::same_shape(vol1, mask2)) )
         throw fatal_error() << "combined_search: volumes and masks must all be same size.";
 
-    // fft in 3d of volume.  
-    arma::cx_cube fft1 = fft(vol1);
-    arma::cx_cube fft2 = fft(vol2);
+    return combined_search(combined_search_prepare(vol1, mask1, L), combined_search_prepare(vol2, mask2, L), L);
+}
 
-    // delete zero frequency coefficients so that the mean of real space values are zero
-    // set 0,0,0 entry to zero before shift instead of mid_co after shift.
-    fft1(0,0,0) = 0.0;
-    fft2(0,0,0) = 0.0;
 
-    // todo: clean up.
-    //fft1 = fftshift(fft1);
-    //fft2 = fftshift(fft2);
-    //arma::cube fft1_abs = arma::abs(fft1);
-    //arma::cube fft2_abs = arma::abs(fft2);
+template<class eT>
+combined_search_volume_t<eT> combined_search_prepare(const arma::Cube<eT> &vol, const arma::Cube<eT> &mask, unsigned int L)
+{
+    if( ! arma::same_shape(vol, mask) )
+        throw fatal_error() << "combined_search_prepare: volume and mask must be same size.";
 
-    arma::cube fft1_abs = arma::abs(fftshift(fft1));
-    arma::cube fft2_abs = arma::abs(fftshift(fft2));
+    combined_search_volume_t<eT> s;
+    s.vol  = vol;
+    s.mask = mask;
+    s.max_l = L;
 
+    // fft in 3d of volume.  
+    arma::Cube< std::complex<eT> > f = fft(vol);
 
-    // Create wigner D-matrices, used later.
-    //! @note consider precomputation and loading from disk, or saving across combined_search runs.
-    std::vector<arma::mat> wig_d = wigner_d(M_PI/2.0, L);
+    // delete zero frequency coefficients so that the mean of real space values are zero
+    // set 0,0,0 entry to zero before shift instead of mid_co after shift.
+    f(0,0,0) = 0.0;
 
+    s.fft_shift = fftshift(f);
+    arma::Cube<eT> fft_abs = arma::abs(s.fft_shift);
 
     // masks may be weights. need to be squared.
     // not necessarily 0/1.
-    arma::cube mask1sq = mask1 % mask1;
-    arma::cube mask2sq = mask2 % mask2;
-    
+    arma::Cube<eT> masksq = mask % mask;
+
     // one shell for every cube. N/2 shells.
-    std::vector<double> radius(arma::max(arma::shape(mask1))/2.0);
-    for(size_t i = 0; i < radius.size(); i++)
-        radius[i] = (i+1.0);
+    s.radius.resize(arma::max(arma::shape(mask))/2.0);
+    for(size_t i = 0; i < s.radius.size(); i++)
+        s.radius[i] = (i+1.0);
+
+    arma::vec3 mid_co = get_fftshift_center(vol);
+
+    s.coef_abs    = rot_search_expansion<eT>(fft_abs % masksq,           L, s.radius, mid_co);
+    s.coef_abs_sq = rot_search_expansion<eT>(fft_abs % fft_abs % masksq, L, s.radius, mid_co);
+    s.coef_mask   = rot_search_expansion<eT>(masksq,                     L, s.radius, mid_co);
+
+    return s;
+}
+
 
-    arma::vec3 mid_co = get_fftshift_center(vol1);
+template<class eT>
+std::vector<std::tuple<double, arma::vec3, euler_angle> > combined_search(const combined_search_volume_t<eT> &s1, const combined_search_volume_t<eT> &s2, unsigned int L, size_t top_n)
+{
+    if( ! arma::same_shape(s1.vol, s2.vol) )
+        throw fatal_error() << "combined_search: volumes and masks must all be same size.";
+
+    if( (s1.max_l != L) || (s2.max_l != L) )
+        throw fatal_error() << "combined_search: volumes were prepared with a different max_l.";
 
-    arma::cx_cube cors_12 = rot_search_cor(fft1_abs % mask1sq, fft2_abs % mask2sq, L, radius, wig_d, mid_co);
+    // Wigner d-matrices only depend on L, they are computed once per process.
+    const std::vector<arma::mat> &wig_d = wigner_d_cached(M_PI/2.0, L);
+
+    arma::cx_cube cors_12 = rot_search_cor(s1.coef_abs, s2.coef_abs, L, s1.radius, wig_d);
 
     // denominator left part.
-    arma::cx_cube sqt_cors_11 = arma::sqrt(rot_search_cor( fft1_abs % fft1_abs % mask1sq, mask2sq, L, radius, wig_d, mid_co));
+    arma::cx_cube sqt_cors_11 = arma::sqrt(rot_search_cor(s1.coef_abs_sq, s2.coef_mask, L, s1.radius, wig_d));
     
     // denominator right part.
-    arma::cx_cube sqt_cors_22 = arma::sqrt(rot_search_cor( mask1sq, fft2_abs % fft2_abs % mask2sq, L, radius, wig_d, mid_co));
+    arma::cx_cube sqt_cors_22 = arma::sqrt(rot_search_cor(s1.coef_mask, s2.coef_abs_sq, L, s1.radius, wig_d));
 
     arma::cx_cube cors = cors_12 / (sqt_cors_11 % sqt_cors_22);
 
@@ -382,15 +470,28 @@ std::vector<std::tuple<double, arma::vec3, euler_angle> > combined_search( const
 
     std::vector<double> scores(angs.size());
 
+    // the translation search of each candidate angle is independent.
+    parallel_error err;
+    #pragma omp parallel for num_threads(get_num_threads()) schedule(dynamic)
+    for(int i = 0; i < (int)angs.size(); i++)
+    {
+        try
+        {
+            std::tie(locs_r[i], scores[i]) = cons_corr_max(s1.fft_shift, s1.mask, s2.vol, s2.mask, angs[i]);
+            //boost::tie(locs_r[i], scores[i]) = cons_corr_max(vol1, mask1, vol2, mask2, angs[i]);
+        }
+        catch(...)
+        {
+            err.capture();
+        }
+    }
+    err.rethrow();
+
     // We will return the list of best matches in a tuple of : (score, trans, rot)
     // where the given translation/rotation will give the correlation score.
     for(size_t i = 0; i < angs.size(); i++)
-    {
-        std::tie(locs_r[i], scores[i]) = cons_corr_max(vol1, mask1, vol2, mask2, angs[i]);
-        //boost::tie(locs_r[i], scores[i]) = cons_corr_max(vol1, mask1, vol2, mask2, angs[i]);
         angs_locs_scores.push_back(std::make_tuple(scores[i], locs_r[i], angs[i]));
         //angs_locs_scores.push_back(boost::make_tuple(scores[i], locs_r[i], angs[i]));
-    }
     
     // sort the list by decreasing score.
     std::sort(angs_locs_scores.begin(), angs_locs_scores.end(), tup_compare);
@@ -400,5 +501,52 @@ std::vector<std::tuple<double, arma::vec3, euler_angle> > combined_search( const
     {
         throw fatal_error() << "combined_search failed to find any matches";
     }    
+
+    if( (top_n > 0) && (angs_locs_scores.size() > top_n) )
+        angs_locs_scores.resize(top_n);
+
     return angs_locs_scores;
 }
+
+
+template<class eT>
+std::vector<std::vector<std::tuple<double, arma::vec3, euler_angle> > > combined_search_batch(const std::vector<combined_search_volume_t<eT> > &s1, const std::vector<combined_search_volume_t<eT> > &s2, unsigned int L, size_t top_n)
+{
+    std::vector<std::vector<std::tuple<double, arma::vec3, euler_angle> > > res(s1.size() * s2.size());
+
+    // pairs are independent, the loops inside combined_search run serially when nested.
+    parallel_error err;
+    #pragma omp parallel for num_threads(get_num_threads()) schedule(dynamic)
+    for(int p = 0; p < (int)res.size(); p++)
+    {
+        try
+        {
+            res[p] = combined_search(s1[p / s2.size()], s2[p % s2.size()], L, top_n);
+        }
+        catch(...)
+        {
+            err.capture();
+        }
+    }
+    err.rethrow();
+
+    return res;
+}
+
+
+/*
+    The alignment functions are instantiated for double and single precision volumes.
+*/
+
+#define TOMO_ALIGN_INSTANTIATE(eT) \
+    template std::tuple<arma::vec3, double> cons_corr_max(const arma::Cube<eT> &v1, const arma::Cube<eT> &m1, const arma::Cube<eT> &v2, const arma::Cube<eT> &m2, euler_angle ang); \
+    template std::tuple<arma::vec3, double> cons_corr_max(const arma::Cube< std::complex<eT> > &vol1_fft_shift, const arma::Cube<eT> &m1, const arma::Cube<eT> &v2, const arma::Cube<eT> &m2, euler_angle ang); \
+    template arma::cx_cube rot_search_cor(const arma::Cube<eT> &vol1, const arma::Cube<eT> &vol2, unsigned int max_l, const std::vector<double> &radius, const std::vector<arma::mat> &wig_d, arma::vec3 mid_co); \
+    template std::vector<arma::cx_mat> rot_search_expansion(const arma::Cube<eT> &vol, unsigned int max_l, const std::vector<double> &radius, arma::vec3 mid_co); \
+    template std::vector<std::tuple<double, arma::vec3, euler_angle> > combined_search(const arma::Cube<eT> &vol1, const arma::Cube<eT> &mask1, const arma::Cube<eT> &vol2, const arma::Cube<eT> &mask2, unsigned int max_l); \
+    template combined_search_volume_t<eT> combined_search_prepare(const arma::Cube<eT> &vol, const arma::Cube<eT> &mask, unsigned int max_l); \
+    template std::vector<std::tuple<double, arma::vec3, euler_angle> > combined_search(const combined_search_volume_t<eT> &s1, const combined_search_volume_t<eT> &s2, unsigned int max_l, size_t top_n); \
+    template std::vector<std::vector<std::tuple<double, arma::vec3, euler_angle> > > combined_search_batch(const std::vector<combined_search_volume_t<eT> > &s1, const std::vector<combined_search_volume_t<eT> > &s2, unsigned int max_l, size_t top_n);
+
+TOMO_ALIGN_INSTANTIATE(double)
+TOMO_ALIGN_INSTANTIATE(float)
@@ -133,9 +133,18 @@ std::complex<double> trapz(const arma::vec &x, const arma::cx_vec &y);
     displacement.
 
 */
-std::tuple<arma::vec3, double> cons_corr_max(const arma::cube &v1, const arma::cube &m1, const arma::cube &v2, const arma::cube &m2, euler_angle ang);
+template<class eT>
+std::tuple<arma::vec3, double> cons_corr_max(const arma::Cube<eT> &v1, const arma::Cube<eT> &m1, const arma::Cube<eT> &v2, const arma::Cube<eT> &m2, euler_angle ang);
 //boost::tuple<arma::vec3, double> cons_corr_max(const arma::cube &v1, const arma::cube &m1, const arma::cube &v2, const arma::cube &m2, euler_angle ang);
 
+/**
+    Same as cons_corr_max() above, with the FFT of the first tomogram given.
+
+    @param vol1_fft_shift fftshift(fft(v1)) with the zero frequency entry set to zero.
+*/
+template<class eT>
+std::tuple<arma::vec3, double> cons_corr_max(const arma::Cube< std::complex<eT> > &vol1_fft_shift, const arma::Cube<eT> &m1, const arma::Cube<eT> &v2, const arma::Cube<eT> &m2, euler_angle ang);
+
 
 
 /**
@@ -176,7 +185,17 @@ std::tuple<arma::vec3, double> cons_corr_max(const arma::cube &v1, const arma::c
 
     @note this function has been combined with rot_search() from the MATLAB version.
 */
-arma::cx_cube rot_search_cor(const arma::cube &vol1, const arma::cube &vol2, unsigned int max_l, const std::vector<double> &radius, const std::vector<arma::mat> &wig_d, arma::vec3 mid_co);
+template<class eT>
+arma::cx_cube rot_search_cor(const arma::Cube<eT> &vol1, const arma::Cube<eT> &vol2, unsigned int max_l, const std::vector<double> &radius, const std::vector<arma::mat> &wig_d, arma::vec3 mid_co);
+
+/**
+    Same as rot_search_cor() above, with the spherical harmonic expansions of
+    both volumes given, see rot_search_expansion().
+
+    @param coef1    expansion of the first volume
+    @param coef2    expansion of the second volume
+*/
+arma::cx_cube rot_search_cor(const std::vector<arma::cx_mat> &coef1, const std::vector<arma::cx_mat> &coef2, unsigned int max_l, const std::vector<double> &radius, const std::vector<arma::mat> &wig_d);
 
 
 /**
@@ -205,7 +224,8 @@ arma::cx_cube rot_search_cor(const arma::cube &vol1, const arma::cube &vol2, uns
     @param radius the radii to use in sampling
     @return the set of spherical harmonic coefficients for each radius.
 */
-std::vector<arma::cx_mat> rot_search_expansion(const arma::cube &vol, unsigned int max_l, const std::vector<double> &radius, arma::vec3 mid_co);
+template<class eT>
+std::vector<arma::cx_mat> rot_search_expansion(const arma::Cube<eT> &vol, unsigned int max_l, const std::vector<double> &radius, arma::vec3 mid_co);
 
 
 /**
@@ -260,11 +280,77 @@ std::tuple<std::vector<euler_angle>, std::vector<double> > local_max_angles(cons
     @returns A list of the best transformations found.  Each entry in the
     results list is a tuple containing the alignment correlation score, the
     translation, and the rotation.
+
+    @note instantiated for arma::cube and arma::fcube.  Single precision
+    volumes keep their FFTs, rotations and translational search in float, the
+    rotational search over the spherical harmonic expansions is done in double.
 */
-std::vector<std::tuple<double, arma::vec3, euler_angle> > combined_search( const arma::cube &vol1, const arma::cube &mask1, const arma::cube &vol2, const arma::cube &mask2, unsigned int max_l);
+template<class eT>
+std::vector<std::tuple<double, arma::vec3, euler_angle> > combined_search( const arma::Cube<eT> &vol1, const arma::Cube<eT> &mask1, const arma::Cube<eT> &vol2, const arma::Cube<eT> &mask2, unsigned int max_l);
 //std::vector<boost::tuple<double, arma::vec3, euler_angle> > combined_search( const arma::cube &vol1, const arma::cube &mask1, const arma::cube &vol2, const arma::cube &mask2, unsigned int max_l);
 
 
+/**
+    The part of combined_search() that only depends on one of the two volumes.
+
+    When one volume is aligned against many others (a subtomogram against a
+    set of templates, or a set of subtomograms against one template), the FFT
+    and the spherical harmonic expansions of every volume are computed once
+    with combined_search_prepare() and reused for every pair.
+
+    The volumes, their FFTs and the translational search are kept in the
+    precision of the input (double or float), the spherical harmonic
+    expansions and the rotational search are always done in double.
+*/
+template<class eT>
+struct combined_search_volume_t
+{
+    arma::Cube<eT> vol;
+    arma::Cube<eT> mask;
+    unsigned int max_l;
+
+    /** fftshift(fft(vol)) with the zero frequency entry set to zero. */
+    arma::Cube< std::complex<eT> > fft_shift;
+
+    /** radii of the shells used in the expansions. */
+    std::vector<double> radius;
+
+    /** expansions of |FFT| % mask^2, |FFT|^2 % mask^2 and mask^2. */
+    std::vector<arma::cx_mat> coef_abs;
+    std::vector<arma::cx_mat> coef_abs_sq;
+    std::vector<arma::cx_mat> coef_mask;
+};
+
+typedef combined_search_volume_t<double> combined_search_volume;
+typedef combined_search_volume_t<float>  combined_search_volume_float;
+
+/**
+    Precompute the per volume state of combined_search().
+
+    @param vol      a cubic volume of data. 
+    @param mask     a mask to be applied to the data.
+    @param max_l    maximum degree of spherical harmonic expansion to use.
+*/
+template<class eT>
+combined_search_volume_t<eT> combined_search_prepare(const arma::Cube<eT> &vol, const arma::Cube<eT> &mask, unsigned int max_l);
+
+/**
+    combined_search() of two prepared volumes, the second one is rotated.
+
+    @param top_n    if > 0, only the top_n best transformations are returned.
+*/
+template<class eT>
+std::vector<std::tuple<double, arma::vec3, euler_angle> > combined_search(const combined_search_volume_t<eT> &s1, const combined_search_volume_t<eT> &s2, unsigned int max_l, size_t top_n=0);
+
+/**
+    combined_search() of every pair (s1[i], s2[j]).
+
+    @returns the results of the pair (i, j) at index i * s2.size() + j.
+*/
+template<class eT>
+std::vector<std::vector<std::tuple<double, arma::vec3, euler_angle> > > combined_search_batch(const std::vector<combined_search_volume_t<eT> > &s1, const std::vector<combined_search_volume_t<eT> > &s2, unsigned int max_l, size_t top_n=0);
+
+
 /**
   Compare two tuples based on their first item which is a double.
 
@@ -1,6 +1,8 @@
 #ifndef TOMO_FFT_HPP
 #define TOMO_FFT_HPP
 
+#include <string>
+
 #include <armadillo>
 
 using arma::span;
@@ -198,6 +200,79 @@ arma::cube    ifftr(const arma::cx_cube &X);
 
 
 
+/**
+    @}
+*/
+
+/** @name 3D single precision FFT functions.
+    @{
+
+    Single precision versions of the 3D transforms, with the same
+    normalization.  They use the fftwf_ plans and halve the memory traffic of
+    the transforms of float valued subtomograms.
+*/
+arma::cx_fcube fft(const arma::fcube &X);
+
+arma::fcube    ifftr(const arma::cx_fcube &X);
+
+arma::cx_fcube fft(const arma::cx_fcube &X);
+
+arma::cx_fcube ifft(const arma::cx_fcube &X);
+
+
+
+/**
+    @}
+*/
+/** @name FFT plan cache and wisdom.
+    @{
+
+    FFTW plans are cached by transform kind, shape and planning rigor, so
+    repeated transforms of the same shape only pay for planning once.  The
+    accumulated FFTW wisdom can be saved to and loaded from a file so that
+    new worker processes start with good plans.  Single and double precision
+    plans are cached separately, the single precision wisdom is kept in a
+    second file with the suffix ".float".
+*/
+
+/**
+    Select the FFTW planning rigor used for new plans.
+
+    @param rigor one of "estimate" (default), "measure", "patient", "exhaustive".
+*/
+void fft_set_plan_rigor(const std::string &rigor);
+
+/**
+    @return the current planning rigor.
+*/
+std::string fft_get_plan_rigor();
+
+/**
+    Destroy all cached plans.
+*/
+void fft_plan_cache_clear();
+
+/**
+    @return number of cached plans.
+*/
+size_t fft_plan_cache_size();
+
+/**
+    Export the accumulated FFTW wisdom.
+
+    @param filename file to write to.
+    @return true on success.
+*/
+bool fft_wisdom_export(const std::string &filename);
+
+/**
+    Import FFTW wisdom, it is used by plans created afterwards.
+
+    @param filename file to read from.
+    @return true on success.
+*/
+bool fft_wisdom_import(const std::string &filename);
+
 /**
     @}
 */
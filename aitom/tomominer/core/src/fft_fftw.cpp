@@ -1,15 +1,21 @@
 
 #include <fftw3.h>
 #include <armadillo>
+#include <map>
+#include <mutex>
+#include <string>
+#include <tuple>
+
+#include "fatal_error.hpp"
 /**
     @note For real valued inputs FFTW will fill only the first 1/2 of the
     array, the second half can be derived from the fact that the signal is
     hermetian for real valued inputs. For multidimensional input the array is
     filled as if the first dimension is halved. 
     
-    @note FFTW will overwrite data while building plans!  Either call plan, and
-    the fill input array, or use a planning method that is safe, FFTW_ESTIMATE
-    for example.  
+    @note FFTW will overwrite data while building plans!  Plans are therefore
+    built on scratch buffers and cached (see fft_plan_get below), and the
+    cached plans are executed on the actual arrays.
 
     @note For real valued inverse FFT, we assume that vector was generated from
     real data.  We use the Hermitian property of the vector \f$X\f$: (\f$X_k =
@@ -22,6 +28,267 @@
 
 */
 
+
+/***************************** 
+  Plan cache.
+*****************************/
+
+/**
+    Plans are cached by transform kind, shape, planning rigor and the SIMD
+    alignment of the input and output arrays, and executed on the actual
+    arrays with the new-array execute functions.  Planning is done on scratch
+    buffers of the same alignment, so FFTW_MEASURE/FFTW_PATIENT never
+    overwrite user data.  The FFTW planner is not thread safe, so planning is
+    serialized by a mutex; executing a plan is thread safe.
+*/
+
+namespace
+{
+
+enum fft_kind { FFT_R2C, FFT_C2R, FFT_C2C_FORWARD, FFT_C2C_BACKWARD };
+
+// (kind, rank, n0, n1, n2, in alignment, out alignment, rigor)
+typedef std::tuple<int, int, int, int, int, int, int, unsigned int> fft_plan_key;
+
+/**
+    The double (fftw_) and single (fftwf_) precision FFTW interfaces, so the
+    plan cache and the transforms below can be written once for both.
+*/
+template<class eT> struct fftw_api;
+
+template<> struct fftw_api<double>
+{
+    typedef fftw_plan    plan;
+    typedef fftw_complex complex;
+
+    static int  alignment_of(double *p)   { return fftw_alignment_of(p); }
+    static void destroy_plan(plan p)      { fftw_destroy_plan(p); }
+
+    static plan plan_r2c(int rank, const int *n, double *in, complex *out, unsigned int flags) { return fftw_plan_dft_r2c(rank, n, in, out, flags); }
+    static plan plan_c2r(int rank, const int *n, complex *in, double *out, unsigned int flags) { return fftw_plan_dft_c2r(rank, n, in, out, flags); }
+    static plan plan_c2c(int rank, const int *n, complex *in, complex *out, int sign, unsigned int flags) { return fftw_plan_dft(rank, n, in, out, sign, flags); }
+
+    static void execute_r2c(plan p, double *in, complex *out)  { fftw_execute_dft_r2c(p, in, out); }
+    static void execute_c2r(plan p, complex *in, double *out)  { fftw_execute_dft_c2r(p, in, out); }
+    static void execute_c2c(plan p, complex *in, complex *out) { fftw_execute_dft(p, in, out); }
+
+    static int export_wisdom(const char *filename) { return fftw_export_wisdom_to_filename(filename); }
+    static int import_wisdom(const char *filename) { return fftw_import_wisdom_from_filename(filename); }
+};
+
+template<> struct fftw_api<float>
+{
+    typedef fftwf_plan    plan;
+    typedef fftwf_complex complex;
+
+    static int  alignment_of(float *p)    { return fftwf_alignment_of(p); }
+    static void destroy_plan(plan p)      { fftwf_destroy_plan(p); }
+
+    static plan plan_r2c(int rank, const int *n, float *in, complex *out, unsigned int flags) { return fftwf_plan_dft_r2c(rank, n, in, out, flags); }
+    static plan plan_c2r(int rank, const int *n, complex *in, float *out, unsigned int flags) { return fftwf_plan_dft_c2r(rank, n, in, out, flags); }
+    static plan plan_c2c(int rank, const int *n, complex *in, complex *out, int sign, unsigned int flags) { return fftwf_plan_dft(rank, n, in, out, sign, flags); }
+
+    static void execute_r2c(plan p, float *in, complex *out)   { fftwf_execute_dft_r2c(p, in, out); }
+    static void execute_c2r(plan p, complex *in, float *out)   { fftwf_execute_dft_c2r(p, in, out); }
+    static void execute_c2c(plan p, complex *in, complex *out) { fftwf_execute_dft(p, in, out); }
+
+    static int export_wisdom(const char *filename) { return fftwf_export_wisdom_to_filename(filename); }
+    static int import_wisdom(const char *filename) { return fftwf_import_wisdom_from_filename(filename); }
+};
+
+template<class eT>
+struct fft_plan_cache_t
+{
+    std::map<fft_plan_key, typename fftw_api<eT>::plan> plans;
+
+    ~fft_plan_cache_t()
+    {
+        clear();
+    }
+
+    void clear()
+    {
+        for(auto &p : plans)
+            fftw_api<eT>::destroy_plan(p.second);
+        plans.clear();
+    }
+};
+
+std::mutex fft_plan_mutex;
+
+// planning rigor, shared by both precisions.
+unsigned int fft_plan_rigor = FFTW_ESTIMATE;
+
+template<class eT>
+fft_plan_cache_t<eT> &fft_plan_cache()
+{
+    static fft_plan_cache_t<eT> c;
+    return c;
+}
+
+/**
+    Get a plan for the given transform.
+
+    @param kind transform kind.
+    @param rank 1, 2 or 3.
+    @param n dimensions in FFTW (row major) order, the last one varies fastest.
+    @param in input array the plan will be executed on.
+    @param out output array the plan will be executed on.
+*/
+template<class eT>
+typename fftw_api<eT>::plan fft_plan_get(fft_kind kind, int rank, const int *n, const void *in, const void *out)
+{
+    typedef fftw_api<eT> api;
+    typedef typename api::complex complex;
+
+    std::lock_guard<std::mutex> lock(fft_plan_mutex);
+    fft_plan_cache_t<eT> &cache = fft_plan_cache<eT>();
+
+    int in_align  = api::alignment_of((eT *)in);
+    int out_align = api::alignment_of((eT *)out);
+
+    int n0 = n[0], n1 = (rank > 1) ? n[1] : 1, n2 = (rank > 2) ? n[2] : 1;
+    fft_plan_key key(kind, rank, n0, n1, n2, in_align, out_align, fft_plan_rigor);
+
+    auto it = cache.plans.find(key);
+    if(it != cache.plans.end())
+        return it->second;
+
+    // number of real and complex elements, the last dimension of a real transform is halved.
+    size_t n_real = (size_t)n0 * n1 * n2;
+    size_t n_half = (n_real / n[rank-1]) * (n[rank-1] / 2 + 1);
+
+    size_t in_bytes, out_bytes;
+    switch(kind)
+    {
+        case FFT_R2C: in_bytes = n_real * sizeof(eT);      out_bytes = n_half * sizeof(complex); break;
+        case FFT_C2R: in_bytes = n_half * sizeof(complex); out_bytes = n_real * sizeof(eT);      break;
+        default:      in_bytes = n_real * sizeof(complex); out_bytes = n_real * sizeof(complex); break;
+    }
+
+    // scratch buffers with the same alignment as the arrays the plan will be executed on.
+    char *in_buf  = (char *)fftw_malloc(in_bytes + 64);
+    char *out_buf = (char *)fftw_malloc(out_bytes + 64);
+    void *in_s  = in_buf  + in_align;
+    void *out_s = out_buf + out_align;
+
+    typename api::plan plan = NULL;
+    switch(kind)
+    {
+        case FFT_R2C:
+            plan = api::plan_r2c(rank, n, (eT *)in_s, (complex *)out_s, fft_plan_rigor);
+            break;
+        case FFT_C2R:
+            plan = api::plan_c2r(rank, n, (complex *)in_s, (eT *)out_s, fft_plan_rigor);
+            break;
+        case FFT_C2C_FORWARD:
+            plan = api::plan_c2c(rank, n, (complex *)in_s, (complex *)out_s, FFTW_FORWARD, fft_plan_rigor);
+            break;
+        case FFT_C2C_BACKWARD:
+            plan = api::plan_c2c(rank, n, (complex *)in_s, (complex *)out_s, FFTW_BACKWARD, fft_plan_rigor);
+            break;
+    }
+
+    fftw_free(in_buf);
+    fftw_free(out_buf);
+
+    if(plan == NULL)
+        throw fatal_error() << "fft: FFTW failed to create a plan.";
+
+    cache.plans[key] = plan;
+    return plan;
+}
+
+template<class eT>
+void fft_execute_r2c(int rank, const int *n, const eT *in, std::complex<eT> *out)
+{
+    typedef fftw_api<eT> api;
+    typename api::plan plan = fft_plan_get<eT>(FFT_R2C, rank, n, in, out);
+    api::execute_r2c(plan, (eT *)in, (typename api::complex *)out);
+}
+
+template<class eT>
+void fft_execute_c2r(int rank, const int *n, std::complex<eT> *in, eT *out)
+{
+    typedef fftw_api<eT> api;
+    typename api::plan plan = fft_plan_get<eT>(FFT_C2R, rank, n, in, out);
+    api::execute_c2r(plan, (typename api::complex *)in, out);
+}
+
+template<class eT>
+void fft_execute_c2c(int rank, const int *n, const std::complex<eT> *in, std::complex<eT> *out, int sign)
+{
+    typedef fftw_api<eT> api;
+    typename api::plan plan = fft_plan_get<eT>((sign == FFTW_FORWARD) ? FFT_C2C_FORWARD : FFT_C2C_BACKWARD, rank, n, in, out);
+    api::execute_c2c(plan, (typename api::complex *)in, (typename api::complex *)out);
+}
+
+} // namespace
+
+
+void fft_set_plan_rigor(const std::string &rigor)
+{
+    unsigned int flags;
+    if(rigor == "estimate")
+        flags = FFTW_ESTIMATE;
+    else if(rigor == "measure")
+        flags = FFTW_MEASURE;
+    else if(rigor == "patient")
+        flags = FFTW_PATIENT;
+    else if(rigor == "exhaustive")
+        flags = FFTW_EXHAUSTIVE;
+    else
+        throw fatal_error() << "fft_set_plan_rigor: unknown rigor " << rigor << ", use estimate, measure, patient or exhaustive.";
+
+    std::lock_guard<std::mutex> lock(fft_plan_mutex);
+    fft_plan_rigor = flags;
+}
+
+std::string fft_get_plan_rigor()
+{
+    std::lock_guard<std::mutex> lock(fft_plan_mutex);
+    switch(fft_plan_rigor)
+    {
+        case FFTW_MEASURE:    return "measure";
+        case FFTW_PATIENT:    return "patient";
+        case FFTW_EXHAUSTIVE: return "exhaustive";
+        default:              return "estimate";
+    }
+}
+
+void fft_plan_cache_clear()
+{
+    std::lock_guard<std::mutex> lock(fft_plan_mutex);
+    fft_plan_cache<double>().clear();
+    fft_plan_cache<float>().clear();
+}
+
+size_t fft_plan_cache_size()
+{
+    std::lock_guard<std::mutex> lock(fft_plan_mutex);
+    return fft_plan_cache<double>().plans.size() + fft_plan_cache<float>().plans.size();
+}
+
+/*
+    FFTW keeps separate wisdom for each precision, the single precision wisdom
+    is stored next to the double precision one with a ".float" suffix.
+*/
+
+bool fft_wisdom_export(const std::string &filename)
+{
+    std::lock_guard<std::mutex> lock(fft_plan_mutex);
+    bool ok = fftw_api<double>::export_wisdom(filename.c_str()) != 0;
+    return fftw_api<float>::export_wisdom((filename + ".float").c_str()) != 0 && ok;
+}
+
+bool fft_wisdom_import(const std::string &filename)
+{
+    std::lock_guard<std::mutex> lock(fft_plan_mutex);
+    // a missing single precision file is not an error, it may have been written before float support existed.
+    fftw_api<float>::import_wisdom((filename + ".float").c_str());
+    return fftw_api<double>::import_wisdom(filename.c_str()) != 0;
+}
+
 /***************************** 
   1D. 
 *****************************/
@@ -30,11 +297,8 @@ arma::cx_vec fft(const arma::vec &X)
 {
     arma::cx_vec out(X.n_elem);
 
-    fftw_plan plan = fftw_plan_dft_r2c_1d(X.n_elem, (double *)(X.memptr()), (fftw_complex *)out.memptr(), FFTW_ESTIMATE);
-
-    fftw_execute(plan);
-
-    fftw_destroy_plan(plan);
+    int n[1] = {(int)X.n_elem};
+    fft_execute_r2c(1, n, X.memptr(), out.memptr());
 
     // fill in remainder for compatability with matlab.
     for(size_t i = out.n_elem/2+1; i < out.n_elem; i++)
@@ -46,13 +310,12 @@ arma::cx_vec fft(const arma::vec &X)
 
 arma::vec ifftr(const arma::cx_vec &X)
 {
+    // c2r transforms overwrite their input.
+    arma::cx_vec in = X;
     arma::vec    out(X.n_elem);
 
-    fftw_plan plan = fftw_plan_dft_c2r_1d(X.n_elem, (fftw_complex *)X.memptr(), out.memptr(), FFTW_ESTIMATE);
-
-    fftw_execute(plan);
-
-    fftw_destroy_plan(plan);
+    int n[1] = {(int)X.n_elem};
+    fft_execute_c2r(1, n, in.memptr(), out.memptr());
 
     out /= out.n_elem;
     return out;
@@ -62,11 +325,8 @@ arma::cx_vec fft(const arma::cx_vec &X)
 {
     arma::cx_vec out(X.n_elem);
 
-    fftw_plan plan = fftw_plan_dft_1d(X.n_elem, (fftw_complex *)X.memptr(), (fftw_complex *)out.memptr(), FFTW_FORWARD, FFTW_ESTIMATE);
-
-    fftw_execute(plan);
-
-    fftw_destroy_plan(plan);
+    int n[1] = {(int)X.n_elem};
+    fft_execute_c2c(1, n, X.memptr(), out.memptr(), FFTW_FORWARD);
 
     return out;
 }
@@ -76,11 +336,8 @@ arma::cx_vec ifft(const arma::cx_vec &X)
 {
     arma::cx_vec out(X.n_elem);
 
-    fftw_plan plan = fftw_plan_dft_1d(X.n_elem, (fftw_complex *)X.memptr(), (fftw_complex*)out.memptr(), FFTW_BACKWARD, FFTW_ESTIMATE);
-    
-    fftw_execute(plan);
-
-    fftw_destroy_plan(plan);
+    int n[1] = {(int)X.n_elem};
+    fft_execute_c2c(1, n, X.memptr(), out.memptr(), FFTW_BACKWARD);
     
     out /= out.n_elem;
     return out;
@@ -98,11 +355,8 @@ arma::cx_mat fft(const arma::cx_mat &X)
 {
     arma::cx_mat out(X.n_rows, X.n_cols);
 
-    fftw_plan plan = fftw_plan_dft_2d(X.n_cols, X.n_rows, (fftw_complex *)X.memptr(), (fftw_complex *)out.memptr(), FFTW_FORWARD, FFTW_ESTIMATE);
-
-    fftw_execute(plan);
-
-    fftw_destroy_plan(plan);
+    int n[2] = {(int)X.n_cols, (int)X.n_rows};
+    fft_execute_c2c(2, n, X.memptr(), out.memptr(), FFTW_FORWARD);
 
     return out;
 }
@@ -112,11 +366,8 @@ arma::cx_mat ifft(const arma::cx_mat &X)
 {
     arma::cx_mat out(X.n_rows, X.n_cols);
 
-    fftw_plan plan = fftw_plan_dft_2d(X.n_cols, X.n_rows, (fftw_complex *)X.memptr(), (fftw_complex*)out.memptr(), FFTW_BACKWARD, FFTW_ESTIMATE);
-
-    fftw_execute(plan);
-
-    fftw_destroy_plan(plan);
+    int n[2] = {(int)X.n_cols, (int)X.n_rows};
+    fft_execute_c2c(2, n, X.memptr(), out.memptr(), FFTW_BACKWARD);
 
     out /= out.n_elem;
     return out;
@@ -127,11 +378,8 @@ arma::cx_mat fft(const arma::mat &X)
 
     arma::cx_mat out = arma::zeros<arma::cx_mat>(X.n_rows / 2 + 1, X.n_cols);
 
-    fftw_plan plan = fftw_plan_dft_r2c_2d(X.n_cols, X.n_rows, (double *)X.memptr(), (fftw_complex *)out.memptr(), FFTW_ESTIMATE);
-
-    fftw_execute(plan);
-
-    fftw_destroy_plan(plan);
+    int n[2] = {(int)X.n_cols, (int)X.n_rows};
+    fft_execute_r2c(2, n, X.memptr(), out.memptr());
 
     out.resize(X.n_rows, X.n_cols);
 
@@ -152,11 +400,8 @@ arma::mat ifftr(const arma::cx_mat &X)
     arma::cx_mat in = X(arma::span(0, X.n_rows / 2), arma::span());
     arma::mat    out(X.n_rows, X.n_cols);
 
-    fftw_plan plan = fftw_plan_dft_c2r_2d(out.n_cols, out.n_rows, (fftw_complex *)in.memptr(), out.memptr(), FFTW_ESTIMATE);
-
-    fftw_execute(plan);
-
-    fftw_destroy_plan(plan);
+    int n[2] = {(int)out.n_cols, (int)out.n_rows};
+    fft_execute_c2r(2, n, in.memptr(), out.memptr());
 
     out /= out.n_elem;
     return out;
@@ -169,15 +414,21 @@ arma::mat ifftr(const arma::cx_mat &X)
 *****************************/
 
 
-arma::cx_cube fft(const arma::cube &X)
+/*
+    The 3D transforms are written once for both precisions, the public
+    functions below pick the precision from the argument type.
+*/
+
+namespace
 {
-    arma::cx_cube out(X.n_rows / 2 + 1, X.n_cols, X.n_slices);
 
-    fftw_plan plan = fftw_plan_dft_r2c_3d(X.n_slices, X.n_cols, X.n_rows, (double *)X.memptr(), (fftw_complex *)out.memptr(), FFTW_ESTIMATE);
+template<class eT>
+arma::Cube< std::complex<eT> > fft3(const arma::Cube<eT> &X)
+{
+    arma::Cube< std::complex<eT> > out(X.n_rows / 2 + 1, X.n_cols, X.n_slices);
 
-    fftw_execute(plan);
-    
-    fftw_destroy_plan(plan);
+    int n[3] = {(int)X.n_slices, (int)X.n_cols, (int)X.n_rows};
+    fft_execute_r2c(3, n, X.memptr(), out.memptr());
 
     out.resize(X.n_rows, X.n_cols, X.n_slices);
 
@@ -200,45 +451,80 @@ arma::cx_cube fft(const arma::cube &X)
     return out;
 }
 
-arma::cube ifftr(const arma::cx_cube &X)
+template<class eT>
+arma::Cube<eT> ifftr3(const arma::Cube< std::complex<eT> > &X)
 {
-    arma::cx_cube in = X(arma::span(0, X.n_rows / 2), arma::span(), arma::span());
+    arma::Cube< std::complex<eT> > in = X(arma::span(0, X.n_rows / 2), arma::span(), arma::span());
 
-    arma::cube ifft(X.n_rows, X.n_cols, X.n_slices);
+    arma::Cube<eT> ifft(X.n_rows, X.n_cols, X.n_slices);
 
-    fftw_plan plan = fftw_plan_dft_c2r_3d(X.n_slices, X.n_cols, X.n_rows, (fftw_complex *)in.memptr(), ifft.memptr(), FFTW_ESTIMATE);
+    int n[3] = {(int)X.n_slices, (int)X.n_cols, (int)X.n_rows};
+    fft_execute_c2r(3, n, in.memptr(), ifft.memptr());
 
-    fftw_execute(plan);
+    return ifft/(eT)(X.n_rows * X.n_cols * X.n_slices);
+}
+
+template<class eT>
+arma::Cube< std::complex<eT> > fft3(const arma::Cube< std::complex<eT> > &X)
+{
+    arma::Cube< std::complex<eT> > fft(X.n_rows, X.n_cols, X.n_slices);
 
-    fftw_destroy_plan(plan);
+    int n[3] = {(int)X.n_slices, (int)X.n_cols, (int)X.n_rows};
+    fft_execute_c2c(3, n, X.memptr(), fft.memptr(), FFTW_FORWARD);
 
-    return ifft/(X.n_rows * X.n_cols * X.n_slices);
+    return fft;
 }
 
-arma::cx_cube fft(const arma::cx_cube &X)
+template<class eT>
+arma::Cube< std::complex<eT> > ifft3(const arma::Cube< std::complex<eT> > &X)
 {
-    arma::cx_cube fft(X.n_rows, X.n_cols, X.n_slices);
+    arma::Cube< std::complex<eT> > ifft(X.n_rows, X.n_cols, X.n_slices);
 
-    fftw_plan plan = fftw_plan_dft_3d(X.n_slices, X.n_cols, X.n_rows, (fftw_complex *)X.memptr(), (fftw_complex *)fft.memptr(), FFTW_FORWARD, FFTW_ESTIMATE);
+    int n[3] = {(int)X.n_slices, (int)X.n_cols, (int)X.n_rows};
+    fft_execute_c2c(3, n, X.memptr(), ifft.memptr(), FFTW_BACKWARD);
 
-    fftw_execute(plan);
+    return ifft/std::complex<eT>((eT)(X.n_rows * X.n_cols * X.n_slices));
+}
 
-    fftw_destroy_plan(plan);
+} // namespace
 
-    return fft;
+
+arma::cx_cube fft(const arma::cube &X)
+{
+    return fft3(X);
 }
 
+arma::cube ifftr(const arma::cx_cube &X)
+{
+    return ifftr3(X);
+}
 
-arma::cx_cube ifft(const arma::cx_cube &X)
+arma::cx_cube fft(const arma::cx_cube &X)
 {
-    arma::cx_cube ifft(X.n_rows, X.n_cols, X.n_slices);
+    return fft3(X);
+}
 
-    fftw_plan plan = fftw_plan_dft_3d(X.n_slices, X.n_cols, X.n_rows, (fftw_complex *)X.memptr(), (fftw_complex *)ifft.memptr(), FFTW_BACKWARD, FFTW_ESTIMATE);
+arma::cx_cube ifft(const arma::cx_cube &X)
+{
+    return ifft3(X);
+}
 
-    fftw_execute(plan);
+arma::cx_fcube fft(const arma::fcube &X)
+{
+    return fft3(X);
+}
 
-    fftw_destroy_plan(plan);
+arma::fcube ifftr(const arma::cx_fcube &X)
+{
+    return ifftr3(X);
+}
 
-    return ifft/(X.n_rows * X.n_cols * X.n_slices);
+arma::cx_fcube fft(const arma::cx_fcube &X)
+{
+    return fft3(X);
 }
 
+arma::cx_fcube ifft(const arma::cx_fcube &X)
+{
+    return ifft3(X);
+}
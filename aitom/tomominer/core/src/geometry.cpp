@@ -146,7 +146,8 @@ euler_angle rot_matrix::as_euler_angle() const
     return ea;
 }
 
-arma::vec3 get_center(const arma::cube &vol)
+template<class T>
+static arma::vec3 get_center_t(const arma::Cube<T> &vol)
 {
     arma::vec3 x;
     x(0) = ceil(vol.n_rows  /2.0);
@@ -155,7 +156,8 @@ arma::vec3 get_center(const arma::cube &vol)
     return x;
 }
 
-arma::vec3 get_fftshift_center(const arma::cube &vol)
+template<class T>
+static arma::vec3 get_fftshift_center_t(const arma::Cube<T> &vol)
 {
     arma::vec3 x;
     x(0) = floor(vol.n_rows  /2.0);
@@ -164,6 +166,12 @@ arma::vec3 get_fftshift_center(const arma::cube &vol)
     return x;
 }
 
+arma::vec3 get_center(const arma::cube &vol)  { return get_center_t(vol); }
+arma::vec3 get_center(const arma::fcube &vol) { return get_center_t(vol); }
+
+arma::vec3 get_fftshift_center(const arma::cube &vol)  { return get_fftshift_center_t(vol); }
+arma::vec3 get_fftshift_center(const arma::fcube &vol) { return get_fftshift_center_t(vol); }
+
 
 std::tuple<std::vector<euler_angle>, std::vector<double> > angle_list_redundancy_removal_zyz(std::vector<euler_angle> &angs, std::vector<double> &scores, double cutoff)
 //boost::tuple<std::vector<euler_angle>, std::vector<double> > angle_list_redundancy_removal_zyz(std::vector<euler_angle> &angs, std::vector<double> &scores, double cutoff)
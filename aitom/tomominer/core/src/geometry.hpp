@@ -126,6 +126,9 @@ class euler_angle;
 */
 arma::vec3 get_center(const arma::cube &vol);
 
+/** @copydoc get_center(const arma::cube &) */
+arma::vec3 get_center(const arma::fcube &vol);
+
 /**
     Return the center coordinate of a cube that has been fftshifted.  The center coordinate is often one-off from the actual center.
     @param vol The cube.
@@ -133,6 +136,9 @@ arma::vec3 get_center(const arma::cube &vol);
 */
 arma::vec3 get_fftshift_center(const arma::cube &vol);
 
+/** @copydoc get_fftshift_center(const arma::cube &) */
+arma::vec3 get_fftshift_center(const arma::fcube &vol);
+
 /**
     Filter angles based on distance.  If two angles are within cutoff, remove one from list.
 
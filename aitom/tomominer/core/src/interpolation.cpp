@@ -11,45 +11,63 @@ using arma::span;
 // nan/etc checks that make built-in floor so slow.
 inline int _floor(double x){ return ((int)x); }
 
-interpolater::interpolater(const arma::cube &f_) : data(f_), ext(arma::math::nan()) {}
+// the cubic interpolation sums 4 consecutive voxels weighted by the
+// catmull-rom coefficients, single precision voxels are summed in double.
+inline double dot4(const arma::subview_col<double> &v, const arma::vec4 &c) { return arma::dot(v, c); }
 
-interpolater::interpolater(const arma::cube &f_, double ext_val) : data(f_), ext(ext_val) {}
+inline double dot4(const arma::subview_col<float> &v, const arma::vec4 &c)
+{
+    return (double)v(0) * c(0) + (double)v(1) * c(1) + (double)v(2) * c(2) + (double)v(3) * c(3);
+}
+
+template<class eT>
+interpolater_t<eT>::interpolater_t(const arma::Cube<eT> &f_) : data(f_), ext(arma::math::nan()) {}
 
-double interpolater::operator()(const arma::vec &x) const 
+template<class eT>
+interpolater_t<eT>::interpolater_t(const arma::Cube<eT> &f_, double ext_val) : data(f_), ext(ext_val) {}
+
+template<class eT>
+double interpolater_t<eT>::operator()(const arma::vec &x) const 
 { 
     if(x.n_elem < 3) 
         throw fatal_error() << "interpolater::operator() called with a vector of length < 3.";
     return (*this)(x(0), x(1), x(2)); 
 }
 
-void interpolater::set_ext_val(double ext_val) { ext = ext_val;}
+template<class eT>
+void interpolater_t<eT>::set_ext_val(double ext_val) { ext = ext_val;}
 
-double interpolater::get_ext_val() const { return ext; }
+template<class eT>
+double interpolater_t<eT>::get_ext_val() const { return ext; }
 
 
-cubic_interpolater::cubic_interpolater(const arma::cube &f_) 
-    : interpolater(f_)
+template<class eT>
+cubic_interpolater_t<eT>::cubic_interpolater_t(const arma::Cube<eT> &f_) 
+    : interpolater_t<eT>(f_)
 {
     update_data();
 }
 
 
 
-cubic_interpolater::cubic_interpolater(const arma::cube &f_, double ext_val)
-    : interpolater(f_, ext_val)
+template<class eT>
+cubic_interpolater_t<eT>::cubic_interpolater_t(const arma::Cube<eT> &f_, double ext_val)
+    : interpolater_t<eT>(f_, ext_val)
 {
     update_data();
 }
 
-double cubic_interpolater::operator()(const arma::vec &x) const { return (*this)(x(0), x(1), x(2)); }
+template<class eT>
+double cubic_interpolater_t<eT>::operator()(const arma::vec &x) const { return (*this)(x(0), x(1), x(2)); }
 
-void cubic_interpolater::update_data()
+template<class eT>
+void cubic_interpolater_t<eT>::update_data()
 {
     arma::uword M = data.n_rows;
     arma::uword N = data.n_cols;
     arma::uword P = data.n_slices;
 
-    f = arma::cube(M+2, N+2, P+2);
+    f = arma::Cube<eT>(M+2, N+2, P+2);
 
     f(span(1,M), span(1,N), span(1,P)) = data;
     
@@ -76,7 +94,8 @@ void cubic_interpolater::update_data()
 }
     
 
-double cubic_interpolater::operator()(double x, double y, double z) const
+template<class eT>
+double cubic_interpolater_t<eT>::operator()(double x, double y, double z) const
 {
     //Fudge factor to handle data that maps to slightly outside of the boundary.
     double EPSILON = 1e-13;
@@ -116,22 +135,26 @@ double cubic_interpolater::operator()(double x, double y, double z) const
     for(size_t i = 0; i < 4; i++)
     {
         for(size_t j = 0; j < 4; j++)
-            yp(j) = 0.5*arma::dot(f.slice(z0+i).col(y0+j).subvec(x0,x0+3), _x);
+            yp(j) = 0.5*dot4(f.slice(z0+i).col(y0+j).subvec(x0,x0+3), _x);
         zp(i) = 0.5*arma::dot(yp, _y);
     }
     return 0.5*arma::dot(zp, _z);
 }
 
 
-linear_interpolater::linear_interpolater(const arma::cube &f_, double ext_val) 
-    : interpolater(f_, ext_val) {}
+template<class eT>
+linear_interpolater_t<eT>::linear_interpolater_t(const arma::Cube<eT> &f_, double ext_val) 
+    : interpolater_t<eT>(f_, ext_val) {}
 
-linear_interpolater::linear_interpolater(const arma::cube &f_) 
-    : interpolater(f_) {}
+template<class eT>
+linear_interpolater_t<eT>::linear_interpolater_t(const arma::Cube<eT> &f_) 
+    : interpolater_t<eT>(f_) {}
 
-double linear_interpolater::operator()(const arma::vec &x) const { return (*this)(x(0), x(1), x(2)); }
+template<class eT>
+double linear_interpolater_t<eT>::operator()(const arma::vec &x) const { return (*this)(x(0), x(1), x(2)); }
 
-double linear_interpolater::operator()(double x, double y, double z) const
+template<class eT>
+double linear_interpolater_t<eT>::operator()(double x, double y, double z) const
 {
     //Fudge factor to handle data that maps to slightly outside of the boundary.
     double EPSILON = 1e-15;
@@ -186,14 +209,17 @@ inline arma::vec4 catmull_rom_coeff(double x)
     return x_;
 }
 
-nearest_interpolater::nearest_interpolater(const arma::cube &f_, double ext_val) 
-    : interpolater(f_, ext_val) {}
+template<class eT>
+nearest_interpolater_t<eT>::nearest_interpolater_t(const arma::Cube<eT> &f_, double ext_val) 
+    : interpolater_t<eT>(f_, ext_val) {}
 
-nearest_interpolater::nearest_interpolater(const arma::cube &f_) 
-    : interpolater(f_) {}
+template<class eT>
+nearest_interpolater_t<eT>::nearest_interpolater_t(const arma::Cube<eT> &f_) 
+    : interpolater_t<eT>(f_) {}
 
 
-double nearest_interpolater::operator()(double x, double y, double z) const
+template<class eT>
+double nearest_interpolater_t<eT>::operator()(double x, double y, double z) const
 {
     if( x < 0 || data.n_rows-1 < x || y < 0 || data.n_cols-1 < y || z < 0 || data.n_slices-1 < z )
         return ext;
@@ -217,3 +243,13 @@ double nearest_interpolater::operator()(double x, double y, double z) const
 
     return data(xx,yy,zz);
 }
+
+
+template class interpolater_t<double>;
+template class interpolater_t<float>;
+template class cubic_interpolater_t<double>;
+template class cubic_interpolater_t<float>;
+template class linear_interpolater_t<double>;
+template class linear_interpolater_t<float>;
+template class nearest_interpolater_t<double>;
+template class nearest_interpolater_t<float>;
@@ -95,8 +95,14 @@ inline arma::vec4 catmull_rom_coeff(double x);
 /**
     Base class for interpolation objects.
 
+    The interpolaters are templates over the element type of the cube, so
+    both double (arma::cube) and single precision (arma::fcube) volumes can be
+    interpolated without conversion.  Coordinates and interpolated values are
+    always double.  The typedefs interpolater, cubic_interpolater, etc. are
+    the double precision versions.
 */
-class interpolater
+template<class eT>
+class interpolater_t
 {
     public:
         /**
@@ -107,7 +113,7 @@ class interpolater
             @param f_ cube to interpolate.
             @param ext_val value to return in the event of extrapolation.
         */
-        interpolater(const arma::cube &f_, double ext_val);
+        interpolater_t(const arma::Cube<eT> &f_, double ext_val);
 
         /**
             Initialize an interpolation object with a cube of data.
@@ -116,7 +122,7 @@ class interpolater
 
             @param f_ data to be interpolated.
         */
-        interpolater(const arma::cube &f_);
+        interpolater_t(const arma::Cube<eT> &f_);
 
         //virtual ~interpolater();
         
@@ -163,7 +169,7 @@ class interpolater
         /**
             The cubic lattice interpolation is carried out on.
         */
-        const arma::cube &data;
+        const arma::Cube<eT> &data;
         /**
             The value returned if the coordinate requested to interpolate is outside of the cube.
         */
@@ -174,49 +180,69 @@ class interpolater
 /**
     An interpolater that uses cubic splines to more accurately estimate the value at a given position.
 */
-class cubic_interpolater : public interpolater
+template<class eT>
+class cubic_interpolater_t : public interpolater_t<eT>
 {
     public:
-        cubic_interpolater(const arma::cube &f_, double ext_val);
+        cubic_interpolater_t(const arma::Cube<eT> &f_, double ext_val);
         
-        cubic_interpolater(const arma::cube &f_);
+        cubic_interpolater_t(const arma::Cube<eT> &f_);
 
         virtual double operator()(double x, double y, double z) const;
 
         double operator()(const arma::vec &x) const;
 
     private:
+        using interpolater_t<eT>::data;
+        using interpolater_t<eT>::ext;
+
         void update_data();
-        arma::cube f;
+        arma::Cube<eT> f;
 };
         
 /**
     An interpolater that uses the nearest values to interpolate at new points.
 */
-class linear_interpolater : public interpolater
+template<class eT>
+class linear_interpolater_t : public interpolater_t<eT>
 {
     public:
-        linear_interpolater(const arma::cube &f_, double ext_val);
+        linear_interpolater_t(const arma::Cube<eT> &f_, double ext_val);
 
-        linear_interpolater(const arma::cube &f_);
+        linear_interpolater_t(const arma::Cube<eT> &f_);
         
         double operator()(const arma::vec &x) const;
 
         virtual double operator()(double x, double y, double z) const;
+
+    private:
+        using interpolater_t<eT>::data;
+        using interpolater_t<eT>::ext;
 };
 
 
-class nearest_interpolater : public interpolater
+template<class eT>
+class nearest_interpolater_t : public interpolater_t<eT>
 {
     public:
-        nearest_interpolater(const arma::cube &f_, double ext_val);
+        nearest_interpolater_t(const arma::Cube<eT> &f_, double ext_val);
         
-        nearest_interpolater(const arma::cube &f_);
+        nearest_interpolater_t(const arma::Cube<eT> &f_);
         
         double operator()(double x, double y, double z) const;
+
+    private:
+        using interpolater_t<eT>::data;
+        using interpolater_t<eT>::ext;
 };
 
 
+typedef interpolater_t<double>          interpolater;
+typedef cubic_interpolater_t<double>    cubic_interpolater;
+typedef linear_interpolater_t<double>   linear_interpolater;
+typedef nearest_interpolater_t<double>  nearest_interpolater;
+
+
 /**
   @} // end group interpolation
 */
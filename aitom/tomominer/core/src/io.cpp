@@ -6,10 +6,77 @@
 
 #include "io.hpp"
 
-void write_mrc(const arma::cube &c, const char *filename)
+/*
+    write_mrc() and read_mrc() are written once for double and single
+    precision cubes.  The helpers below are the only parts that differ: double
+    values are converted to and from the 32-bit floats of the file, float
+    values are written and read directly.
+*/
+
+namespace
+{
+
+double mrc_mean(const arma::cube &c) { return arma::accu(c) / c.n_elem; }
+
+double mrc_mean(const arma::fcube &c)
+{
+    double s = 0;
+    for(size_t i = 0; i < c.n_elem; i++)
+        s += c(i);
+    return s / c.n_elem;
+}
+
+void mrc_write_data(std::ofstream &fout, const arma::cube &c)
+{
+    unsigned int buf_len = c.n_elem * sizeof(float);
+    float *data = new float[c.n_elem];
+
+    // move from double to float.
+    for(size_t i = 0; i < c.n_elem; i++)
+        data[i] = c(i);
+
+    // write the data.
+    fout.write(reinterpret_cast<char*>(data), buf_len);
+
+    delete[] data;
+}
+
+void mrc_write_data(std::ofstream &fout, const arma::fcube &c)
+{
+    fout.write(reinterpret_cast<const char*>(c.memptr()), c.n_elem * sizeof(float));
+}
+
+bool mrc_read_data(std::ifstream &fin, arma::cube &vol)
+{
+    unsigned int buf_len = sizeof(float) * vol.n_elem;
+
+    float *fvol = new float[vol.n_elem];
+
+    // read data into memory.
+    fin.read(reinterpret_cast<char*>(fvol), buf_len);
+    // check that we read enough.
+    bool ok = !(fin.gcount() != buf_len || fin.fail());
+
+    for(size_t i = 0; ok && i < vol.n_elem; i++)
+        vol(i) = fvol[i];
+    
+    delete[] fvol;
+    return ok;
+}
+
+bool mrc_read_data(std::ifstream &fin, arma::fcube &vol)
+{
+    unsigned int buf_len = sizeof(float) * vol.n_elem;
+
+    fin.read(reinterpret_cast<char*>(vol.memptr()), buf_len);
+    return !(fin.gcount() != buf_len || fin.fail());
+}
+
+
+template<class eT>
+void write_mrc_t(const arma::Cube<eT> &c, const char *filename)
 {
     char *zeros;
-    float *data;
 
     std::ofstream fout(filename, std::ios::out | std::ios::binary);
 
@@ -76,7 +143,7 @@ void write_mrc(const arma::cube &c, const char *filename)
 
     stats[0] = float(c.min());
     stats[1] = float(c.max());
-    stats[2] = float(arma::accu(c) / c.n_elem);
+    stats[2] = float(mrc_mean(c));
 
     // min value in file/max value/avg value.
     fout.write(reinterpret_cast<char*>(stats), 3*sizeof(float));
@@ -90,23 +157,15 @@ void write_mrc(const arma::cube &c, const char *filename)
     // everything else is zeros.
     fout.write(reinterpret_cast<char *>(zeros), 812);
 
-    buf_len = c.n_elem * sizeof(float);
-    data = new float[buf_len];
-
-    // move from double to float.
-    for(size_t i = 0; i < c.n_elem; i++)
-        data[i] = c(i);
-
-    // write the data.
-    fout.write(reinterpret_cast<char*>(data), buf_len);
+    mrc_write_data(fout, c);
 
     fout.close();
-    delete[] data;
     delete[] zeros;
 }
 
 
-arma::cube read_mrc(const char *filename)
+template<class eT>
+arma::Cube<eT> read_mrc_t(const char *filename)
 {
     // open the file.
     std::ifstream fin(filename, std::ios::in | std::ios::binary);
@@ -133,7 +192,6 @@ arma::cube read_mrc(const char *filename)
         std::cerr << msg.str();
         throw std::ios_base::failure(msg.str());
     }
-    unsigned int n_elem = dim[0]*dim[1]*dim[2];
 
     // The next entry is the type of data stored in the file.
     int32_t mode;
@@ -183,16 +241,11 @@ arma::cube read_mrc(const char *filename)
         throw std::runtime_error(msg.str());
     }
 
-    unsigned int buf_len = sizeof(float) * n_elem;
+    arma::Cube<eT> vol(dim[0], dim[1], dim[2]);
 
-    float *fvol = new float[buf_len];
-
-    // read data into memory.
-    fin.read(reinterpret_cast<char*>(fvol), buf_len);
-    // check that we read enough.
-    if(fin.gcount() != buf_len || fin.fail())
+    // read data into memory, and check that we read enough.
+    if(!mrc_read_data(fin, vol))
     {
-        delete[] fvol;
         std::stringstream msg;
         msg << "read_mrc: Failed to read file: " << filename << std::endl;
         std::cerr << msg.str();
@@ -201,16 +254,20 @@ arma::cube read_mrc(const char *filename)
 
     fin.close();
 
-    arma::cube vol(dim[0], dim[1], dim[2]);
-    
-    for(size_t i = 0; i < n_elem; i++)
-        vol(i) = fvol[i];
-    
-    delete[] fvol;
-
     return vol;
 }
 
+} // namespace
+
+
+void write_mrc(const arma::cube &c, const char *filename)  { write_mrc_t(c, filename); }
+
+void write_mrc(const arma::fcube &c, const char *filename) { write_mrc_t(c, filename); }
+
+arma::cube read_mrc(const char *filename) { return read_mrc_t<double>(filename); }
+
+arma::fcube read_mrc_float(const char *filename) { return read_mrc_t<float>(filename); }
+
 arma::cube read_em(const char *filename)
 {
 
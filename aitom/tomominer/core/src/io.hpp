@@ -13,6 +13,15 @@
 */
 void write_mrc(const arma::cube &c, const char *filename);
 
+/**
+    Output a single precision cube in MRC format.  MRC mode 2 stores 32-bit
+    floats, so the data is written without conversion.
+
+    @param c The cube to write to a file.
+    @param filename the file to write c to.
+*/
+void write_mrc(const arma::fcube &c, const char *filename);
+
 /** 
     readr for MRC files.
     
@@ -20,6 +29,12 @@ void write_mrc(const arma::cube &c, const char *filename);
 */
 arma::cube read_mrc(const char *filename);
 
+/**
+    Same as read_mrc(), but keeps the 32-bit float values of the file as they
+    are, without conversion to double.
+*/
+arma::fcube read_mrc_float(const char *filename);
+
 
 
 #endif
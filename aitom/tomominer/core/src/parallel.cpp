@@ -0,0 +1,53 @@
+#include <cstdlib>
+
+#ifdef _OPENMP
+#include <omp.h>
+#endif
+
+#include "parallel.hpp"
+
+namespace
+{
+
+int threads_from_env()
+{
+    const char *s = std::getenv("TOMOMINER_CORE_THREADS");
+    if(s == NULL || *s == '\0')
+        return 1;
+    return std::atoi(s);
+}
+
+int num_threads_resolve(int n)
+{
+#ifdef _OPENMP
+    if(n <= 0)
+        n = omp_get_num_procs();
+#else
+    n = 1;
+#endif
+    return n;
+}
+
+int num_threads = num_threads_resolve(threads_from_env());
+
+} // namespace
+
+
+void set_num_threads(int n)
+{
+    num_threads = num_threads_resolve(n);
+}
+
+int get_num_threads()
+{
+    return num_threads;
+}
+
+void parallel_error::capture()
+{
+    #pragma omp critical(parallel_error_capture)
+    {
+        if(!err)
+            err = std::current_exception();
+    }
+}
@@ -0,0 +1,58 @@
+#ifndef TOMO_PARALLEL_HPP
+#define TOMO_PARALLEL_HPP
+
+#include <exception>
+
+/**
+    @defgroup parallel Thread parallelism
+    @{
+
+    The alignment and rotation kernels run their outer loops (candidate
+    angles, spherical shells, volume pairs, slices of a rotated volume) in
+    parallel with OpenMP.  The number of threads is a process wide setting,
+    taken from the environment variable TOMOMINER_CORE_THREADS at start up
+    and defaulting to 1, so that existing setups running one worker process
+    per core are not oversubscribed.  Nested parallel regions run serially.
+
+    When the library is built without OpenMP everything runs serially and the
+    thread count is ignored.
+*/
+
+/**
+    Set the number of threads used by the kernels.
+
+    @param n number of threads, n <= 0 uses all available cores.
+*/
+void set_num_threads(int n);
+
+/**
+    @return number of threads used by the kernels.
+*/
+int get_num_threads();
+
+/**
+    Collects the first exception thrown inside a parallel loop, exceptions
+    must not leave an OpenMP parallel region.  Call capture() from a catch(...)
+    block inside the loop, and rethrow() after the loop.
+*/
+class parallel_error
+{
+public:
+    parallel_error() : err(nullptr) {}
+
+    void capture();
+
+    void rethrow() const
+    {
+        if(err)
+            std::rethrow_exception(err);
+    }
+
+private:
+    std::exception_ptr err;
+};
+
+/**
+  @} // end group parallel.
+*/
+#endif
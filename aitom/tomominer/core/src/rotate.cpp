@@ -2,15 +2,17 @@
 #include "interpolation.hpp"
 
 #include "arma_extend.hpp"
+#include "parallel.hpp"
 
-arma::cube transform(const interpolater &inter, affine_transform &at, arma::uvec3 size)
+template<class eT>
+arma::Cube<eT> transform(const interpolater_t<eT> &inter, affine_transform &at, arma::uvec3 size)
 {
-    arma::cube out(size(0), size(1), size(2));
+    arma::Cube<eT> out(size(0), size(1), size(2));
 
     arma::vec4 x;
     arma::vec4 y;
 
-    #pragma omp parallel for private(x,y)
+    #pragma omp parallel for private(x,y) num_threads(get_num_threads())
     for(int x0 = 0; x0 < int(size(0)); x0++)
     {
         x(0) = x0;
@@ -33,7 +35,8 @@ arma::cube transform(const interpolater &inter, affine_transform &at, arma::uvec
     return out;
 }
 
-arma::cube rotate_vol(const arma::cube &vol, const rot_matrix &rm, const arma::vec3 &dx /* = {0,0,0} */)
+template<class eT>
+arma::Cube<eT> rotate_vol(const arma::Cube<eT> &vol, const rot_matrix &rm, const arma::vec3 &dx /* = {0,0,0} */)
 {
 
     arma::vec3 center = get_center(vol);
@@ -45,15 +48,16 @@ arma::cube rotate_vol(const arma::cube &vol, const rot_matrix &rm, const arma::v
     affine_transform tform(rm, _dx);
 
     // the interpolation we will use.
-    cubic_interpolater cub_int(vol, arma::math::nan());
+    cubic_interpolater_t<eT> cub_int(vol, arma::math::nan());
 
     // do transformation.
     return transform(cub_int, tform, arma::shape(vol));
 }
 
-arma::cube rotate_vol_pad_mean(const arma::cube &vol, const rot_matrix &rm, const arma::vec3 &dx /* = {0,0,0} */)
+template<class eT>
+arma::Cube<eT> rotate_vol_pad_mean(const arma::Cube<eT> &vol, const rot_matrix &rm, const arma::vec3 &dx /* = {0,0,0} */)
 {
-    arma::cube vol2 = rotate_vol(vol, rm, dx);
+    arma::Cube<eT> vol2 = rotate_vol(vol, rm, dx);
     
     double s = 0;
     size_t n = 0;
@@ -77,9 +81,10 @@ arma::cube rotate_vol_pad_mean(const arma::cube &vol, const rot_matrix &rm, cons
 }
 
 
-arma::cube rotate_vol_pad_zero(const arma::cube &vol, const rot_matrix &rm, const arma::vec3 &dx /* = {0,0,0} */)
+template<class eT>
+arma::Cube<eT> rotate_vol_pad_zero(const arma::Cube<eT> &vol, const rot_matrix &rm, const arma::vec3 &dx /* = {0,0,0} */)
 {
-    arma::cube vol2 = rotate_vol(vol, rm, dx);
+    arma::Cube<eT> vol2 = rotate_vol(vol, rm, dx);
 
     for(size_t i = 0; i < vol2.n_elem; i++)
         if( !arma::is_finite(vol2(i)) )
@@ -89,7 +94,8 @@ arma::cube rotate_vol_pad_zero(const arma::cube &vol, const rot_matrix &rm, cons
 }
 
 
-arma::cube rotate_mask(const arma::cube &mask, const rot_matrix &rm)
+template<class eT>
+arma::Cube<eT> rotate_mask(const arma::Cube<eT> &mask, const rot_matrix &rm)
 {
     // our output volume has the same dimensions as the input.
     arma::vec3 center = get_center(mask);
@@ -102,10 +108,10 @@ arma::cube rotate_mask(const arma::cube &mask, const rot_matrix &rm)
 
     // the interpolation we will use.
     // linear is used to avoid negatives... but we still screen for them below?
-    linear_interpolater lin_int(mask, 0);
+    linear_interpolater_t<eT> lin_int(mask, 0);
 
     // do transformation.
-    arma::cube mask_r = transform(lin_int, tform, arma::shape(mask));
+    arma::Cube<eT> mask_r = transform(lin_int, tform, arma::shape(mask));
     
     for(size_t i = 0; i < mask_r.n_elem; i++)
         if( mask_r(i) < 0 )
@@ -113,3 +119,19 @@ arma::cube rotate_mask(const arma::cube &mask, const rot_matrix &rm)
 
     return mask_r;
 }
+
+
+template arma::cube  transform(const interpolater_t<double> &inter, affine_transform &at, arma::uvec3 size);
+template arma::fcube transform(const interpolater_t<float> &inter, affine_transform &at, arma::uvec3 size);
+
+template arma::cube  rotate_vol(const arma::cube &vol, const rot_matrix &rm, const arma::vec3 &dx);
+template arma::fcube rotate_vol(const arma::fcube &vol, const rot_matrix &rm, const arma::vec3 &dx);
+
+template arma::cube  rotate_vol_pad_mean(const arma::cube &vol, const rot_matrix &rm, const arma::vec3 &dx);
+template arma::fcube rotate_vol_pad_mean(const arma::fcube &vol, const rot_matrix &rm, const arma::vec3 &dx);
+
+template arma::cube  rotate_vol_pad_zero(const arma::cube &vol, const rot_matrix &rm, const arma::vec3 &dx);
+template arma::fcube rotate_vol_pad_zero(const arma::fcube &vol, const rot_matrix &rm, const arma::vec3 &dx);
+
+template arma::cube  rotate_mask(const arma::cube &mask, const rot_matrix &rm);
+template arma::fcube rotate_mask(const arma::fcube &mask, const rot_matrix &rm);
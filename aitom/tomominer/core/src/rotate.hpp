@@ -21,6 +21,11 @@
     to maintain order \f$ O(h^3) \f$ accuracy.  Instead the MATLAB code uses a
     padding or fill value for these entries.  Additionally blending and
     extrapolation is carried out for points outside of the cube boundary.
+
+    All functions are templates over the element type of the volume and are
+    instantiated for arma::cube and arma::fcube.  Single precision volumes are
+    rotated without conversion to double, the interpolation itself is carried
+    out in double precision.
 */
 
 /**
@@ -32,7 +37,8 @@
     @param size the size of the output volume.
     @return A cube of values after interpolation.
 */
-arma::cube transform(const interpolater &inter, affine_transform &at, arma::uvec3 size);
+template<class eT>
+arma::Cube<eT> transform(const interpolater_t<eT> &inter, affine_transform &at, arma::uvec3 size);
 
 
 /**
@@ -43,7 +49,8 @@ arma::cube transform(const interpolater &inter, affine_transform &at, arma::uvec
 
     @returns A cube produced by rotation and translation of the passed volume, with values produced by interpolation of the old volume.
 */
-arma::cube rotate_vol(const arma::cube &vol, const rot_matrix &rm, const arma::vec3 &dx = arma::zeros<arma::vec>(3));
+template<class eT>
+arma::Cube<eT> rotate_vol(const arma::Cube<eT> &vol, const rot_matrix &rm, const arma::vec3 &dx = arma::zeros<arma::vec>(3));
 
 
 /**
@@ -55,7 +62,8 @@ arma::cube rotate_vol(const arma::cube &vol, const rot_matrix &rm, const arma::v
     @param rm the rotation matrix to apply
     @returns The volume after rotation and padding.
 */
-arma::cube rotate_vol_pad_mean(const arma::cube &vol, const rot_matrix &rm, const arma::vec3 &dx =  arma::zeros<arma::vec>(3));
+template<class eT>
+arma::Cube<eT> rotate_vol_pad_mean(const arma::Cube<eT> &vol, const rot_matrix &rm, const arma::vec3 &dx =  arma::zeros<arma::vec>(3));
 
 
 /**
@@ -69,7 +77,8 @@ arma::cube rotate_vol_pad_mean(const arma::cube &vol, const rot_matrix &rm, cons
     @returns The volume after rotation and padding.
 
 */
-arma::cube rotate_vol_pad_zero(const arma::cube &vol, const rot_matrix &rm, const arma::vec3 &dx = arma::zeros<arma::vec>(3));
+template<class eT>
+arma::Cube<eT> rotate_vol_pad_zero(const arma::Cube<eT> &vol, const rot_matrix &rm, const arma::vec3 &dx = arma::zeros<arma::vec>(3));
 
     
 /**
@@ -79,7 +88,8 @@ arma::cube rotate_vol_pad_zero(const arma::cube &vol, const rot_matrix &rm, cons
     @param rm  the rotation matrix to apply to the mask
     @returns The new mask.
 */
-arma::cube rotate_mask(const arma::cube &mask, const rot_matrix &rm);
+template<class eT>
+arma::Cube<eT> rotate_mask(const arma::Cube<eT> &mask, const rot_matrix &rm);
 
 /**
   @} // end addtogroup geometry. 
@@ -1,7 +1,12 @@
 #include <vector>
 #include <cassert>
+#include <map>
+#include <mutex>
+#include <utility>
 #include <armadillo>
 
+#include "wigner.hpp"
+
 //#define parity(X) ((X % 2) == 0 ? 1 : -1)
 /**
     Return parity or argument.
@@ -109,3 +114,19 @@ std::vector<arma::mat> wigner_d(double theta, int L)
     return D;
 }
 
+
+const std::vector<arma::mat> &wigner_d_cached(double theta, int L)
+{
+    static std::map<std::pair<double, int>, std::vector<arma::mat> > cache;
+    static std::mutex cache_mutex;
+
+    std::lock_guard<std::mutex> lock(cache_mutex);
+
+    // std::map never moves its elements, so the reference stays valid after later insertions.
+    std::pair<double, int> key(theta, L);
+    auto it = cache.find(key);
+    if(it == cache.end())
+        it = cache.insert(std::make_pair(key, wigner_d(theta, L))).first;
+
+    return it->second;
+}
@@ -35,6 +35,17 @@
 */
 std::vector<arma::mat> wigner_d(double theta, int max_l);
 
+/**
+    Cached version of wigner_d().  The matrices are computed once per
+    (theta, max_l) and kept for the lifetime of the process, so repeated
+    rotational searches with the same bandwidth do not recompute them.
+
+    @param theta Angle of rotation.  radians.
+    @param max_l Maximum order of matrix to generate.
+    @return reference to the cached list of matrices, same as wigner_d(theta, max_l).
+*/
+const std::vector<arma::mat> &wigner_d_cached(double theta, int max_l);
+
 /**
   @}
 */
@@ -10,19 +10,43 @@ Please cite: Xu et al. De novo visual proteomics of single cells through pattern
 import os
 import stat
 import shutil
+import threading
+import collections
 import time
 import uuid
 import pickle
 import numpy as N
 import aitom.tomominer.io.file as IF
+import aitom.tomominer.io.pack as IP
 
 
 class Cache:
+    '''
+    two tier cache of loaded volumes.
+    tier 1 is an in-process LRU of decoded arrays bounded by mem_max_bytes (0 disables it).
+    tier 2 is a node-local copy of the source files under cache_dir (None disables it), bounded by disk_max_bytes.
+    the disk tier is shared by all worker processes of a node: files are populated through a temporary file and
+    an atomic rename, and only one process copies a given file while the others wait for it.
+    a memory tier hit checks the mtime and size of the source file at most once every version_ttl seconds, so that
+    repeated reads of the same volume do not stat the shared file system each time.
+    '''
 
-    def __init__(self, cache_dir=None, tmp_dir=None, logger=None):
+    def __init__(self, cache_dir=None, tmp_dir=None, logger=None, mem_max_bytes=0, disk_max_bytes=None, lock_timeout=60.0, version_ttl=5.0):
         self.logger = logger
         self.cache_dir = cache_dir
         self.tmp_dir = tmp_dir
+        self.mem_max_bytes = mem_max_bytes
+        self.disk_max_bytes = disk_max_bytes
+        self.lock_timeout = lock_timeout
+        self.version_ttl = version_ttl
+        self.mem = collections.OrderedDict()
+        self.mem_bytes = 0
+        self.mem_lock = threading.RLock()
+        # bytes copied into cache_dir by this process since the last eviction scan
+        self.disk_bytes_added = 0
+        # paths of the volumes held by the cache tiers, reported to the queue server for locality aware scheduling
+        self.disk_resident = set()
+        self.counters = {'mem_hit': 0, 'mem_miss': 0, 'mem_evict': 0, 'disk_hit': 0, 'disk_miss': 0, 'disk_evict': 0, }
 
     def get_temp_file_path(self, prefix=None, fn_id=None, suffix=None, ext=None):
         if (fn_id is not None):
@@ -55,7 +79,58 @@ class Cache:
 
     def load_file_cache_fs(self, load_func, path):
         path = os.path.abspath(path)
-        if (self.cache_dir is None):
+        if (self.mem_max_bytes <= 0):
+            return self.load_file_cache_disk(load_func, path)
+        key = (load_func.__module__, load_func.__name__, path)
+        version = None
+        with self.mem_lock:
+            e = self.mem.get(key)
+        if (e is not None):
+            t = time.time()
+            if ((e['version'] is not None) and ((t - e['checked']) > self.version_ttl)):
+                version = self.load_file_cache_fs__version(path)
+                if (version == e['version']):
+                    e['checked'] = t
+            else:
+                version = e['version']
+        with self.mem_lock:
+            if ((e is not None) and (e['version'] == version) and (self.mem.get(key) is e)):
+                self.mem.move_to_end(key)
+                self.counters['mem_hit'] += 1
+                # callers may modify the returned volume in place
+                return N.array(e['v'], copy=True)
+            self.counters['mem_miss'] += 1
+        if (e is None):
+            version = self.load_file_cache_fs__version(path)
+        checked = time.time()
+        v = self.load_file_cache_disk(load_func, path)
+        self.mem_put(key, {'version': version, 'checked': checked, 'v': N.array(v, copy=True), })
+        return v
+
+    def load_file_cache_fs__version(self, path):
+        '''mtime and size of a source file, None for volumes inside a pack, whose chunk files are never modified'''
+        if IP.is_pack_path(path):
+            return None
+        st = os.stat(path)
+        return (st.st_mtime, st.st_size)
+
+    def mem_put(self, key, e):
+        nbytes = e['v'].nbytes
+        if (nbytes > self.mem_max_bytes):
+            return
+        with self.mem_lock:
+            if (key in self.mem):
+                self.mem_bytes -= self.mem.pop(key)['v'].nbytes
+            while (self.mem and ((self.mem_bytes + nbytes) > self.mem_max_bytes)):
+                (_, e_old) = self.mem.popitem(last=False)
+                self.mem_bytes -= e_old['v'].nbytes
+                self.counters['mem_evict'] += 1
+            self.mem[key] = e
+            self.mem_bytes += nbytes
+
+    def load_file_cache_disk(self, load_func, path):
+        # volumes inside a pack are read with a positioned read from the chunk file, no per file copy is needed
+        if ((self.cache_dir is None) or IP.is_pack_path(path)):
             v = load_func(path)
             return v
         if (not os.path.isdir(self.cache_dir)):
@@ -66,17 +141,29 @@ class Cache:
             if (not os.path.isdir(self.cache_dir)):
                 raise OSError(('cache_dir   ' + self.cache_dir))
         cache_path = (self.cache_dir + path)
-        while self.load_file_cache_fs__is_miss(path=path, cache_path=cache_path):
-            cache_path__dir = os.path.dirname(cache_path)
-            if (not os.path.isdir(cache_path__dir)):
-                try:
-                    os.makedirs(cache_path__dir)
-                except:
-                    pass
-            shutil.copyfile(path, cache_path)
-            time.sleep(1)
-        v = load_func(cache_path)
-        return v
+        if (not self.load_file_cache_fs__is_miss(path=path, cache_path=cache_path)):
+            self.counters['disk_hit'] += 1
+            try:
+                # record the access time for LRU eviction, keep mtime which marks the version of the source
+                st = os.stat(cache_path)
+                os.utime(cache_path, (time.time(), st.st_mtime))
+                v = load_func(cache_path)
+                with self.mem_lock:
+                    self.disk_resident.add(path)
+                return v
+            except (IOError, OSError):
+                # evicted by another process in the mean time
+                pass
+        self.counters['disk_miss'] += 1
+        if self.load_file_cache_fs__populate(path=path, cache_path=cache_path):
+            try:
+                v = load_func(cache_path)
+                with self.mem_lock:
+                    self.disk_resident.add(path)
+                return v
+            except (IOError, OSError):
+                pass
+        return load_func(path)
 
     def load_file_cache_fs__is_miss(self, path, cache_path):
         miss = False
@@ -85,8 +172,120 @@ class Cache:
         else:
             path__st = os.stat(path)
             cache_path__st = os.stat(cache_path)
-            if (path__st.st_mtime > cache_path__st.st_mtime):
+            if (path__st.st_mtime != cache_path__st.st_mtime):
                 miss = True
             if (path__st.st_size != cache_path__st.st_size):
                 miss = True
-        return miss
\ No newline at end of file
+        return miss
+
+    def load_file_cache_fs__populate(self, path, cache_path):
+        '''copy path into the cache, return False if the file could not be cached in time'''
+        cache_path__dir = os.path.dirname(cache_path)
+        if (not os.path.isdir(cache_path__dir)):
+            try:
+                os.makedirs(cache_path__dir)
+            except:
+                pass
+        lock_path = (cache_path + '.lock')
+        t0 = time.time()
+        while True:
+            try:
+                fd = os.open(lock_path, ((os.O_CREAT | os.O_EXCL) | os.O_WRONLY))
+                os.close(fd)
+                break
+            except OSError:
+                pass
+            # another process is copying the same file
+            if (not self.load_file_cache_fs__is_miss(path=path, cache_path=cache_path)):
+                return True
+            try:
+                if ((time.time() - os.path.getmtime(lock_path)) > self.lock_timeout):
+                    # stale lock left by a killed process
+                    os.remove(lock_path)
+                    continue
+            except OSError:
+                continue
+            if ((time.time() - t0) > self.lock_timeout):
+                return False
+            time.sleep(0.05)
+        try:
+            if (not self.load_file_cache_fs__is_miss(path=path, cache_path=cache_path)):
+                return True
+            tmp_path = ('%s.%s.tmp' % (cache_path, uuid.uuid4()))
+            try:
+                # copy2 keeps the mtime of the source, which is used to detect changes of the source
+                shutil.copy2(path, tmp_path)
+                os.rename(tmp_path, cache_path)
+            except (IOError, OSError) as e:
+                # e.g. the local disk is full, the caller reads the source instead
+                if (self.logger is not None):
+                    self.logger.warning('cannot cache %s: %s', path, e)
+                try:
+                    os.remove(tmp_path)
+                except OSError:
+                    pass
+                return False
+            self.disk_bytes_added += os.path.getsize(cache_path)
+        finally:
+            try:
+                os.remove(lock_path)
+            except OSError:
+                pass
+        if ((self.disk_max_bytes is not None) and (self.disk_bytes_added > (self.disk_max_bytes * 0.1))):
+            self.evict_disk()
+        return True
+
+    def evict_disk(self, target_ratio=0.9):
+        '''remove least recently used files until the cache is below target_ratio * disk_max_bytes'''
+        self.disk_bytes_added = 0
+        if ((self.cache_dir is None) or (self.disk_max_bytes is None)):
+            return
+        fs = []
+        total = 0
+        for (root, dirs, files) in os.walk(self.cache_dir):
+            for fn in files:
+                if (fn.endswith('.lock') or fn.endswith('.tmp')):
+                    continue
+                fp = os.path.join(root, fn)
+                try:
+                    st = os.stat(fp)
+                except OSError:
+                    continue
+                fs.append((st.st_atime, st.st_size, fp))
+                total += st.st_size
+        if (total <= self.disk_max_bytes):
+            return
+        fs.sort()
+        for (_, size, fp) in fs:
+            if (total <= (self.disk_max_bytes * target_ratio)):
+                break
+            try:
+                os.remove(fp)
+            except OSError:
+                continue
+            with self.mem_lock:
+                self.disk_resident.discard(fp[len(self.cache_dir):])
+            total -= size
+            self.counters['disk_evict'] += 1
+
+    def resident_keys(self):
+        '''
+        paths of the volumes in the memory tier, or in the disk tier as far as this process knows.
+        files evicted from the disk tier by other processes of the node are noticed only when they are read again
+        '''
+        with self.mem_lock:
+            ks = set(_[2] for _ in self.mem)
+            ks.update(self.disk_resident)
+        return ks
+
+    def stats(self):
+        with self.mem_lock:
+            s = dict(self.counters)
+            s['mem_bytes'] = self.mem_bytes
+            s['mem_items'] = len(self.mem)
+        return s
+
+    def clear_mem(self):
+        with self.mem_lock:
+            self.mem.clear()
+            self.mem_bytes = 0
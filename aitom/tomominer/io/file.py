@@ -17,15 +17,24 @@ import uuid
 import array
 import numpy as N
 
-def get_mrc(path, retry_interval=1.0, max_retry=5):
+def get_mrc(path, retry_interval=1.0, max_retry=5, dtype=N.float64):
+    '''
+    read a volume in Fortran order. dtype is float64 or float32, float32 keeps the values of a mode 2 mrc file
+    without conversion, so that the single precision core functions can be used on it.
+    '''
+    import aitom.tomominer.io.pack as IP
+    if IP.is_pack_path(path):
+        # same as the core reader
+        return N.array(IP.read_vol(path), dtype=dtype, order='F')
     path = os.path.realpath(str(path))
     import aitom.tomominer.core.core as tomo
+    read = (tomo.read_mrc_float if (N.dtype(dtype) == N.float32) else tomo.read_mrc)
     v = None
     retry = 0
     while (retry < max_retry):
         try:
             v = None
-            v = tomo.read_mrc(path)
+            v = read(path)
             break
         except:
             retry += 1
@@ -34,57 +43,53 @@ def get_mrc(path, retry_interval=1.0, max_retry=5):
         raise IOError(('cannot load ' + path))
     return v
 
+# layout of the 1024 byte MRC header, parsed with a single structured read
+mrc_header_dtype = N.dtype([('nx', '<i4'), ('ny', '<i4'), ('nz', '<i4'), ('mode', '<i4'), ('nxstart', '<i4'), ('nystart', '<i4'), ('nzstart', '<i4'), ('mx', '<i4'), ('my', '<i4'), ('mz', '<i4'), ('xlen', '<f4'), ('ylen', '<f4'), ('zlen', '<f4'), ('alpha', '<f4'), ('beta', '<f4'), ('gamma', '<f4'), ('mapc', '<i4'), ('mapr', '<i4'), ('maps', '<i4'), ('amin', '<f4'), ('amax', '<f4'), ('amean', '<f4'), ('ispg', '<i2'), ('nsymbt', '<i2'), ('next', '<i4'), ('creatid', '<i2'), ('unused1', 'S30'), ('nint', '<i2'), ('nreal', '<i2'), ('unused2', 'S28'), ('idtype', '<i2'), ('lens', '<i2'), ('nd1', '<i2'), ('nd2', '<i2'), ('vd1', '<i2'), ('vd2', '<i2'), ('tiltangles', '<f4', (6,)), ('xorg', '<f4'), ('yorg', '<f4'), ('zorg', '<f4'), ('cmap', 'S4'), ('stamp', 'S4'), ('rms', '<f4'), ('nlabl', '<i4'), ('labl', 'S800')])
+assert (mrc_header_dtype.itemsize == 1024)
+
+# voxel data type of each supported MRC mode
+mrc_mode_dtype = {0: N.dtype(N.int8), 1: N.dtype('<i2'), 2: N.dtype('<f4'), 6: N.dtype('<u2'), 12: N.dtype('<f2'), }
+
+def mrc_mode_of_dtype(dtype):
+    dtype = N.dtype(dtype)
+    for (mode, mode_dtype) in mrc_mode_dtype.items():
+        if (dtype.kind == mode_dtype.kind) and (dtype.itemsize == mode_dtype.itemsize):
+            return mode
+    raise Exception(('Sorry, no MRC mode for dtype ' + str(dtype)))
+
+def read_mrc_header_raw(f):
+    hr = N.fromfile(f, dtype=mrc_header_dtype, count=1)
+    if (hr.size != 1):
+        raise IOError('incomplete MRC header')
+    hr = hr[0]
+    mrc = {}
+    for k in mrc_header_dtype.names:
+        if (k == 'tiltangles'):
+            continue
+        mrc[k] = hr[k].item()
+    mrc['nx'] = int(mrc['nx'])
+    mrc['ny'] = int(mrc['ny'])
+    mrc['nz'] = int(mrc['nz'])
+    mrc['tiltangles'] = tuple(hr['tiltangles'].tolist())
+    # keep the per-character representation of the byte fields
+    mrc['unused1'] = mrc_header_chars(mrc['unused1'], 30)[0]
+    mrc['unused2'] = mrc_header_chars(mrc['unused2'], 28)[0]
+    mrc['cmap'] = mrc_header_chars(mrc['cmap'], 4)
+    mrc['stamp'] = mrc_header_chars(mrc['stamp'], 4)
+    mrc['labl'] = mrc_header_chars(mrc['labl'], 800)
+    return mrc
+
+def mrc_header_chars(b, n):
+    # numpy strips trailing zero bytes from fixed length byte fields
+    b = b.ljust(n, b'\x00')
+    return tuple((b[i:(i + 1)] for i in range(n)))
+
 def read_mrc(path, read_data=True, show_progress=False):
     path = os.path.realpath(path)
     with open(path, 'rb') as f:
-        mrc = {}
-        mrc['nx'] = int(struct.unpack('i', f.read(4))[0])
-        mrc['ny'] = int(struct.unpack('i', f.read(4))[0])
-        mrc['nz'] = int(struct.unpack('i', f.read(4))[0])
-        mrc['mode'] = struct.unpack('i', f.read(4))[0]
-        mrc['nxstart'] = struct.unpack('i', f.read(4))[0]
-        mrc['nystart'] = struct.unpack('i', f.read(4))[0]
-        mrc['nzstart'] = struct.unpack('i', f.read(4))[0]
-        mrc['mx'] = struct.unpack('i', f.read(4))[0]
-        mrc['my'] = struct.unpack('i', f.read(4))[0]
-        mrc['mz'] = struct.unpack('i', f.read(4))[0]
-        mrc['xlen'] = struct.unpack('f', f.read(4))[0]
-        mrc['ylen'] = struct.unpack('f', f.read(4))[0]
-        mrc['zlen'] = struct.unpack('f', f.read(4))[0]
-        mrc['alpha'] = struct.unpack('f', f.read(4))[0]
-        mrc['beta'] = struct.unpack('f', f.read(4))[0]
-        mrc['gamma'] = struct.unpack('f', f.read(4))[0]
-        mrc['mapc'] = struct.unpack('i', f.read(4))[0]
-        mrc['mapr'] = struct.unpack('i', f.read(4))[0]
-        mrc['maps'] = struct.unpack('i', f.read(4))[0]
-        mrc['amin'] = struct.unpack('f', f.read(4))[0]
-        mrc['amax'] = struct.unpack('f', f.read(4))[0]
-        mrc['amean'] = struct.unpack('f', f.read(4))[0]
-        mrc['ispg'] = struct.unpack('h', f.read(2))[0]
-        mrc['nsymbt'] = struct.unpack('h', f.read(2))[0]
-        mrc['next'] = struct.unpack('i', f.read(4))[0]
-        mrc['creatid'] = struct.unpack('h', f.read(2))[0]
-        mrc['unused1'] = struct.unpack(('c' * 30), f.read(30))[0]
-        mrc['nint'] = struct.unpack('h', f.read(2))[0]
-        mrc['nreal'] = struct.unpack('h', f.read(2))[0]
-        mrc['unused2'] = struct.unpack(('c' * 28), f.read(28))[0]
-        mrc['idtype'] = struct.unpack('h', f.read(2))[0]
-        mrc['lens'] = struct.unpack('h', f.read(2))[0]
-        mrc['nd1'] = struct.unpack('h', f.read(2))[0]
-        mrc['nd2'] = struct.unpack('h', f.read(2))[0]
-        mrc['vd1'] = struct.unpack('h', f.read(2))[0]
-        mrc['vd2'] = struct.unpack('h', f.read(2))[0]
-        mrc['tiltangles'] = struct.unpack(('f' * 6), f.read((4 * 6)))
-        mrc['xorg'] = struct.unpack('f', f.read(4))[0]
-        mrc['yorg'] = struct.unpack('f', f.read(4))[0]
-        mrc['zorg'] = struct.unpack('f', f.read(4))[0]
-        mrc['cmap'] = struct.unpack(('c' * 4), f.read(4))
-        mrc['stamp'] = struct.unpack(('c' * 4), f.read(4))
-        mrc['rms'] = struct.unpack('f', f.read(4))[0]
-        mrc['nlabl'] = struct.unpack('i', f.read(4))[0]
-        mrc['labl'] = struct.unpack(('c' * 800), f.read(800))
+        mrc = read_mrc_header_raw(f)
         size = [mrc['nx'], mrc['ny'], mrc['nz']]
-        n_voxel = N.prod(size)
+        n_voxel = int(N.prod(size))
         extended = {}
         extended['magnification'] = [0]
         extended['exp_time'] = [0]
@@ -92,53 +97,19 @@ def read_mrc(path, read_data=True, show_progress=False):
         extended['defocus'] = [0]
         extended['a_tilt'] = ([0] * mrc['nz'])
         extended['tiltaxis'] = [0]
-        if (mrc['next'] != 0):
-            nbh = (mrc['next'] / 128)
-            if (nbh == 1024):
-                for lauf in range(nbh):
-                    extended['a_tilt'][lauf] = struct.unpack('f', f.read(4))[0]
-                    extended['b_tilt'][lauf] = struct.unpack('f', f.read(4))[0]
-                    extended['x_stage'][lauf] = struct.unpack('f', f.read(4))[0]
-                    extended['y_stage'][lauf] = struct.unpack('f', f.read(4))[0]
-                    extended['z_stage'][lauf] = struct.unpack('f', f.read(4))[0]
-                    extended['x_shift'][lauf] = struct.unpack('f', f.read(4))[0]
-                    extended['y_shift'][lauf] = struct.unpack('f', f.read(4))[0]
-                    extended['defocus'][lauf] = struct.unpack('f', f.read(4))[0]
-                    extended['exp_time'][lauf] = struct.unpack('f', f.read(4))[0]
-                    extended['mean_int'][lauf] = struct.unpack('f', f.read(4))[0]
-                    extended['tiltaxis'][lauf] = struct.unpack('f', f.read(4))[0]
-                    extended['tiltaxis'][lauf] = struct.unpack('f', f.read(4))[0]
-                    extended['pixelsize'][lauf] = struct.unpack('f', f.read(4))[0]
-                    extended['magnification'][lauf] = struct.unpack('f', f.read(4))[0]
-                    f.seek(offset=(128 - 52), whence=1)
-                else:
-                    f.seek(offset=MRC.__next__, whence=1)
         if read_data:
-            slice_voxel_num = (mrc['nx'] * mrc['ny'])
-            v = None
-            for i in range(mrc['nz']):
-                if show_progress:
-                    print('\r', i, '   ', end=' ')
-                    sys.stdout.flush()
-                if (mrc['mode'] == 0):
-                    if (v is None):
-                        v = N.zeros(size, dtype=N.int8)
-                    data_read = N.fromfile(f, dtype=N.int8, count=slice_voxel_num)
-                elif (mrc['mode'] == 1):
-                    if (v is None):
-                        v = N.zeros(size, dtype=N.int16)
-                    data_read = N.fromfile(f, dtype=N.int16, count=slice_voxel_num)
-                elif (mrc['mode'] == 2):
-                    if (v is None):
-                        v = N.zeros(size, dtype=N.float32)
-                    data_read = N.fromfile(f, dtype=N.float32, count=slice_voxel_num)
-                else:
-                    raise Exception('Sorry, i cannot read this as an MRC-File !!!')
-                    data_read = None
-                if (data_read.size != slice_voxel_num):
-                    import pdb
-                    pdb.set_trace()
-                v[:, :, i] = N.reshape(data_read, (mrc['nx'], mrc['ny']), order='F')
+            if (mrc['mode'] not in mrc_mode_dtype):
+                raise Exception('Sorry, i cannot read this as an MRC-File !!!')
+            # voxels start after the main and the extended header
+            f.seek((1024 + max(mrc['next'], 0)))
+            if show_progress:
+                print('\r', 'reading', n_voxel, 'voxels', end=' ')
+                sys.stdout.flush()
+            # x is the fastest varying axis, so the block is a Fortran ordered array, no copy is needed
+            v = N.fromfile(f, dtype=mrc_mode_dtype[mrc['mode']], count=n_voxel)
+            if (v.size != n_voxel):
+                raise IOError(('incomplete MRC data ' + path))
+            v = N.reshape(v, size, order='F')
         else:
             v = None
         h = {}
@@ -175,17 +146,46 @@ def read_mrc(path, read_data=True, show_progress=False):
     return {'header': h, 'value': v, }
 
 def read_mrc_vol(path, show_progress=False):
+    import aitom.tomominer.io.pack as IP
+    if IP.is_pack_path(path):
+        return IP.read_vol(path)
     return read_mrc(path=path, show_progress=show_progress)['value']
 
-def put_mrc(mrc, path, overwrite=True):
-    path = os.path.realpath(path)
-    if (mrc.dtype != N.float):
-        mrc = N.array(mrc, order='F', dtype=N.float)
-    if (not mrc.flags['F_CONTIGUOUS']):
-        mrc = N.array(mrc, order='F', dtype=N.float)
-    path = str(path)
+def put_mrc(mrc, path, overwrite=True, dtype=N.float32):
+    path = os.path.realpath(str(path))
     if ((overwrite == False) and os.path.isfile(path)):
         return
-    import aitom.tomominer.core.core as core
-    core.write_mrc(mrc, path)
+    write_mrc(mrc, path, dtype=dtype)
 
+def write_mrc(v, path, dtype=None):
+    """
+    write a 3D volume in a single call. dtype selects the MRC mode (int8, int16, float32, uint16, float16),
+    by default the dtype of v is kept when it has a MRC mode, otherwise float32 is used.
+    """
+    assert (v.ndim == 3)
+    if (dtype is None):
+        try:
+            mrc_mode_of_dtype(v.dtype)
+            dtype = v.dtype
+        except Exception:
+            dtype = N.float32
+    mode = mrc_mode_of_dtype(dtype)
+    dtype = mrc_mode_dtype[mode]
+    # v.T of a Fortran ordered volume is C contiguous, in such case no copy is made
+    vt = N.ascontiguousarray(v.T, dtype=dtype)
+    h = N.zeros(1, dtype=mrc_header_dtype)
+    (h['nx'], h['ny'], h['nz']) = v.shape
+    h['mode'] = mode
+    (h['mx'], h['my'], h['mz']) = v.shape
+    (h['xlen'], h['ylen'], h['zlen']) = v.shape
+    (h['mapc'], h['mapr'], h['maps']) = (1, 2, 3)
+    if (vt.size > 0):
+        h['amin'] = vt.min()
+        h['amax'] = vt.max()
+        h['amean'] = vt.mean(dtype=N.float64)
+        h['rms'] = vt.std(dtype=N.float64)
+    h['cmap'] = b'MAP '
+    h['stamp'] = b'DA\x00\x00'
+    with open(path, 'wb') as f:
+        h.tofile(f)
+        vt.tofile(f)
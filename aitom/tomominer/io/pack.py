@@ -0,0 +1,294 @@
+'''
+Packed, indexed storage of many small volumes (subtomograms, masks) in a few large chunk files.
+
+A pack is a directory whose name ends with PACK_EXT. It contains
+    chunk-<writer>-<n>.bin      concatenated raw (optionally zlib compressed) voxel blocks
+    index-<writer>.log          key -> entry index written by one writer, a sequence of pickled dicts, one per flush,
+                                holding the entries added since the previous flush
+where every writer process appends to its own chunk and index files, so several processes can fill a pack at the same
+time. A flush costs only the entries added since the last one, and readers load only the records appended since their
+last refresh. Packs written before the index log, with one index-<writer>.pickle per writer, are still readable. Identical volumes (e.g. a wedge mask shared by all subtomograms of a tomogram) are stored only once.
+
+A volume inside a pack is addressed by the path  <pack dir>/<key>  (see pack_path()), so data_json records can refer
+to it in place of an mrc file, and tomominer.io.file.read_mrc_vol() / get_mrc() read such paths unchanged.
+'''
+
+import os
+import uuid
+import zlib
+import pickle
+import hashlib
+import threading
+import numpy as N
+
+PACK_EXT = '.vpack'
+
+def is_pack_path(path):
+    return (split_pack_path(path) is not None)
+
+def split_pack_path(path):
+    '''split <pack dir>/<key> into (pack dir, key), return None if path does not point into a pack'''
+    path = str(path)
+    i = path.find((PACK_EXT + os.sep))
+    if (i < 0):
+        return None
+    i += len(PACK_EXT)
+    return (path[:i], path[(i + 1):])
+
+def pack_path(pack_dir, key):
+    return os.path.join(pack_dir, key)
+
+class Pack:
+
+    def __init__(self, path, mode='r', compress_level=0, chunk_size=(2 ** 30), dedup=True):
+        '''
+        mode 'r' opens an existing pack for reading, mode 'a' additionally allows adding new volumes.
+        compress_level is the zlib level for new volumes, 0 stores them uncompressed.
+        '''
+        assert (mode in ['r', 'a'])
+        self.path = os.path.abspath(str(path))
+        self.mode = mode
+        self.compress_level = compress_level
+        self.chunk_size = chunk_size
+        self.dedup = dedup
+        self.lock = threading.Lock()
+        self.files = {}
+        self.index = {}
+        self.digests = {}
+        self.index_mtimes = {}
+        # read position in every index log, records after it have not been loaded yet
+        self.index_offsets = {}
+        if (mode == 'a'):
+            if (not os.path.isdir(self.path)):
+                os.makedirs(self.path)
+            self.writer_id = str(uuid.uuid4())
+            # entries added since the last flush
+            self.writer_index_new = {}
+            self.writer_chunk_i = 0
+            self.writer_chunk = None
+            self.writer_chunk_name = None
+        elif (not os.path.isdir(self.path)):
+            raise IOError(('pack not found: ' + self.path))
+        self.refresh()
+
+    def refresh(self):
+        '''load the index records that are new, or have been added by other writers'''
+        for fn in os.listdir(self.path):
+            if (not fn.startswith('index-')):
+                continue
+            fp = os.path.join(self.path, fn)
+            if fn.endswith('.log'):
+                self.refresh__log(fn, fp)
+                continue
+            if (not fn.endswith('.pickle')):
+                continue
+            mt = os.path.getmtime(fp)
+            if (self.index_mtimes.get(fn) == mt):
+                continue
+            with open(fp, 'rb') as f:
+                ind = pickle.load(f)
+            self.index_mtimes[fn] = mt
+            self.refresh__update(ind)
+
+    def refresh__log(self, fn, fp):
+        offset = self.index_offsets.get(fn, 0)
+        if (os.path.getsize(fp) <= offset):
+            return
+        with open(fp, 'rb') as f:
+            f.seek(offset)
+            while True:
+                try:
+                    ind = pickle.load(f)
+                except (EOFError, pickle.UnpicklingError, ValueError):
+                    # end of the log, or a record that the writer is still appending
+                    break
+                offset = f.tell()
+                self.refresh__update(ind)
+        self.index_offsets[fn] = offset
+
+    def refresh__update(self, ind):
+        self.index.update(ind)
+        for e in ind.values():
+            self.digests[e['digest']] = e
+
+    def key_of(self, key):
+        # accept both plain keys and <pack dir>/<key> paths, so that the pack can be used as an img_db
+        sp = split_pack_path(key)
+        if (sp is not None):
+            return sp[1]
+        return str(key)
+
+    def __contains__(self, key):
+        key = self.key_of(key)
+        if (key not in self.index):
+            self.refresh()
+        return (key in self.index)
+
+    def __len__(self):
+        return len(self.index)
+
+    def __iter__(self):
+        return iter(list(self.index.keys()))
+
+    def keys(self):
+        return list(self.index.keys())
+
+    def entry(self, key):
+        key = self.key_of(key)
+        if (key not in self.index):
+            self.refresh()
+        if (key not in self.index):
+            raise KeyError(key)
+        return self.index[key]
+
+    def __getitem__(self, key):
+        return self.decode(self.entry(key), self.read_raw(self.entry(key)))
+
+    def get(self, key):
+        return self[key]
+
+    def get_many(self, keys):
+        '''batched read, the entries are read in the order of their location inside the chunk files'''
+        es = [self.entry(_) for _ in keys]
+        order = sorted(range(len(es)), key=(lambda _: (es[_]['chunk'], es[_]['offset'])))
+        vs = ([None] * len(es))
+        for i in order:
+            vs[i] = self.decode(es[i], self.read_raw(es[i]))
+        return vs
+
+    def file_of(self, chunk):
+        with self.lock:
+            if (chunk not in self.files):
+                self.files[chunk] = os.open(os.path.join(self.path, chunk), os.O_RDONLY)
+            return self.files[chunk]
+
+    def read_raw(self, e):
+        b = os.pread(self.file_of(e['chunk']), e['nbytes'], e['offset'])
+        if (len(b) != e['nbytes']):
+            raise IOError(('incomplete read of ' + e['chunk']))
+        return b
+
+    def decode(self, e, b):
+        if e['compressed']:
+            b = zlib.decompress(b)
+        return N.frombuffer(b, dtype=N.dtype(e['dtype'])).reshape(e['shape'], order='F').copy(order='F')
+
+    def __setitem__(self, key, v):
+        self.put(key, v)
+
+    def put(self, key, v):
+        '''add volume v under key, return the path that refers to it'''
+        assert (self.mode == 'a')
+        key = self.key_of(key)
+        v = N.asfortranarray(v)
+        # v.T of a Fortran ordered volume is C contiguous, so this does not copy
+        raw = N.ascontiguousarray(v.T).tobytes()
+        digest = hashlib.sha1((((str(v.dtype) + str(v.shape)).encode()) + raw)).hexdigest()
+        with self.lock:
+            if (self.dedup and (digest in self.digests)):
+                e = dict(self.digests[digest])
+            else:
+                compressed = (self.compress_level > 0)
+                if compressed:
+                    raw = zlib.compress(raw, self.compress_level)
+                (chunk, offset) = self.append_raw(raw)
+                e = {'chunk': chunk, 'offset': offset, 'nbytes': len(raw), 'compressed': compressed, 'dtype': v.dtype.str, 'shape': tuple(v.shape), 'digest': digest, }
+                self.digests[digest] = e
+            self.index[key] = e
+            self.writer_index_new[key] = e
+        return pack_path(self.path, key)
+
+    def append_raw(self, raw):
+        if ((self.writer_chunk is None) or ((self.writer_chunk.tell() + len(raw)) > self.chunk_size)):
+            if (self.writer_chunk is not None):
+                self.writer_chunk.close()
+            self.writer_chunk_name = ('chunk-%s-%05d.bin' % (self.writer_id, self.writer_chunk_i))
+            self.writer_chunk_i += 1
+            self.writer_chunk = open(os.path.join(self.path, self.writer_chunk_name), 'wb')
+        offset = self.writer_chunk.tell()
+        self.writer_chunk.write(raw)
+        return (self.writer_chunk_name, offset)
+
+    def flush(self):
+        '''make the added volumes visible to readers, by appending the entries added since the last flush to the index log'''
+        if (self.mode != 'a'):
+            return
+        with self.lock:
+            if (len(self.writer_index_new) == 0):
+                return
+            # the voxels must be on disk before an index record refers to them
+            if (self.writer_chunk is not None):
+                self.writer_chunk.flush()
+                os.fsync(self.writer_chunk.fileno())
+            fn = os.path.join(self.path, ('index-%s.log' % (self.writer_id,)))
+            with open(fn, 'ab') as f:
+                f.write(pickle.dumps(self.writer_index_new, protocol=(-1)))
+                f.flush()
+                os.fsync(f.fileno())
+            self.writer_index_new = {}
+
+    def close(self):
+        self.flush()
+        if ((self.mode == 'a') and (self.writer_chunk is not None)):
+            self.writer_chunk.close()
+            self.writer_chunk = None
+        with self.lock:
+            for fd in self.files.values():
+                os.close(fd)
+            self.files = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+# packs opened for reading in this process, so that the index is loaded only once
+open_packs = {}
+open_packs_lock = threading.Lock()
+
+def get_pack(pack_dir):
+    pack_dir = os.path.abspath(pack_dir)
+    with open_packs_lock:
+        if (pack_dir not in open_packs):
+            open_packs[pack_dir] = Pack(pack_dir, mode='r')
+        return open_packs[pack_dir]
+
+def read_vol(path):
+    (pack_dir, key) = split_pack_path(path)
+    return get_pack(pack_dir)[key]
+
+def read_vols(paths):
+    '''batched read of many volumes, grouped by pack'''
+    vs = ([None] * len(paths))
+    groups = {}
+    for (i, p) in enumerate(paths):
+        (pack_dir, key) = split_pack_path(p)
+        groups.setdefault(pack_dir, []).append((i, key))
+    for (pack_dir, ik) in groups.items():
+        vs_t = get_pack(pack_dir).get_many([_[1] for _ in ik])
+        for (j, (i, _)) in enumerate(ik):
+            vs[i] = vs_t[j]
+    return vs
+
+def pack_data_json(data_json, pack_dir, keys=('subtomogram', 'mask'), compress_level=0):
+    '''
+    copy the mrc files referred by data_json into a pack, return a new data_json referring to the pack.
+    masks that are shared across records are stored once.
+    '''
+    import copy
+    import aitom.tomominer.io.file as IF
+    dj = copy.deepcopy(data_json)
+    path_map = {}
+    with Pack(pack_dir, mode='a', compress_level=compress_level) as p:
+        for r in dj:
+            for k in keys:
+                if (k not in r):
+                    continue
+                if (r[k] not in path_map):
+                    path_map[r[k]] = p.put(pack_key_of_file(r[k]), IF.read_mrc_vol(r[k]))
+                r[k] = path_map[r[k]]
+    return dj
+
+def pack_key_of_file(path):
+    return os.path.abspath(path).strip(os.sep).replace(os.sep, '--')
@@ -8,18 +8,38 @@ Please cite: Xu et al. De novo visual proteomics of single cells through pattern
 
 
 import socket
-import pickle
 import time
+import threading
+from aitom.tomominer.parallel.RPCMessage import send_message, recv_message, set_low_latency
+
+
+class ServerBusy(Exception):
+    '''the server kept rejecting a call because of overload'''
+    pass
 
 
 class RPCClient(object):
+    '''
+    calls are sent as RPCMessage messages. Every request carries an id, so that several calls can be in flight on the
+    one connection, see pipeline()
+    '''
 
-    def __init__(self, host, port, tcp_keepidle=(60 * 5), tcp_keepintvl=30, tcp_keepcnt=5):
+    def __init__(self, host, port, tcp_keepidle=(60 * 5), tcp_keepintvl=30, tcp_keepcnt=5, busy_max_wait=None, reconnect_max_wait=(60 * 10), reconnect_delay=5):
         self.host = host
+        # how long a call rejected by an overloaded server is retried, None means forever
+        self.busy_max_wait = busy_max_wait
+        # how long to keep trying to connect again when the connection is lost, e.g. while the server restarts.
+        # None means forever, 0 means the error is raised right away
+        self.reconnect_max_wait = reconnect_max_wait
+        self.reconnect_delay = reconnect_delay
         self.port = port
         self.tcp_keepidle = tcp_keepidle
         self.tcp_keepintvl = tcp_keepintvl
         self.tcp_keepcnt = tcp_keepcnt
+        self._lock = threading.RLock()
+        self._request_id = 0
+        # responses that arrived while waiting for another request
+        self._responses = {}
         self._connect()
 
     def __del__(self):
@@ -34,10 +54,9 @@ class RPCClient(object):
             self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, self.tcp_keepidle)
             self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPCNT, self.tcp_keepcnt)
             self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, self.tcp_keepintvl)
+            set_low_latency(self.socket)
             try:
                 self.socket.connect((self.host, self.port))
-                self.rfile = self.socket.makefile('rb')
-                self.wfile = self.socket.makefile('wb')
                 return
             except socket.error as exc:
                 raise
@@ -55,8 +74,72 @@ class RPCClient(object):
     def _close(self):
         self.socket.shutdown(socket.SHUT_RDWR)
         self.socket.close()
-        self.rfile.close()
-        self.wfile.close()
+
+    def _reconnect(self, err):
+        '''the connection has been lost, connect again, a restarted server replays its journal'''
+        if (self.reconnect_max_wait == 0):
+            raise err
+        try:
+            self._close()
+        except socket.error:
+            pass
+        # responses of the old connection will never arrive
+        self._responses = {}
+        start = time.time()
+        while True:
+            try:
+                self._connect()
+                return
+            except socket.error:
+                if ((self.reconnect_max_wait is not None) and ((time.time() - start) > self.reconnect_max_wait)):
+                    raise err
+                time.sleep(self.reconnect_delay)
+
+    def _submit(self, name, args, kwargs):
+        '''send a call without waiting for its result, return the request id'''
+        with self._lock:
+            self._request_id += 1
+            send_message(self.socket, (self._request_id, {'method': name, 'args': args, 'kwargs': kwargs, }))
+            return self._request_id
+
+    def _receive(self, request_id):
+        with self._lock:
+            while (request_id not in self._responses):
+                (request_id_t, status, result) = recv_message(self.socket)
+                self._responses[request_id_t] = (status, result)
+            return self._responses.pop(request_id)
+
+    def _result(self, request_id, name, args, kwargs):
+        busy_start = None
+        while True:
+            (status, result) = self._receive(request_id)
+            if (status == 'OK'):
+                return result
+            elif (status == 'BUSY'):
+                # the server rejected the call, back off on the client side and try again
+                if (busy_start is None):
+                    busy_start = time.time()
+                if ((self.busy_max_wait is not None) and ((time.time() - busy_start) > self.busy_max_wait)):
+                    raise ServerBusy(name)
+                time.sleep(result)
+                request_id = self._submit(name, args, kwargs)
+            else:
+                raise result
+
+    def pipeline(self, calls):
+        '''
+        send all calls, each given as (method, args, kwargs), before waiting for any result.
+        saves one network round trip per call, the results are returned in the order of the calls
+        '''
+        calls = [(name, tuple(args), dict(kwargs)) for (name, args, kwargs) in calls]
+        with self._lock:
+            while True:
+                try:
+                    request_ids = [self._submit(*_) for _ in calls]
+                    return [self._result(request_ids[i], *calls[i]) for i in range(len(calls))]
+                except (EOFError, ConnectionError) as err:
+                    # all calls are sent again, the server ignores tasks that it already has
+                    self._reconnect(err)
 
     def __getattr__(self, name):
         if name.startswith('_'):
@@ -64,23 +147,10 @@ class RPCClient(object):
             return
 
         def proxy(*args, **kwargs):
-            while True:
-                try:
-                    pickle.dump({'method': name, 'args': args, 'kwargs': kwargs, }, self.wfile, protocol=2)
-                    self.wfile.flush()
-                    (status, result) = pickle.load(self.rfile)
-                    if (status == 'OK'):
-                        return result
-                    else:
-                        raise result
-                except socket.timeout:
-                    time.sleep(5.0)
-                    continue
-                except (socket.error, EOFError) as e:
-                    raise
+            with self._lock:
+                while True:
                     try:
-                        self._close()
-                    except:
-                        pass
-                    self._connect()
-        return proxy
\ No newline at end of file
+                        return self._result(self._submit(name, args, kwargs), name, args, kwargs)
+                    except (EOFError, ConnectionError) as err:
+                        self._reconnect(err)
+        return proxy
@@ -0,0 +1,78 @@
+'''
+Length prefixed binary messages used by RPCClient and RPCServer.
+
+An object is serialized with pickle protocol 5, and large contiguous buffers inside it (e.g. numpy arrays) are kept
+out of band. On the wire a message is
+    header      magic, payload size, number of buffers          (struct HEADER_FORMAT)
+    sizes       size of every out of band buffer                 (one !Q each)
+    payload     the pickle stream, without the buffer contents
+    buffers     the raw contents of the buffers, one after another
+The buffers are handed to the socket directly (scatter/gather send), and received into freshly allocated bytearrays
+that the unpickled arrays then use as their memory, so array data is not copied on either side.
+'''
+
+import socket
+import struct
+import pickle
+import itertools
+import collections
+
+MAGIC = b'TMR1'
+HEADER_FORMAT = '!4sQI'
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+
+# max number of buffers passed to one sendmsg() call, must stay below the IOV_MAX of the system
+SENDMSG_MAX_BUFFERS = 512
+
+
+def send_message(sock, obj):
+    buffers = []
+    payload = pickle.dumps(obj, protocol=5, buffer_callback=buffers.append)
+    views = [_.raw() for _ in buffers]
+    header = struct.pack(HEADER_FORMAT, MAGIC, len(payload), len(views)) + struct.pack(('!%dQ' % len(views)), *[_.nbytes for _ in views])
+    send_views(sock, ([header, payload] + views))
+
+
+def send_views(sock, views):
+    views = collections.deque(memoryview(_).cast('B') for _ in views if (len(_) > 0))
+    if (not hasattr(sock, 'sendmsg')):
+        for v in views:
+            sock.sendall(v)
+        return
+    while views:
+        n = sock.sendmsg(list(itertools.islice(views, SENDMSG_MAX_BUFFERS)))
+        # drop what has been sent, sendmsg() may stop in the middle of a buffer
+        while (n > 0):
+            if (n >= views[0].nbytes):
+                n -= views[0].nbytes
+                views.popleft()
+            else:
+                views[0] = views[0][n:]
+                n = 0
+
+
+def recv_message(sock):
+    '''receive one message, raise EOFError if the connection has been closed'''
+    (magic, payload_size, buffer_num) = struct.unpack(HEADER_FORMAT, recv_exactly(sock, HEADER_SIZE))
+    if (magic != MAGIC):
+        raise IOError('invalid message header')
+    sizes = struct.unpack(('!%dQ' % buffer_num), recv_exactly(sock, (8 * buffer_num)))
+    payload = recv_exactly(sock, payload_size)
+    buffers = [recv_exactly(sock, _) for _ in sizes]
+    return pickle.loads(payload, buffers=buffers)
+
+
+def recv_exactly(sock, n):
+    buf = bytearray(n)
+    v = memoryview(buf)
+    while (len(v) > 0):
+        k = sock.recv_into(v)
+        if (k == 0):
+            raise EOFError
+        v = v[k:]
+    return buf
+
+
+def set_low_latency(sock):
+    '''requests are small and often pipelined, do not let Nagle's algorithm delay them'''
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
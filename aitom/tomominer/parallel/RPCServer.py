@@ -8,33 +8,43 @@ Please cite: Xu et al. De novo visual proteomics of single cells through pattern
 
 
 import socketserver
-import pickle
+import threading
 import time
 import sys
 import select
 import os
 import psutil
+from aitom.tomominer.parallel.RPCMessage import send_message, recv_message, set_low_latency
 
 
-class RPCHandler(socketserver.StreamRequestHandler):
+class RPCHandler(socketserver.BaseRequestHandler):
+    '''
+    serves the calls of one connection, see RPCMessage for the message format.
+    a request is (request_id, call), the response is (request_id, status, result). A client may send several requests
+    before reading the responses (pipelining), they are answered in order.
+    '''
 
     def handle(self):
         self.server.active_connections += 1
+        set_low_latency(self.request)
         while True:
             try:
-                data = pickle.load(self.rfile)
-            except EOFError:
+                (request_id, data) = recv_message(self.request)
+            except (EOFError, ConnectionError):
                 break
             try:
+                busy = self.server._admit(data)
+                if (busy is not None):
+                    send_message(self.request, (request_id, 'BUSY', busy))
+                    continue
                 result = self.server._dispatch(data)
             except Exception as e:
-                pickle.dump(('ERR', e), self.wfile, protocol=2)
+                send_message(self.request, (request_id, 'ERR', e))
                 if True:
                     import traceback
                     traceback.print_exc()
             else:
-                pickle.dump(('OK', result), self.wfile, protocol=2)
-            self.wfile.flush()
+                send_message(self.request, (request_id, 'OK', result))
         self.server.active_connections -= 1
 
 
@@ -43,17 +53,41 @@ class RPCServer(socketserver.ThreadingTCPServer):
     allow_reuse_address = True
     active_connections = 0
 
-    def __init__(self, addr, requestHandler=RPCHandler, bind_and_activate=True):
+    # methods that add new work, they are rejected while the server is overloaded. Other methods (e.g. get_task,
+    # put_result) reduce the load and are always served
+    throttled_methods = frozenset(['put_task', 'put_tasks', 'put_broadcast_task'])
+
+    def __init__(self, addr, requestHandler=RPCHandler, bind_and_activate=True, cpu_usage_threshold=200, cpu_sample_interval=1.0, busy_retry_interval=1.0):
         self.instance = None
         socketserver.ThreadingTCPServer.__init__(self, addr, requestHandler, bind_and_activate)
         self.previous_method = None
         self.same_method_call_count = 0
         self.process = psutil.Process(os.getpid())
+        self.cpu_usage_threshold = cpu_usage_threshold
+        self.cpu_sample_interval = cpu_sample_interval
+        self.busy_retry_interval = busy_retry_interval
+        # cpu usage is sampled in the background, the dispatch path only reads the latest value
+        self.cpu_usage = 0.0
+        t = threading.Thread(target=self._sample_cpu_usage, name='rpc_server_cpu_sampler')
+        t.daemon = True
+        t.start()
 
     def register_instance(self, obj):
         self.instance = obj
 
-    def _dispatch(self, data, cpu_usage_threshold=200):
+    def _sample_cpu_usage(self):
+        self.process.cpu_percent(interval=None)
+        while True:
+            time.sleep(self.cpu_sample_interval)
+            self.cpu_usage = self.process.cpu_percent(interval=None)
+
+    def _admit(self, data):
+        '''admission decision, without waiting. returns None to accept the call, otherwise the interval after which the client should retry'''
+        if ((self.cpu_usage >= self.cpu_usage_threshold) and (data.get('method') in self.throttled_methods)):
+            return self.busy_retry_interval
+        return None
+
+    def _dispatch(self, data):
         try:
             method = data['method']
             args = data['args']
@@ -69,11 +103,6 @@ class RPCServer(socketserver.ThreadingTCPServer):
                 sys.stdout.write('\n')
             self.same_method_call_count += 1
             sys.stdout.write((((('\r' + method) + ' ') + repr(self.same_method_call_count)) + '\t'))
-        while True:
-            cpu_usage = self.process.cpu_percent(interval=1)
-            if (cpu_usage < cpu_usage_threshold):
-                break
-            time.sleep(1)
         if method.startswith('_'):
             raise AttributeError(("Cannot call method (%s) with leading '_'" % method))
         if hasattr(self.instance, method):
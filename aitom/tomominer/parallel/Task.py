@@ -7,23 +7,27 @@ Please cite: Xu et al. De novo visual proteomics of single cells through pattern
 
 
 
+import os
 import uuid
 import time
 
 
 class Task(object):
 
-    def __init__(self, priority=1000, proj_id=None, module=None, method=None, args=[], kwargs={}):
+    def __init__(self, priority=1000, proj_id=None, module=None, method=None, args=[], kwargs={}, data_keys=None, task_id=None):
         self.priority = priority
         self.proj_id = proj_id
         assert (proj_id is not None)
-        self.task_id = str(uuid.uuid4())
+        # a task_id given by the caller must be unique in the project, see QueueMaster.task_key()
+        self.task_id = (task_id if (task_id is not None) else str(uuid.uuid4()))
         self.module = module
         assert (module is not None)
         self.method = method
         assert (method is not None)
         self.args = args
         self.kwargs = kwargs
+        # paths of the volumes the task reads, the server prefers workers that have them in their cache
+        self.data_keys = data_keys
         self.max_tries = 1
         self.max_time = None
         self.tries = 0
@@ -33,6 +37,9 @@ class Task(object):
         self.todo_queue_total = None
         self.calc_total = None
         self.done_queue_total = None
+        # the worker that returned the result, and the durations measured by it, see queue_stats
+        self.worker_id = None
+        self.timing = {}
 
     def fail(self, msg=''):
         self.error = True
@@ -41,5 +48,14 @@ class Task(object):
     def succ(self, res):
         self.result = res
 
+    def __lt__(self, other):
+        # queues hold (priority, task) tuples, tasks are compared only when their priorities are equal
+        return (self.priority < other.priority)
+
     def __repr__(self):
-        return ('Task( proj_id = %s, task_id = %s,  module = %s, method = %s, error = %s, error_msg = %s, result = %s )' % ((self.proj_id[:8] + '...'), (self.task_id[:8] + '...'), self.module, self.method, self.error, self.error_msg, self.result))
\ No newline at end of file
+        return ('Task( proj_id = %s, task_id = %s,  module = %s, method = %s, error = %s, error_msg = %s, result = %s )' % ((self.proj_id[:8] + '...'), (self.task_id[:8] + '...'), self.module, self.method, self.error, self.error_msg, self.result))
+
+
+def data_json_keys(data_json, keys=('subtomogram',)):
+    '''data keys of the records of a data_json, for Task.data_keys'''
+    return [os.path.abspath(r[k]) for r in data_json for k in keys if (k in r)]
@@ -0,0 +1,77 @@
+'''
+Persistent journal of the tasks of a QueueServer, kept in a SQLite database.
+
+Every task that is submitted is recorded together with its state
+    todo        submitted, waiting in the queue
+    out         assigned to a worker
+    done        finished, the task (with its result or error) waits to be collected by its project
+Rows are removed when the result is collected by get_results(), or when the project is deleted. A restarted server
+replays the journal: todo and out tasks are queued again, and done tasks are put back into the done queue of their
+project, so that a master reconnecting with the same proj_id collects them without resubmitting finished work. A
+restarted master recreates the ids of its tasks from their arguments, see QueueMaster.task_key().
+
+Large results are expected to be references (e.g. the file names returned by reduce.run__reduce()), the journal
+stores results as they are returned by the tasks.
+'''
+
+import time
+import pickle
+import sqlite3
+import threading
+
+
+class TaskJournal:
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        # the server calls the journal from its RPC handler threads, access is serialized by self.lock
+        self.db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        # the write ahead log keeps the database consistent if the server is killed, synchronous=NORMAL only risks
+        # losing the last transactions on a power failure, not on a crash of the process
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS tasks (task_id TEXT PRIMARY KEY, proj_id TEXT, state TEXT, worker_id TEXT, time REAL, task BLOB)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS tasks_proj_id ON tasks (proj_id)')
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+    def write(self, sql, rows):
+        with self.lock:
+            self.db.execute('BEGIN')
+            try:
+                self.db.executemany(sql, rows)
+                self.db.execute('COMMIT')
+            except:
+                self.db.execute('ROLLBACK')
+                raise
+
+    def submit(self, tasks):
+        now = time.time()
+        self.write('INSERT OR REPLACE INTO tasks (task_id, proj_id, state, worker_id, time, task) VALUES (?, ?, ?, NULL, ?, ?)', [(t.task_id, t.proj_id, 'todo', now, pickle.dumps(t, protocol=(-1))) for t in tasks])
+
+    def assign(self, task_id, worker_id):
+        self.write('UPDATE tasks SET state = ?, worker_id = ?, time = ? WHERE task_id = ?', [('out', (None if (worker_id is None) else str(worker_id)), time.time(), task_id)])
+
+    def complete(self, task):
+        '''record a finished task, together with its result'''
+        self.write('UPDATE tasks SET state = ?, time = ?, task = ? WHERE task_id = ?', [('done', time.time(), pickle.dumps(task, protocol=(-1)), task.task_id)])
+
+    def collected(self, task_ids):
+        self.write('DELETE FROM tasks WHERE task_id = ?', [(_,) for _ in task_ids])
+
+    def delete_projects(self, proj_ids):
+        self.write('DELETE FROM tasks WHERE proj_id = ?', [(_,) for _ in proj_ids])
+
+    def project_states(self, proj_id):
+        '''{task_id: state} of the tasks of a project'''
+        with self.lock:
+            return dict(self.db.execute('SELECT task_id, state FROM tasks WHERE proj_id = ?', (proj_id,)).fetchall())
+
+    def replay(self):
+        '''all journaled tasks, as (state, task) in the order of their last update'''
+        with self.lock:
+            rows = self.db.execute('SELECT state, task FROM tasks ORDER BY time').fetchall()
+        return [(state, pickle.loads(task)) for (state, task) in rows]
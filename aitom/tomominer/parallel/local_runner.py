@@ -0,0 +1,178 @@
+'''
+Single node replacement of QueueMaster, QueueServer and QueueWorker processes.
+
+LocalRunner has the task() / run() / run__except() / run__reduce() / estimate_chunk_size() interface of QueueMaster, and executes the
+tasks on a local process pool. Task arguments and results are pickled with protocol 5; numpy arrays (and other large
+contiguous buffers) of at least shm_min_bytes are passed through shared memory blocks instead of the pool pipe or
+temporary files. The receiving side maps a block, unlinks its name right away, and the unpickled arrays use the
+mapping as their memory, so the block is freed together with the last array that refers to it.
+
+usage:
+    self.runner = LocalRunner(worker_num=64)
+    for res in self.runner.run__except(tasks): ...
+'''
+
+import os
+import uuid
+import queue
+import random
+import logging
+import tempfile
+import traceback
+import importlib
+import multiprocessing
+from aitom.tomominer.parallel.Task import Task
+from aitom.tomominer.parallel.queue_master import QueueMaster
+from aitom.tomominer.io.cache import Cache
+from aitom.parallel.multiprocessing.shm import shm_dumps, shm_loads, shm_free
+
+
+class LocalWorker:
+    '''the worker object passed as self to the task functions inside a pool process'''
+
+    def __init__(self, tmp_dir, cache_mem_max_bytes=0, shm_min_bytes=(2 ** 20)):
+        self.cache = Cache(tmp_dir=tmp_dir, mem_max_bytes=cache_mem_max_bytes)
+        self.cache_none = Cache()
+        self.pool = None
+        self.task = None
+        self.shm_min_bytes = shm_min_bytes
+        self.logger = logging.LoggerAdapter(logging.getLogger(), {'host': os.environ.get('HOSTNAME', 'unknown'), 'job_id': 'local', 'source_type': 'local_worker', })
+        self.funcs = {}
+        self.work_queue = self
+
+    def done_tasks_contains(self, task_id):
+        # tasks are never executed twice
+        return False
+
+    def get_func(self, module, method):
+        k = (module, method)
+        if (k not in self.funcs):
+            self.funcs[k] = getattr(importlib.import_module(module), method)
+        return self.funcs[k]
+
+
+local_worker = None
+
+
+def local_worker_init(tmp_dir, cache_mem_max_bytes, shm_min_bytes):
+    global local_worker
+    import numpy as N
+    # different processes need different random seeds
+    N.random.seed(random.randint(0, 123456789))
+    local_worker = LocalWorker(tmp_dir=tmp_dir, cache_mem_max_bytes=cache_mem_max_bytes, shm_min_bytes=shm_min_bytes)
+
+
+def local_execute(task_d):
+    '''run one task inside a pool process, returns (error, error_msg, result) encoded by shm_dumps()'''
+    w = local_worker
+    try:
+        task = shm_loads(task_d)
+        func = w.get_func(task.module, task.method)
+        assert ('self' not in task.kwargs)
+        w.task = task
+        task.kwargs['self'] = w
+        re = (False, None, func(*task.args, **task.kwargs))
+    except Exception:
+        re = (True, traceback.format_exc(), None)
+    finally:
+        w.task = None
+    try:
+        return shm_dumps(re, w.shm_min_bytes)
+    except Exception:
+        return shm_dumps((True, traceback.format_exc(), None), w.shm_min_bytes)
+
+
+class LocalRunner:
+    '''
+    runs tasks on a pool of worker_num local processes, with the interface of QueueMaster.
+    tmp_dir is used by tasks that still write temporary files (Cache.save_tmp_data), default is the system tmp dir
+    '''
+
+    def __init__(self, worker_num=None, tmp_dir=None, cache_mem_max_bytes=0, shm_min_bytes=(2 ** 20)):
+        if (worker_num is None):
+            worker_num = multiprocessing.cpu_count()
+        if (tmp_dir is None):
+            tmp_dir = tempfile.gettempdir()
+        self.worker_num = worker_num
+        self.shm_min_bytes = shm_min_bytes
+        self.proj_id = str(uuid.uuid4())
+        self.logger = logging.LoggerAdapter(logging.getLogger(), {'host': os.environ.get('HOSTNAME', 'unknown'), 'job_id': 'local', 'source_type': 'local_runner', })
+        self.pool = multiprocessing.Pool(processes=worker_num, initializer=local_worker_init, initargs=(tmp_dir, cache_mem_max_bytes, shm_min_bytes))
+        # callers that ask the queue, e.g. for get_worker_number(), get the runner itself
+        self.work_queue = self
+
+    def task(self, priority=1000, module=None, method=None, args=[], kwargs={}, data_keys=None):
+        return Task(priority=priority, proj_id=self.proj_id, module=module, method=method, args=args, kwargs=kwargs, data_keys=data_keys)
+
+    def get_worker_number(self):
+        return self.worker_num
+
+    def close(self):
+        if (self.pool is not None):
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def submit(self, task, done):
+        d = shm_dumps(task, self.shm_min_bytes)
+
+        def error_callback(e):
+            # the task did not run, or did not return, so its argument blocks may not have been loaded
+            shm_free(d)
+            done.put((task, e))
+        self.pool.apply_async(func=local_execute, args=(d,), callback=(lambda r: done.put((task, r))), error_callback=error_callback)
+
+    def run(self, tasks, max_time=None, max_retry=1, one_at_a_time=False):
+        '''
+        yields the tasks, with their result, error and error_msg set, in the order of completion.
+        a task that raised is re-executed until it has been tried max_retry times. max_time is not enforced
+        '''
+        done = queue.Queue()
+        state = {}
+        # tasks submitted whose result has not been taken from done
+        running = 0
+        try:
+            for t in tasks:
+                t.max_time = max_time
+                state[t.task_id] = max_retry
+                self.submit(t, done)
+                running += 1
+            while len(state):
+                (t, r) = done.get()
+                running -= 1
+                if isinstance(r, BaseException):
+                    (t.error, t.error_msg, t.result) = (True, repr(r), None)
+                else:
+                    (t.error, t.error_msg, t.result) = shm_loads(r)
+                if t.error:
+                    state[t.task_id] -= 1
+                    if (state[t.task_id] > 0):
+                        self.logger.warning('resubmitting crashed task: %s', t.task_id)
+                        self.submit(t, done)
+                        running += 1
+                        continue
+                del state[t.task_id]
+                yield t
+        finally:
+            # the caller stopped early, e.g. run__except() raised on a failed task, release the results still running
+            while (running > 0):
+                (t, r) = done.get()
+                running -= 1
+                if (not isinstance(r, BaseException)):
+                    shm_free(r)
+
+    run__except = QueueMaster.run__except
+    run__reduce = QueueMaster.run__reduce
+    estimate_chunk_size = QueueMaster.estimate_chunk_size
@@ -12,29 +12,50 @@ import os
 import sys
 import uuid
 import pickle
+import hashlib
 import _thread
 import numpy as N
 from aitom.tomominer.parallel.RPCClient import RPCClient
 from aitom.tomominer.parallel.RPCLoggingHandler import RPCLoggingHandler
 from aitom.tomominer.parallel.Task import Task
+import aitom.tomominer.parallel.reduce as PR
 import logging
 
 
 class QueueMaster:
 
-    def __init__(self, host, port):
+    def __init__(self, host, port, proj_id=None):
         self.work_queue = RPCClient(host, port)
         self.handler = RPCLoggingHandler(self.work_queue)
         self.logger = logging.getLogger()
         self.logger.addHandler(self.handler)
         self.logger.setLevel(logging.DEBUG)
         self.logger = logging.LoggerAdapter(logging.getLogger(), {'host': os.environ.get('HOSTNAME', 'unknown'), 'job_id': os.environ.get('PBS_JOBID', 'N/A').split('.')[0], 'source_type': 'queue_master', })
-        self.proj_id = str(uuid.uuid4())
+        # with a proj_id given by the caller, task ids are derived from the tasks (see task_key()), so that a master
+        # restarted with the same proj_id recreates the ids of the tasks of the previous run. run() then does not
+        # submit again the tasks the server still has, and collects the results the server holds for them
+        self.resumed = (proj_id is not None)
+        if (proj_id is None):
+            proj_id = str(uuid.uuid4())
+        self.proj_id = proj_id
+        self.task_keys = {}
         self.work_queue.new_project(self.proj_id)
         _thread.start_new_thread(QueueMaster.keep_alive, (self, RPCClient(host, port)))
 
-    def task(self, priority=1000, module=None, method=None, args=[], kwargs={}):
-        return Task(priority=priority, proj_id=self.proj_id, module=module, method=method, args=args, kwargs=kwargs)
+    def task(self, priority=1000, module=None, method=None, args=[], kwargs={}, data_keys=None):
+        task_id = (self.task_key(module=module, method=method, args=args, kwargs=kwargs) if self.resumed else None)
+        return Task(priority=priority, proj_id=self.proj_id, module=module, method=method, args=args, kwargs=kwargs, data_keys=data_keys, task_id=task_id)
+
+    def task_key(self, module, method, args, kwargs):
+        '''
+        deterministic task id: a hash of the function and the arguments of the task, and the number of identical tasks
+        created before it by this master. a restarted master that creates the same tasks gets the same ids, as long as
+        the arguments pickle to the same bytes (e.g. no sets of strings, whose order changes between processes)
+        '''
+        h = hashlib.sha1(pickle.dumps((module, method, args, kwargs), protocol=4)).hexdigest()
+        n = self.task_keys.get(h, 0)
+        self.task_keys[h] = (n + 1)
+        return ('%s-%s-%d' % (self.proj_id, h, n))
 
     def __del__(self):
         self.work_queue.del_project(self.proj_id)
@@ -53,10 +74,13 @@ class QueueMaster:
             t.max_time = max_time
             task_dict[t.task_id] = t
             state[t.task_id] = max_retry
+        if self.resumed:
+            known = self.work_queue.project_task_states(self.proj_id)
+            tasks = [_ for _ in tasks if (_.task_id not in known)]
         if one_at_a_time:
             for t in tasks:
                 self.work_queue.put_task(t)
-        else:
+        elif (len(tasks) > 0):
             self.work_queue.put_tasks(tasks)
         while len(state):
             results = self.work_queue.get_results(self.proj_id)
@@ -106,6 +130,10 @@ class QueueMaster:
                 raise Exception
             yield res
 
+    def run__reduce(self, tasks, ops=None, fan_in=8):
+        '''run tasks whose results are additive partial accumulators, and return their merge, see reduce.run__reduce()'''
+        return PR.run__reduce(self, tasks, ops=ops, fan_in=fan_in)
+
     def estimate_chunk_size(self, n, worker_number_multiply_factor=1.5):
         n_chunk = (float(n) / (self.work_queue.get_worker_number() * float(worker_number_multiply_factor)))
         n_chunk = N.max((n_chunk, 1))
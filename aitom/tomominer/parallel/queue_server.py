@@ -16,17 +16,36 @@ import uuid
 import _thread
 import threading
 import queue
+import itertools
 import logging
 import logging.handlers
 import psutil
 from aitom.tomominer.parallel.Task import Task
 from aitom.tomominer.parallel.RPCServer import RPCServer
+from aitom.tomominer.parallel.journal import TaskJournal
+from aitom.tomominer.parallel.queue_stats import QueueStats
 
 
 class QueueServer:
 
-    def __init__(self):
+    def __init__(self, stats_interval=1.0, print_stats=True, affinity_max_workers=2, steal_scan=100, journal_path=None, stats_dump_dir=None, stats_dump_interval=60.0):
+        # queued tasks are entries [task, taken, preferred workers, queued time], held in todo_queue as (priority, seq, entry).
+        # an entry is also put into the affinity queue of each preferred worker, whichever queue hands it out first
+        # marks it taken, and the other copies are dropped when they come up
         self.todo_queue = queue.PriorityQueue()
+        self.todo_count = 0
+        self.todo_seq = itertools.count()
+        self.affinity_queues = {}
+        # entries that are queued and not yet taken, by task id, so that a task is not queued twice
+        self.queued = {}
+        self.affinity_max_workers = affinity_max_workers
+        self.steal_scan = steal_scan
+        # data keys that are resident in the cache of each worker, and the inverse index
+        self.worker_keys = {}
+        self.key_workers = {}
+        self.locality_counts = {'affine': 0, 'neutral': 0, 'stolen': 0, }
+        # notified whenever a task (including a broadcast task) becomes available, get_task() waits on it
+        self.task_available = threading.Condition()
         self.done_queues = {}
         self.done_tasks_time = dict()
         self.done_tasks_time_max = (60.0 * 20)
@@ -48,13 +67,97 @@ class QueueServer:
         self.pub_logger.addHandler(h)
         self.logger = logging.LoggerAdapter(logging.getLogger(), {'host': os.environ.get('HOSTNAME', 'unknown'), 'job_id': os.environ.get('PBS_JOBID', 'N/A').split('.')[0], 'source_type': 'queue_server', })
         self.process = psutil.Process(os.getpid())
+        # cpu and queue statistics are sampled by a background thread, RPC methods only read the latest snapshot
+        self.stats_interval = stats_interval
+        self.print_stats = print_stats
+        self.stats = {'cpu': 0.0, 'proj': 0, 'worker': 0, 'todo': 0, 'in_progress': 0, 'done': 0, 'locality': dict(self.locality_counts), 'time': time.time(), }
+        # per task timing, worker throughput and project queue depths, see get_timing_stats(). if stats_dump_dir is
+        # given, they are appended to files in it every stats_dump_interval seconds
+        self.queue_stats = QueueStats()
+        self.stats_dump_dir = stats_dump_dir
+        self.stats_dump_interval = stats_dump_interval
+        # tasks that were assigned to a worker before a restart, and queued again when the journal was replayed
+        self.replayed = {}
+        self.journal = None
+        if (journal_path is not None):
+            self.journal = TaskJournal(journal_path)
+            self.replay_journal()
         _thread.start_new_thread(QueueServer.remove_dead_projects_daemon, (self,))
+        _thread.start_new_thread(QueueServer.stats_daemon, (self,))
+
+    def replay_journal(self):
+        '''restore the tasks of the journal, after a restart of the server'''
+        counts = {'todo': 0, 'out': 0, 'done': 0, }
+        with self.task_available:
+            for (state, task) in self.journal.replay():
+                if (task.proj_id not in self.done_queues):
+                    self.new_project(task.proj_id)
+                counts[state] += 1
+                if (state == 'done'):
+                    self.done_tasks_time[task.task_id] = time.time()
+                    self.done_queues[task.proj_id].put(task)
+                    continue
+                # the worker of an assigned task may still deliver the result, after reconnecting
+                if (state == 'out'):
+                    self.replayed[task.task_id] = task
+                self.enqueue_task(task)
+        self.logger.warning('replayed journal %s: %d todo, %d in progress, %d done tasks', self.journal.path, counts['todo'], counts['out'], counts['done'])
+
+    def stats_daemon(self):
+        self.process.cpu_percent(interval=None)
+        dump_time = time.time()
+        while True:
+            time.sleep(self.stats_interval)
+            self.update_stats()
+            self.queue_stats.snapshot(self.project_depths())
+            if ((self.stats_dump_dir is not None) and ((time.time() - dump_time) >= self.stats_dump_interval)):
+                dump_time = time.time()
+                try:
+                    self.queue_stats.dump(self.stats_dump_dir, self.get_timing_stats(history=False))
+                except (IOError, OSError) as err:
+                    self.logger.error('failed to dump stats to %s: %s', self.stats_dump_dir, err)
+            if self.print_stats:
+                print(('\r' + self.queue_stats_string()), end=' ')
+                sys.stdout.flush()
+
+    def update_stats(self):
+        self.stats = {'cpu': self.process.cpu_percent(interval=None), 'proj': len(self.done_queues), 'worker': self.get_worker_number(), 'todo': self.todo_count, 'in_progress': len(self.out_tasks), 'done': sum((_.qsize() for _ in list(self.done_queues.values()))), 'locality': dict(self.locality_counts), 'time': time.time(), }
+
+    def get_stats(self):
+        '''latest snapshot of the queue statistics'''
+        return dict(self.stats)
+
+    def project_depths(self):
+        '''number of queued, in progress and done tasks of each project'''
+        depths = {}
+        for proj_id in list(self.done_queues.keys()):
+            depths[proj_id] = {'todo': 0, 'in_progress': 0, 'done': 0, }
+        for entry in list(self.queued.values()):
+            depths.setdefault(entry[0].proj_id, {'todo': 0, 'in_progress': 0, 'done': 0, })['todo'] += 1
+        for task in list(self.out_tasks.values()):
+            depths.setdefault(task.proj_id, {'todo': 0, 'in_progress': 0, 'done': 0, })['in_progress'] += 1
+        for (proj_id, done_queue) in list(self.done_queues.items()):
+            depths[proj_id]['done'] = done_queue.qsize()
+        return depths
+
+    def get_timing_stats(self, straggler_factor=3.0, history=True):
+        '''
+        per method timing of the task phases, per worker throughput, per project queue depths (over time if history),
+        and the in progress tasks that run straggler_factor times longer than the mean of their method
+        '''
+        running = [(task, self.start_calc[task_id]) for (task_id, task) in list(self.out_tasks.items()) if (task_id in self.start_calc)]
+        re = {'time': time.time(), 'queue': self.get_stats(), 'methods': self.queue_stats.method_summary(), 'workers': self.queue_stats.worker_summary(), 'projects': self.project_depths(), 'stragglers': self.queue_stats.stragglers(running, factor=straggler_factor), }
+        if history:
+            re['history'] = list(self.queue_stats.history)
+        return re
 
     def log_queue_stats(self):
-        self.logger.debug('TODO_QUEUE: %6d    IN_PROGRESS: %6d    DONE_QUEUE: %6d', self.todo_queue.qsize(), len(self.out_tasks), sum((_.qsize() for _ in list(self.done_queues.values()))))
+        s = self.stats
+        self.logger.debug('TODO_QUEUE: %6d    IN_PROGRESS: %6d    DONE_QUEUE: %6d', s['todo'], s['in_progress'], s['done'])
 
     def queue_stats_string(self):
-        return ('CPU %3.0f  PROJ %2d  WORKER %4d    TODO_QUEUE: %6d  IN_PROGRESS: %4d  DONE_QUEUE: %3d ' % (self.process.cpu_percent(interval=1), len(self.done_queues), self.get_worker_number(), self.todo_queue.qsize(), len(self.out_tasks), sum((_.qsize() for _ in list(self.done_queues.values())))))
+        s = self.stats
+        return ('CPU %3.0f  PROJ %2d  WORKER %4d    TODO_QUEUE: %6d  IN_PROGRESS: %4d  DONE_QUEUE: %3d ' % (s['cpu'], s['proj'], s['worker'], s['todo'], s['in_progress'], s['done']))
 
     def new_project(self, proj_id, max_queue_size=0):
         lock = threading.Lock()
@@ -94,6 +197,8 @@ class QueueServer:
             with lock:
                 for proj_id in done_queues_to_delete:
                     del self.done_queues[proj_id]
+            if (self.journal is not None):
+                self.journal.delete_projects(done_queues_to_delete)
             return True
         except:
             return False
@@ -109,6 +214,32 @@ class QueueServer:
         while True:
             time.sleep(interval)
             self.remove_dead_projects()
+            self.check_running_tasks()
+            self.remove_dead_workers()
+
+    def check_running_tasks(self):
+        '''drop in progress tasks of deleted projects, and report tasks that run longer than their max_time'''
+        now = time.time()
+        for (task_id, start_time) in list(self.start_calc.items()):
+            task = self.out_tasks.get(task_id)
+            if (task is None):
+                continue
+            if (task.proj_id not in self.done_queues):
+                self.out_tasks.pop(task_id, None)
+                continue
+            if (task.max_time and ((now - start_time) > task.max_time)):
+                self.logger.error('Task %s has been running for %d! Time to resubmit', task, (now - start_time))
+
+    def remove_dead_workers(self):
+        '''forget the cached data keys and affinity queues of workers that are no longer alive'''
+        with self.task_available:
+            for worker_id in list(self.worker_keys.keys()):
+                if (not self.worker_is_alive(worker_id)):
+                    self.update_worker_keys(worker_id, keys_removed=list(self.worker_keys[worker_id]))
+                    del self.worker_keys[worker_id]
+            for worker_id in list(self.affinity_queues.keys()):
+                if (not self.worker_is_alive(worker_id)):
+                    del self.affinity_queues[worker_id]
 
     def remove_dead_projects(self):
         dead_projects = []
@@ -134,40 +265,187 @@ class QueueServer:
         return c
 
     def task_queue_size(self):
-        return self.todo_queue.qsize()
+        return self.todo_count
 
     def in_progress_task_number(self):
         return len(self.out_tasks)
 
     def put_tasks(self, tasks):
-        print(('\r' + self.queue_stats_string()), end=' ')
-        for task in tasks:
-            self.todo_queue.put((task.priority, task))
-            self.logger.debug('put_task %s', task)
+        with self.task_available:
+            tasks = self.submitted_tasks(tasks)
+            if ((self.journal is not None) and (len(tasks) > 0)):
+                self.journal.submit(tasks)
+            for task in tasks:
+                self.enqueue_task(task)
+                self.logger.debug('put_task %s', task)
+            self.task_available.notify(len(tasks))
 
     def put_task(self, task):
-        print(('\r' + self.queue_stats_string()), end=' ')
-        self.todo_queue.put((task.priority, task))
+        with self.task_available:
+            tasks = self.submitted_tasks([task])
+            if ((self.journal is not None) and (len(tasks) > 0)):
+                self.journal.submit(tasks)
+            for task in tasks:
+                self.enqueue_task(task)
+            self.task_available.notify()
         self.logger.debug('put_task %s', task)
 
+    def submitted_tasks(self, tasks):
+        '''
+        the tasks submitted by a project that need to run. a task whose result is waiting in the done queue of its
+        project is not run again, the project collects that result. a task that is done and whose result has been
+        collected is run again, e.g. a task that raised and is retried, or a task resubmitted by a restarted master
+        with the same proj_id, so it is no longer treated as done (see take_entry())
+        '''
+        if (not any(((_.task_id in self.done_tasks_time) for _ in tasks))):
+            return tasks
+        uncollected = set()
+        for proj_id in set((_.proj_id for _ in tasks)):
+            done_queue = self.done_queues.get(proj_id)
+            if (done_queue is None):
+                continue
+            with done_queue.mutex:
+                uncollected.update((_.task_id for _ in done_queue.queue))
+        re = []
+        for task in tasks:
+            if (task.task_id in uncollected):
+                continue
+            self.done_tasks_time.pop(task.task_id, None)
+            re.append(task)
+        return re
+
+    def enqueue_task(self, task):
+        if (task.task_id in self.queued):
+            # e.g. resent by a client after reconnecting
+            return
+        preferred = self.preferred_workers(task)
+        item = (task.priority, next(self.todo_seq), [task, False, preferred, time.time()])
+        self.queued[task.task_id] = item[2]
+        self.todo_queue.put(item)
+        self.todo_count += 1
+        for worker_id in preferred:
+            if (worker_id not in self.affinity_queues):
+                self.affinity_queues[worker_id] = queue.PriorityQueue()
+            self.affinity_queues[worker_id].put(item)
+
+    def preferred_workers(self, task):
+        '''live workers whose cache holds most of the data keys of the task'''
+        keys = getattr(task, 'data_keys', None)
+        if (not keys):
+            return []
+        counts = {}
+        for k in keys:
+            for worker_id in self.key_workers.get(k, ()):
+                counts[worker_id] = (counts.get(worker_id, 0) + 1)
+        ws = sorted((_ for _ in counts if self.worker_is_alive(_)), key=(lambda _: counts[_]), reverse=True)
+        return ws[:self.affinity_max_workers]
+
+    def worker_is_alive(self, worker_id):
+        return ((worker_id in self.worker_alive_time) and ((time.time() - self.worker_alive_time[worker_id]) <= self.worker_alive_time_max))
+
+    def update_worker_keys(self, worker_id, keys_added=None, keys_removed=None):
+        '''record changes of the data keys resident in the cache of a worker'''
+        ks = self.worker_keys.setdefault(worker_id, set())
+        for k in (keys_removed or ()):
+            ks.discard(k)
+            ws = self.key_workers.get(k)
+            if (ws is not None):
+                ws.discard(worker_id)
+                if (len(ws) == 0):
+                    del self.key_workers[k]
+        for k in (keys_added or ()):
+            ks.add(k)
+            self.key_workers.setdefault(k, set()).add(worker_id)
+
     def cancel_task(self, task):
         raise NotImplementedError
 
-    def get_task(self, worker_id=None, interval=5, timeout=10):
-        print(('\r' + self.queue_stats_string()), end=' ')
+    def get_task(self, worker_id=None, timeout=10, keys_added=None, keys_removed=None):
+        '''
+        long poll, wait up to timeout seconds until a task is available, and return it as soon as it is.
+        broadcast tasks for this worker come first. returns None if there was no task.
+        keys_added and keys_removed report changes of the data keys in the cache of the worker since its last call
+        '''
         self.worker_alive_time[worker_id] = time.time()
-        start_time = time.time()
-        while ((time.time() - start_time) < timeout):
-            try:
-                (priority, task) = self.todo_queue.get_nowait()
-                if (task.task_id in self.done_tasks_time):
-                    continue
-                self.start_calc[task.task_id] = time.time()
-                self.out_tasks[task.task_id] = task
+        deadline = (time.time() + timeout)
+        with self.task_available:
+            # registered under the lock, put_broadcast_task() iterates over the workers while holding it
+            if (worker_id not in self.broadcast_todo_queue):
+                self.broadcast_todo_queue[worker_id] = queue.PriorityQueue()
+            if (keys_added or keys_removed):
+                self.update_worker_keys(worker_id, keys_added=keys_added, keys_removed=keys_removed)
+            while True:
+                task = self.pop_broadcast_task(worker_id)
+                if (task is None):
+                    task = self.pop_task(worker_id)
+                    if ((task is not None) and (self.journal is not None)):
+                        self.journal.assign(task.task_id, worker_id)
+                if (task is not None):
+                    return task
+                remaining = (deadline - time.time())
+                if (remaining <= 0):
+                    return None
+                self.task_available.wait(remaining)
+
+    def pop_task(self, worker_id=None):
+        '''
+        tasks whose data is in the cache of the worker come first, then tasks that no other live worker prefers.
+        if only tasks preferred by other workers are left, the worker steals one of them
+        '''
+        aq = self.affinity_queues.get(worker_id)
+        while ((aq is not None) and (not aq.empty())):
+            task = self.take_entry(aq.get_nowait()[2])
+            if (task is not None):
+                self.locality_counts['affine'] += 1
                 return task
+        skipped = []
+        task = None
+        while ((task is None) and (len(skipped) < self.steal_scan)):
+            try:
+                item = self.todo_queue.get_nowait()
             except queue.Empty:
-                time.sleep(interval)
-        return None
+                break
+            entry = item[2]
+            if entry[1]:
+                continue
+            if any(((_ != worker_id) and self.worker_is_alive(_)) for _ in entry[2]):
+                skipped.append(item)
+                continue
+            task = self.take_entry(entry)
+            if (task is not None):
+                self.locality_counts['neutral'] += 1
+        while ((task is None) and (len(skipped) > 0)):
+            task = self.take_entry(skipped.pop(0)[2])
+            if (task is not None):
+                self.locality_counts['stolen'] += 1
+        for item in skipped:
+            self.todo_queue.put(item)
+        return task
+
+    def take_entry(self, entry):
+        '''mark a queue entry as taken, return its task unless the entry was taken before or the task is done'''
+        if entry[1]:
+            return None
+        entry[1] = True
+        self.todo_count -= 1
+        task = entry[0]
+        self.queued.pop(task.task_id, None)
+        self.replayed.pop(task.task_id, None)
+        if (task.task_id in self.done_tasks_time):
+            return None
+        task.todo_queue_total = (time.time() - entry[3])
+        self.start_calc[task.task_id] = time.time()
+        self.out_tasks[task.task_id] = task
+        return task
+
+    def pop_broadcast_task(self, worker_id):
+        try:
+            (priority, task) = self.broadcast_todo_queue[worker_id].get_nowait()
+        except queue.Empty:
+            return None
+        self.out_tasks[task.task_id] = task
+        self.start_calc[task.task_id] = time.time()
+        return task
 
     def done_tasks_contains(self, task_id):
         return (task_id in self.done_tasks_time)
@@ -180,81 +458,101 @@ class QueueServer:
                 task_ids_t.append(task_id)
         return task_ids_t
 
-    def put_result(self, worker_id, task_id, error, error_msg, result):
-        print(('\r' + self.queue_stats_string()), end=' ')
+    def put_result(self, worker_id, task_id, error, error_msg, result, timing=None):
+        '''timing holds the durations of the task phases measured by the worker, see queue_stats'''
         self.worker_alive_time[worker_id] = time.time()
         if (task_id in self.done_tasks_time):
             return True
-        self.done_tasks_time[task_id] = time.time()
-        if (not (task_id in self.out_tasks)):
+        task = self.out_tasks.pop(task_id, None)
+        if (task is None):
+            task = self.replayed.pop(task_id, None)
+        if (task is None):
+            # e.g. a late duplicate of a result that has been collected, and whose task has been submitted again
             return True
-        task = self.out_tasks[task_id]
-        del self.out_tasks[task_id]
+        self.done_tasks_time[task_id] = time.time()
         task.error = error
         task.error_msg = error_msg
         task.result = result
-        task.calc_total = (time.time() - self.start_calc[task.task_id])
-        del self.start_calc[task.task_id]
+        task.worker_id = worker_id
+        task.timing = (timing or {})
+        start_calc = self.start_calc.pop(task.task_id, None)
+        if (start_calc is not None):
+            task.calc_total = (time.time() - start_calc)
+        self.queue_stats.task_done(task, worker_id)
+        if (self.journal is not None):
+            self.journal.complete(task)
         if (task.proj_id not in self.done_queues):
             self.new_project(task.proj_id)
         self.done_queues[task.proj_id].put(task)
         self.logger.debug('put_result: %s', task)
         return True
 
-    def get_results(self, proj_id):
+    def get_results(self, proj_id, timeout=10):
+        '''
+        long poll, wait up to timeout seconds for the first result of the project, then return it together with all
+        other results that are already available
+        '''
         if (proj_id not in self.done_queues):
             self.new_project(proj_id)
         self.log_queue_stats()
-        print(('\r' + self.queue_stats_string()), end=' ')
+        done_queue = self.done_queues[proj_id]
         results = []
-        while True:
-            try:
-                task = self.done_queues[proj_id].get_nowait()
-                results.append(task)
-            except queue.Empty:
-                if (len(results) > 0):
-                    self.logger.debug('get_results: (%s)', len(results))
-                else:
-                    time.sleep(1)
-                break
+        try:
+            results.append(done_queue.get(timeout=timeout))
+            while True:
+                results.append(done_queue.get_nowait())
+        except queue.Empty:
+            pass
         now = time.time()
-        for (task_id, start_time) in list(self.start_calc.items()):
-            if (task_id in self.out_tasks):
-                task = self.out_tasks[task_id]
-                if (task.proj_id not in self.done_queues):
-                    del self.out_tasks[task_id]
-                    continue
-                if ((task.max_time > 0) and ((now - start_time) > task.max_time)):
-                    self.logger.error('Task %s has been running for %d! Time to resubmit', task, (now - start_time))
+        for task in results:
+            task.done_queue_total = (now - self.done_tasks_time.get(task.task_id, now))
+            self.queue_stats.task_collected(task)
+        if (len(results) > 0):
+            self.logger.debug('get_results: (%s)', len(results))
+            if (self.journal is not None):
+                self.journal.collected([_.task_id for _ in results])
         return results
 
+    def project_task_states(self, proj_id):
+        '''{task_id: 'todo' / 'out' / 'done'} of the tasks of a project known to the server, see QueueMaster.run()'''
+        states = {}
+        with self.task_available:
+            for (task_id, entry) in list(self.queued.items()):
+                if (entry[0].proj_id == proj_id):
+                    states[task_id] = 'todo'
+            for (task_id, task) in list(self.out_tasks.items()):
+                if (task.proj_id == proj_id):
+                    states[task_id] = 'out'
+        done_queue = self.done_queues.get(proj_id)
+        if (done_queue is not None):
+            with done_queue.mutex:
+                for task in done_queue.queue:
+                    states[task.task_id] = 'done'
+        return states
+
     def put_broadcast_task(self, task):
-        print(('\r' + self.queue_stats_string()), end=' ')
         task_worker_id = {}
-        for worker_id in self.broadcast_todo_queue:
-            if ((time.time() - self.worker_alive_time[worker_id]) > self.worker_alive_time_max):
-                continue
-            t = copy.deepcopy(task)
-            t.task_id_original = t.task_id
-            t.task_id = str(uuid.uuid4())
-            self.broadcast_todo_queue[worker_id].put((t.priority, t))
-            self.logger.debug('put_task %s', t)
-            task_worker_id[t.task_id] = worker_id
+        with self.task_available:
+            for worker_id in self.broadcast_todo_queue:
+                if ((time.time() - self.worker_alive_time[worker_id]) > self.worker_alive_time_max):
+                    continue
+                t = copy.deepcopy(task)
+                t.task_id_original = t.task_id
+                t.task_id = str(uuid.uuid4())
+                self.broadcast_todo_queue[worker_id].put((t.priority, t))
+                self.logger.debug('put_task %s', t)
+                task_worker_id[t.task_id] = worker_id
+            # the task is meant for particular workers, wake up all of them
+            self.task_available.notify_all()
         return task_worker_id
 
     def get_broadcast_task(self, worker_id):
         self.worker_alive_time[worker_id] = time.time()
-        if (worker_id not in self.broadcast_todo_queue):
-            self.broadcast_todo_queue[worker_id] = queue.PriorityQueue()
-            return None
-        try:
-            (priority, task) = self.broadcast_todo_queue[worker_id].get_nowait()
-            self.out_tasks[task.task_id] = task
-            self.start_calc[task.task_id] = time.time()
-            return task
-        except queue.Empty:
-            pass
-        return None
+        with self.task_available:
+            if (worker_id not in self.broadcast_todo_queue):
+                self.broadcast_todo_queue[worker_id] = queue.PriorityQueue()
+                return None
+            return self.pop_broadcast_task(worker_id)
 
     def log(self, record):
         self.pub_logger.handle(record)
\ No newline at end of file
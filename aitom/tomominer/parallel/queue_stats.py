@@ -0,0 +1,144 @@
+'''
+Timing statistics of the tasks that go through a QueueServer.
+
+The phases of a task are
+    todo_queue      from submission to assignment to a worker                 (Task.todo_queue_total, server clock)
+    calc            from assignment to the arrival of the result               (Task.calc_total, server clock)
+    done_queue      from the arrival of the result to its collection          (Task.done_queue_total, server clock)
+calc is broken down with the durations measured by the worker (Task.timing, worker clock)
+    fetch           loading the data keys of the task into the cache, when the worker prefetches
+    ready_wait      waiting in the prefetch queue of the worker for a free slot
+    compute         running the task function
+    upload_wait     waiting for the upload thread of the worker
+    transfer        the rest of calc, i.e. sending the task and the result over the network
+Per method summaries (mean and max of every phase) help to choose n_chunk: a chunk should be large enough that
+compute dominates todo_queue and transfer. Tasks that are computing for much longer than the mean of their method
+are reported as stragglers.
+'''
+
+import os
+import csv
+import json
+import time
+import threading
+import collections
+
+PHASES = ['todo_queue', 'calc', 'fetch', 'ready_wait', 'compute', 'upload_wait', 'transfer', 'done_queue']
+
+
+class QueueStats:
+
+    def __init__(self, worker_window=100, history_max=1000, records_max=100000):
+        # completion times of the last worker_window tasks of each worker, for the throughput
+        self.worker_window = worker_window
+        self.workers = {}
+        self.methods = {}
+        # per task records since the last dump, and queue depth snapshots over time
+        self.records = collections.deque(maxlen=records_max)
+        self.history = collections.deque(maxlen=history_max)
+        # updated by the RPC handler threads of the server, read by its stats thread
+        self.lock = threading.Lock()
+
+    def task_done(self, task, worker_id):
+        '''a result has arrived, account it to its worker'''
+        with self.lock:
+            w = self.workers.get(worker_id)
+            if (w is None):
+                w = {'tasks': 0, 'errors': 0, 'compute_total': 0.0, 'times': collections.deque(maxlen=self.worker_window), }
+                self.workers[worker_id] = w
+            w['tasks'] += 1
+            if task.error:
+                w['errors'] += 1
+            w['compute_total'] += (getattr(task, 'timing', None) or {}).get('compute', 0.0)
+            w['times'].append(time.time())
+
+    def task_collected(self, task):
+        '''a result has been collected by its project, all phases of the task are known'''
+        r = task_record(task)
+        with self.lock:
+            self.records.append(r)
+            m = self.methods.get(r['method'])
+            if (m is None):
+                m = {'count': 0, 'errors': 0, 'n': {}, 'sum': {}, 'max': {}, }
+                self.methods[r['method']] = m
+            m['count'] += 1
+            if r['error']:
+                m['errors'] += 1
+            for p in PHASES:
+                if (r[p] is None):
+                    continue
+                m['n'][p] = (m['n'].get(p, 0) + 1)
+                m['sum'][p] = (m['sum'].get(p, 0.0) + r[p])
+                m['max'][p] = max(m['max'].get(p, 0.0), r[p])
+
+    def method_summary(self):
+        re = {}
+        with self.lock:
+            for (method, m) in self.methods.items():
+                re[method] = {'count': m['count'], 'errors': m['errors'], 'mean': {p: (m['sum'][p] / m['n'][p]) for p in m['sum']}, 'max': dict(m['max']), }
+        return re
+
+    def worker_summary(self):
+        now = time.time()
+        re = {}
+        with self.lock:
+            for (worker_id, w) in self.workers.items():
+                ts = w['times']
+                # tasks per second over the window of the last completions, up to now
+                span = ((now - ts[0]) if (len(ts) > 0) else 0.0)
+                re[str(worker_id)] = {'tasks': w['tasks'], 'errors': w['errors'], 'compute_total': w['compute_total'], 'throughput': ((len(ts) / span) if (span > 0) else None), 'last_result': (ts[(-1)] if (len(ts) > 0) else None), }
+        return re
+
+    def stragglers(self, running, factor=3.0):
+        '''in progress tasks, given as (task, start time), that run factor times longer than the mean calc of their method'''
+        now = time.time()
+        with self.lock:
+            means = {method: (m['sum']['calc'] / m['n']['calc']) for (method, m) in self.methods.items() if ('calc' in m['sum'])}
+        re = []
+        for (task, start) in running:
+            mean = means.get(method_name(task))
+            if (mean is None):
+                continue
+            if ((now - start) > (factor * mean)):
+                re.append({'task_id': task.task_id, 'proj_id': task.proj_id, 'method': method_name(task), 'running': (now - start), 'mean_calc': mean, })
+        return re
+
+    def snapshot(self, projects):
+        '''record the queue depths of each project, given as {proj_id: {'todo', 'in_progress', 'done'}}'''
+        with self.lock:
+            self.history.append({'time': time.time(), 'projects': projects, })
+
+    def dump(self, dump_dir, summary):
+        '''append the task records since the last dump to tasks.csv, and the summary to stats.jsonl'''
+        if (not os.path.isdir(dump_dir)):
+            os.makedirs(dump_dir)
+        with self.lock:
+            records = list(self.records)
+            self.records.clear()
+        if (len(records) > 0):
+            path = os.path.join(dump_dir, 'tasks.csv')
+            header = (not os.path.isfile(path))
+            with open(path, 'a', newline='') as f:
+                w = csv.DictWriter(f, fieldnames=list(records[0].keys()))
+                if header:
+                    w.writeheader()
+                w.writerows(records)
+        with open(os.path.join(dump_dir, 'stats.jsonl'), 'a') as f:
+            f.write((json.dumps(summary, default=str) + '\n'))
+
+
+def method_name(task):
+    return ('%s.%s' % (task.module, task.method))
+
+
+def task_record(task):
+    timing = (getattr(task, 'timing', None) or {})
+    r = {'time': time.time(), 'task_id': task.task_id, 'proj_id': task.proj_id, 'method': method_name(task), 'error': bool(task.error), 'worker_id': getattr(task, 'worker_id', None), 'todo_queue': task.todo_queue_total, 'calc': task.calc_total, }
+    for p in ['fetch', 'ready_wait', 'compute', 'upload_wait']:
+        r[p] = timing.get(p)
+    if (task.calc_total is not None):
+        r['transfer'] = max((task.calc_total - sum((timing.get(_, 0.0) for _ in ['fetch', 'ready_wait', 'compute', 'upload_wait']))), 0.0)
+    else:
+        r['transfer'] = None
+    r['done_queue'] = task.done_queue_total
+    return r
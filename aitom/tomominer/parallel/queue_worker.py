@@ -14,6 +14,8 @@ import sys
 import time
 import warnings
 import uuid
+import queue
+import threading
 from multiprocessing.pool import Pool
 import importlib
 from aitom.tomominer.parallel.RPCClient import RPCClient
@@ -24,8 +26,10 @@ from aitom.tomominer.io.cache import Cache
 
 class QueueWorker:
 
-    def __init__(self, host=None, port=None, instance=None, pool=None, tmp_dir=None):
+    def __init__(self, host=None, port=None, instance=None, pool=None, tmp_dir=None, cache_dir=None, cache_mem_max_bytes=None, cache_disk_max_bytes=None):
         self.worker_id = str(uuid.uuid4())
+        self.host = host
+        self.port = port
         self.work_queue = RPCClient(host, port)
         self.handler = RPCLoggingHandler(self.work_queue)
         self.logger = logging.getLogger()
@@ -35,52 +39,175 @@ class QueueWorker:
         if (tmp_dir is None):
             tmp_dir = os.getenv('TOMOMINER_TMP_DIR')
         assert (tmp_dir is not None)
-        self.cache = Cache(tmp_dir=tmp_dir, logger=self.logger)
+        # node-local cache of templates, masks and subtomograms, configured through the environment when not given
+        if (cache_dir is None):
+            cache_dir = os.getenv('TOMOMINER_CACHE_DIR')
+        if (cache_mem_max_bytes is None):
+            cache_mem_max_bytes = int(os.getenv('TOMOMINER_CACHE_MEM_MAX_BYTES', 0))
+        if ((cache_disk_max_bytes is None) and (os.getenv('TOMOMINER_CACHE_DISK_MAX_BYTES') is not None)):
+            cache_disk_max_bytes = int(os.getenv('TOMOMINER_CACHE_DISK_MAX_BYTES'))
+        self.cache = Cache(cache_dir=cache_dir, tmp_dir=tmp_dir, logger=self.logger, mem_max_bytes=cache_mem_max_bytes, disk_max_bytes=cache_disk_max_bytes)
         self.cache_none = Cache(logger=self.logger)
         self.pool = pool
+        # data keys of self.cache already reported to the server
+        self.reported_keys = set()
+        self.reported_keys_lock = threading.Lock()
+        # imported task functions, by (module, method)
+        self.funcs = {}
 
-    def run(self, interval=5):
+    def run(self, timeout=10, slots=None, prefetch=None):
+        '''
+        slots is the number of tasks executed at the same time, prefetch the number of tasks fetched ahead of execution.
+        both default to the TOMOMINER_WORKER_SLOTS and TOMOMINER_WORKER_PREFETCH environment variables, or to 1 and 0,
+        which executes one task after another
+        '''
+        if (slots is None):
+            slots = int(os.getenv('TOMOMINER_WORKER_SLOTS', 1))
+        if (prefetch is None):
+            prefetch = int(os.getenv('TOMOMINER_WORKER_PREFETCH', 0))
+        if ((slots > 1) or (prefetch > 0)):
+            return self.run_pipelined(timeout=timeout, slots=slots, prefetch=prefetch)
         while True:
-            task = self.work_queue.get_broadcast_task(worker_id=self.worker_id)
+            # get_task() blocks on the server until a task (broadcast tasks included) is assigned to this worker
+            (keys_added, keys_removed) = self.cache_key_changes()
+            task = self.work_queue.get_task(worker_id=self.worker_id, timeout=timeout, keys_added=keys_added, keys_removed=keys_removed)
             if (not task):
-                task = self.work_queue.get_task(worker_id=self.worker_id)
-            if (not task):
-                time.sleep(interval)
                 continue
             self.task = task
+            start = time.time()
             (err, err_msg, result) = self._dispatch()
+            task.timing = {'compute': (time.time() - start), }
+            if err:
+                self.logger.warning('task failed: %s, %s', repr(task), err_msg)
+                continue
+            self.upload_result(self.work_queue, task, result)
+
+    def run_pipelined(self, timeout=10, slots=2, prefetch=2):
+        '''
+        fetching, execution and result upload overlap: a fetch thread takes tasks from the server and loads their
+        data keys into the cache while up to prefetch of them wait in a bounded queue, slots threads execute them, and
+        an upload thread sends the results. fetch and upload use their own connections, so that a long poll for the
+        next task does not hold up uploads
+        '''
+        ready = queue.Queue(maxsize=max(prefetch, 1))
+        done = queue.Queue()
+        ts = [threading.Thread(target=self.fetch_loop, args=(ready, timeout), name='queue_worker_fetch'), threading.Thread(target=self.upload_loop, args=(done,), name='queue_worker_upload')]
+        for i in range((slots - 1)):
+            ts.append(threading.Thread(target=self.slot_loop, args=(ready, done), name=('queue_worker_slot_%d' % (i + 1))))
+        for t in ts:
+            t.daemon = True
+            t.start()
+        self.slot_loop(ready, done)
+
+    def fetch_loop(self, ready, timeout):
+        work_queue = RPCClient(self.host, self.port)
+        while True:
+            (keys_added, keys_removed) = self.cache_key_changes()
+            task = work_queue.get_task(worker_id=self.worker_id, timeout=timeout, keys_added=keys_added, keys_removed=keys_removed)
+            if (not task):
+                continue
+            start = time.time()
+            self.prefetch(task)
+            task.timing = {'fetch': (time.time() - start), }
+            # blocks while the prefetch queue is full
+            ready.put((task, time.time()))
+
+    def prefetch(self, task):
+        '''import the function of a task and load its data keys into the cache, errors are left to the execution'''
+        try:
+            self.get_func(task.module, task.method)
+        except Exception:
+            pass
+        if ((self.cache.mem_max_bytes <= 0) and (self.cache.cache_dir is None)):
+            return
+        for k in (getattr(task, 'data_keys', None) or ()):
+            try:
+                self.cache.get_mrc(k)
+            except Exception:
+                pass
+
+    def slot_loop(self, ready, done):
+        slot = QueueWorkerSlot(self)
+        while True:
+            (task, ready_time) = ready.get()
+            start = time.time()
+            task.timing['ready_wait'] = (start - ready_time)
+            slot.task = task
+            (err, err_msg, result) = self._dispatch(slot)
+            task.timing['compute'] = (time.time() - start)
             if err:
                 self.logger.warning('task failed: %s, %s', repr(task), err_msg)
                 continue
-            while True:
-                if self.work_queue.done_tasks_contains(task.task_id):
-                    break
-                if self.work_queue.put_result(worker_id=self.worker_id, task_id=task.task_id, error=err, error_msg=err_msg, result=result):
-                    break
-                time.sleep(10)
-
-    def _dispatch(self):
-        if self.task.method.startswith('_'):
+            done.put((task, result, time.time()))
+
+    def upload_loop(self, done):
+        work_queue = RPCClient(self.host, self.port)
+        while True:
+            (task, result, done_time) = done.get()
+            task.timing['upload_wait'] = (time.time() - done_time)
+            self.upload_result(work_queue, task, result)
+
+    def upload_result(self, work_queue, task, result):
+        while True:
+            if work_queue.done_tasks_contains(task.task_id):
+                break
+            if work_queue.put_result(worker_id=self.worker_id, task_id=task.task_id, error=False, error_msg=None, result=result, timing=getattr(task, 'timing', None)):
+                break
+            time.sleep(10)
+
+    def cache_key_changes(self):
+        '''changes of the data keys resident in the cache since the last report'''
+        with self.reported_keys_lock:
+            ks = self.cache.resident_keys()
+            keys_added = list((ks - self.reported_keys))
+            keys_removed = list((self.reported_keys - ks))
+            self.reported_keys = ks
+        return (keys_added, keys_removed)
+
+    def get_func(self, module, method):
+        '''the function of a task, modules and functions are looked up only once'''
+        k = (module, method)
+        if (k not in self.funcs):
+            modu = importlib.import_module(module)
+            self.funcs[k] = getattr(modu, method)
+        return self.funcs[k]
+
+    def _dispatch(self, slot=None):
+        '''run the current task of slot, which is the worker itself when tasks are executed one after another'''
+        if (slot is None):
+            slot = self
+        task = slot.task
+        if task.method.startswith('_'):
             return (True, "method starts with '_'", None)
         else:
-            assert (self.task.module is not None)
+            assert (task.module is not None)
             try:
-                modu = importlib.import_module(self.task.module)
+                func = self.get_func(task.module, task.method)
+            except AttributeError:
+                return (True, ('method not found: %s ' % task.method), None)
             except Exception:
                 (ex_type, ex, tb) = sys.exc_info()
-                return (True, ('loading module error: %s  in sys path  %s     ;    exception  %s' % (self.task.module, repr(sys.path), repr(traceback.format_tb(tb)))), None)
-            try:
-                func = getattr(modu, self.task.method)
-            except:
-                return (True, ('method not found: %s ' % self.task.method), None)
+                return (True, ('loading module error: %s  in sys path  %s     ;    exception  %s' % (task.module, repr(sys.path), repr(traceback.format_tb(tb)))), None)
             if (not callable(func)):
                 return (True, 'method not callable', None)
             try:
-                assert ('self' not in self.task.kwargs)
-                self.task.kwargs['self'] = self
-                result = func(*self.task.args, **self.task.kwargs)
+                assert ('self' not in task.kwargs)
+                task.kwargs['self'] = slot
+                result = func(*task.args, **task.kwargs)
                 return (False, None, result)
             except Exception as ex:
                 return (True, traceback.format_exc(), None)
-                sys.stderr.write(traceback.format_exc())
-                self.logger.error('Exception: %s', traceback.format_exc())
\ No newline at end of file
+
+
+class QueueWorkerSlot:
+    '''
+    the worker as seen by a task running in one execution slot: it has its own current task, everything else
+    (cache, work_queue, logger, ...) is shared with the worker
+    '''
+
+    def __init__(self, worker):
+        self.worker = worker
+        self.task = None
+
+    def __getattr__(self, name):
+        return getattr(self.worker, name)
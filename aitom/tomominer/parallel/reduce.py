@@ -0,0 +1,101 @@
+'''
+Reduction of task results on the workers.
+
+A task whose result is an accumulator (a dict of arrays that are summed over subtomograms, like the 'sum' and
+'prod_sum' of ssnr.var__local()) is run through run__reduce() instead of run(). Every task then saves its partial
+result with Cache.save_tmp_data() and only returns the file name. The partials are merged on the workers, fan_in at a
+time, by reduce__merge() tasks, level by level until one is left, which is the only result loaded by the master.
+
+How a field is merged is given by ops, which maps a top level key of the result to one of
+    'add'       the values are added, dicts are merged key by key (the default)
+    'keep'      the value of the first partial is kept, for fields that are the same in every partial
+Only accumulators, whose size does not grow with the number of merged partials, are worth reducing this way. Results
+that are concatenated, e.g. the rows of a data matrix, should come back inline with run__except(), every merge level
+would otherwise copy the whole growing result through tmp_dir.
+
+usage:
+    re = self.runner.run__reduce(tasks, ops={'shift': 'keep'})
+'''
+
+import os
+import pickle
+
+
+def merge(a, b, op='add'):
+    '''merge the partial b into a, in place where possible, and return the result'''
+    if (a is None):
+        return b
+    if (b is None):
+        return a
+    if (op == 'keep'):
+        return a
+    assert (op == 'add'), op
+    if isinstance(a, dict):
+        for k in b:
+            a[k] = merge(a.get(k), b[k], op='add')
+        return a
+    a += b
+    return a
+
+
+def merge_result(a, b, ops=None):
+    if (ops is None):
+        ops = {}
+    if (a is None):
+        return b
+    if (b is None):
+        return a
+    for k in b:
+        a[k] = merge(a.get(k), b[k], op=ops.get(k, 'add'))
+    return a
+
+
+def load(key):
+    with open(key, 'rb') as f:
+        return pickle.load(f)
+
+
+def reduce__leaf(self, module, method, args=[], kwargs={}):
+    '''run a task function and save its result as a partial, the result is the file name of the partial'''
+    func = self.get_func(module, method)
+    re = func(*args, self=self, **kwargs)
+    return self.cache.save_tmp_data(re)
+
+
+def reduce__merge(self, keys, ops=None):
+    '''merge the partials saved under keys, save the merged partial, the result is its file name'''
+    re = None
+    for k in keys:
+        if (self.work_queue is not None) and self.work_queue.done_tasks_contains(self.task.task_id):
+            raise Exception('Duplicated task')
+        re = merge_result(re, load(k), ops=ops)
+    return self.cache.save_tmp_data(re)
+
+
+def run__reduce(runner, tasks, ops=None, fan_in=8):
+    '''
+    run tasks, whose results are partial accumulators, and return the merge of all their results.
+    the partials are merged by reduce__merge() tasks on the workers, the intermediate files are removed at the end.
+    returns None if there are no tasks
+    '''
+    assert (fan_in >= 2)
+    leafs = []
+    for t in tasks:
+        leafs.append(runner.task(priority=t.priority, module='aitom.tomominer.parallel.reduce', method='reduce__leaf', kwargs={'module': t.module, 'method': t.method, 'args': t.args, 'kwargs': t.kwargs, }, data_keys=t.data_keys))
+    if (len(leafs) == 0):
+        return None
+    keys = [res.result for res in runner.run__except(leafs)]
+    created = list(keys)
+    try:
+        while (len(keys) > 1):
+            # the partials of one merge task are read by one worker, the master only sees the file names
+            merges = [runner.task(module='aitom.tomominer.parallel.reduce', method='reduce__merge', kwargs={'keys': keys[i:(i + fan_in)], 'ops': ops, }) for i in range(0, len(keys), fan_in)]
+            keys = [res.result for res in runner.run__except(merges)]
+            created.extend(keys)
+        return load(keys[0])
+    finally:
+        for k in created:
+            try:
+                os.remove(k)
+            except OSError:
+                pass
@@ -451,15 +451,25 @@ def pursuit(self, op, data_json):
             start_time = time.time()
             if not os.path.isdir(align_template__tmp_dir):
                 os.makedirs(align_template__tmp_dir)
+            prefilter_required = None
+            if 'prefilter' in op['align']:
+                # the specificity test below needs the scores of cluster members against the templates it compares
+                prefilter_required = CU.align_to_templates__prefilter_required(
+                    tk=cas_re['selected_templates'], tk_info=cas_re['tk_info'],
+                    sample_num=op['align']['prefilter'].get('specificity_sample_num', 50))
             at_ress = CU.align_to_templates__batch(self=self, op=op, data_json=data_json,
                                                    segmentation_tg_op=segmentation_tg_op,
                                                    tmp_dir=align_template__tmp_dir,
-                                                   tem_keys=cas_re['selected_templates_common_frame'])
+                                                   tem_keys=cas_re['selected_templates_common_frame'],
+                                                   prefilter_required=prefilter_required)
             with open(align_template_file, 'wb') as f:
                 pickle.dump(at_ress, f, protocol=(-1))
             shutil.rmtree(align_template__tmp_dir)
             print(('Align all volumes to cluster_templates. %2.6f sec' % (time.time() - start_time)))
         at_ress = [_.result for _ in at_ress]
+        if 'prefilter' in op['align']:
+            file_stat['passes'][pass_i]['align_template_prefilter_recall'] = CU.align_to_templates__prefilter_recall(
+                at_ress)
         sys.stdout.flush()
         cratcms = CU.cluster_removal_according_to_center_matching_specificity(ci=cluster_info, cis=cluster_info_stat,
                                                                               al=at_ress,
@@ -16,7 +16,12 @@ def main():
     self = CO.Object()
     self.pool = None
     self.cache = Cache(tmp_dir=op['options']['tmp_dir'])
-    self.runner = QueueMaster(op['options']['network']['qhost'], op['options']['network']['qport'])
+    if 'network' in op['options']:
+        self.runner = QueueMaster(op['options']['network']['qhost'], op['options']['network']['qport'])
+    else:
+        # no queue server configured, run the tasks on a local process pool
+        from aitom.tomominer.parallel.local_runner import LocalRunner
+        self.runner = LocalRunner(worker_num=op['options'].get('worker_num'), tmp_dir=op['options']['tmp_dir'])
     print('loading ', op['data_file'])
     with open(op['data_file']) as f:
         data_json = json.load(f)
@@ -18,7 +18,9 @@ from multiprocessing.pool import Pool as Pool
 import numpy as N
 import numpy.fft as NF
 from aitom.tomominer.io.cache import Cache
+from aitom.tomominer.parallel.Task import data_json_keys
 from aitom.tomominer.common.obj import Object
+from aitom.tomominer.average.accumulator import VolumeAccumulator
 import aitom.tomominer.dimension_reduction.util as DU
 import aitom.image.vol.util as UV
 import aitom.tomominer.io.file as IV
@@ -27,6 +29,7 @@ import aitom.geometry.rotate as GR
 import aitom.tomominer.align.fast.full as AFF
 import aitom.tomominer.align.refine.gradient_refine as AFGF
 import aitom.align.fast.util as AU
+import aitom.align.fast.prefilter as AFP
 import aitom.tomominer.statistics.ssnr as SS
 import aitom.tomominer.segmentation.watershed as SW
 import aitom.tomominer.segmentation.active_contour.chan_vese.segment as SACS
@@ -50,7 +53,7 @@ def align_vols_with_wedge(v1, m1, v2, m2, op=None, logger=None):
             err = traceback.format_exc()
     else:
         try:
-            re = AU.align_vols(v1=v1, m1=m1, v2=v2, m2=m2, L=op['L'])
+            re = AU.align_vols(v1=v1, m1=m1, v2=v2, m2=m2, L=op['L'], multires=op.get('multires'))
             ang = re['angle']
             loc = re['loc']
             score = re['score']
@@ -180,25 +183,16 @@ def neighbor_covariance_avg__parallel(self, data_json, segmentation_tg_op, norma
         inds_t = inds[:n_chunk]
         tasks.append(self.runner.task(module='tomominer.pursuit.multi.util', method='neighbor_covariance__collect_info',
                                       kwargs={'data_json': data_json_copy_part,
-                                              'segmentation_tg_op': segmentation_tg_op, 'normalize': normalize, }))
+                                              'segmentation_tg_op': segmentation_tg_op, 'normalize': normalize, },
+                                      data_keys=data_json_keys(data_json_copy_part)))
         data_json_copy = data_json_copy[n_chunk:]
         inds = inds[n_chunk:]
-    sum_global = None
-    neighbor_prod_sum = None
-    for res in self.runner.run__except(tasks):
-        with open(res.result) as f:
-            re = pickle.load(f)
-        os.remove(res.result)
-        if sum_global is None:
-            sum_global = re['sum']
-        else:
-            sum_global += re['sum']
-        assert N.all(N.isfinite(sum_global))
-        if neighbor_prod_sum is None:
-            neighbor_prod_sum = re['neighbor_prod_sum']
-        else:
-            neighbor_prod_sum += re['neighbor_prod_sum']
-        assert N.all(N.isfinite(neighbor_prod_sum))
+    # the partial sums are added up on the workers, the neighbor shifts are the same for every partial
+    re = self.runner.run__reduce(tasks, ops={'shift': 'keep'})
+    sum_global = re['sum']
+    assert N.all(N.isfinite(sum_global))
+    neighbor_prod_sum = re['neighbor_prod_sum']
+    assert N.all(N.isfinite(neighbor_prod_sum))
     avg_global = (sum_global / len(data_json))
     neighbor_prod_avg = (neighbor_prod_sum / len(data_json))
     shift = re['shift']
@@ -212,7 +206,7 @@ def neighbor_covariance_avg__parallel(self, data_json, segmentation_tg_op, norma
     return cov_avg
 
 
-def neighbor_covariance__collect_info(self, data_json, segmentation_tg_op, normalize):
+def neighbor_covariance__collect_info(self, data_json, segmentation_tg_op, normalize, return_key=False):
     sum_local = None
     neighbor_prod_sum = None
     for rec in data_json:
@@ -252,6 +246,8 @@ def neighbor_covariance__collect_info(self, data_json, segmentation_tg_op, norma
         else:
             neighbor_prod_sum += nei_prod['p']
     re = {'sum': sum_local, 'neighbor_prod_sum': neighbor_prod_sum, 'shift': nei_prod['shift'], }
+    if not return_key:
+        return re
     re_key = self.cache.save_tmp_data(re, fn_id=self.task.task_id)
     assert (re_key is not None)
     return re_key
@@ -268,14 +264,15 @@ def data_matrix_collect__parallel(self, data_json, segmentation_tg_op, normalize
         tasks.append(self.runner.task(module='tomominer.pursuit.multi.util', method='data_matrix_collect__local',
                                       kwargs={'data_json': data_json_copy_t, 'segmentation_tg_op': segmentation_tg_op,
                                               'normalize': normalize, 'inds': inds_t,
-                                              'voxel_mask_inds': voxel_mask_inds, }))
+                                              'voxel_mask_inds': voxel_mask_inds, },
+                                      data_keys=data_json_keys(data_json_copy_t)))
         data_json_copy = data_json_copy[n_chunk:]
         inds = inds[n_chunk:]
     red = None
     for res in self.runner.run__except(tasks):
-        with open(res.result) as f:
-            re = pickle.load(f)
-        os.remove(res.result)
+        # the rows are not an accumulator, merging them on the workers (run__reduce()) would only copy them around,
+        # so they come back inline with the task
+        re = res.result
         if red is None:
             red = N.zeros([len(data_json), re['mat'].shape[1]])
         red[re['inds'], :] = re['mat']
@@ -283,7 +280,8 @@ def data_matrix_collect__parallel(self, data_json, segmentation_tg_op, normalize
     return red
 
 
-def data_matrix_collect__local(self, data_json, inds, segmentation_tg_op, normalize, voxel_mask_inds=None):
+def data_matrix_collect__local(self, data_json, inds, segmentation_tg_op, normalize, voxel_mask_inds=None,
+                               return_key=False):
     mat = None
     for (i, rec) in enumerate(data_json):
         if 'template' not in rec:
@@ -317,6 +315,8 @@ def data_matrix_collect__local(self, data_json, inds, segmentation_tg_op, normal
             mat = N.zeros([len(data_json), vi.size])
         mat[i, :] = vi
     re = {'mat': mat, 'inds': inds, }
+    if not return_key:
+        return re
     re_key = self.cache.save_tmp_data(re, fn_id=self.task.task_id)
     assert (re_key is not None)
     return re_key
@@ -411,8 +411,7 @@ def cluster_ssnr_fsc(self, clusters, n_chunk, op=None):
 
 
 def vol_avg__local(self, data_json, op=None, return_key=True):
-    vol_sum = None
-    mask_sum = None
+    a = VolumeAccumulator()
     for rec in data_json:
         if self.work_queue.done_tasks_contains(self.task.task_id):
             raise Exception('Duplicated task')
@@ -427,13 +426,9 @@ def vol_avg__local(self, data_json, op=None, return_key=True):
             in_re = impute_vol_keys(vk=rec, ang=rec['angle'], loc=rec['loc'], tk=rec['template'],
                                     align_to_template=True, normalize=True, cache=self.cache)
             vt = in_re['vi']
-        if vol_sum is None:
-            vol_sum = N.zeros(vt.shape, dtype=N.float64, order='F')
-        vol_sum += vt
-        if mask_sum is None:
-            mask_sum = N.zeros(in_re['vm_r'].shape, dtype=N.float64, order='F')
-        mask_sum += in_re['vm_r']
-    re = {'vol_sum': vol_sum, 'mask_sum': mask_sum, 'vol_count': len(data_json), 'op': op, }
+        a.add_rotated(vt, in_re['vm_r'])
+    re = a.to_dict()
+    re['op'] = op
     if return_key:
         re_key = self.cache.save_tmp_data(re, fn_id=self.task.task_id)
         assert (re_key is not None)
@@ -462,44 +457,29 @@ def cluster_averaging_vols(self, clusters, op={}):
             op_t = copy.deepcopy(op)
             op_t['cluster'] = c
             tasks.append(self.runner.task(module='tomominer.pursuit.multi.util', method='vol_avg__local',
-                                          kwargs={'data_json': part, 'op': op_t, 'return_key': True, }))
+                                          kwargs={'data_json': part, 'op': op_t, 'return_key': False, },
+                                          data_keys=data_json_keys(part)))
             clusters[c] = clusters[c][op['n_chunk']:]
-    cluster_sums = {}
-    cluster_mask_sums = {}
-    cluster_sizes = {}
+    cluster_accs = {}
     for res in self.runner.run__except(tasks):
-        with open(res.result['key']) as f:
-            re = pickle.load(f)
-        os.remove(res.result['key'])
+        re = res.result
         oc = re['op']['cluster']
-        ms = re['mask_sum']
-        s = re['vol_sum']
-        vc = re['vol_count']
-        if oc not in cluster_sums:
-            cluster_sums[oc] = s
+        if oc not in cluster_accs:
+            cluster_accs[oc] = VolumeAccumulator.from_dict(re)
         else:
-            cluster_sums[oc] += s
-        if oc not in cluster_mask_sums:
-            cluster_mask_sums[oc] = ms
-        else:
-            cluster_mask_sums[oc] += ms
-        if oc not in cluster_sizes:
-            cluster_sizes[oc] = vc
-        else:
-            cluster_sizes[oc] += vc
-        del oc, ms, s, vc
+            cluster_accs[oc].merge(VolumeAccumulator.from_dict(re))
+        del oc
+    cluster_sums = {c: cluster_accs[c].vol_sum for c in cluster_accs}
+    cluster_mask_sums = {c: cluster_accs[c].mask_sum for c in cluster_accs}
+    cluster_sizes = {c: cluster_accs[c].count for c in cluster_accs}
     cluster_avg_dict = {}
-    for c in cluster_sums:
+    for c in cluster_accs:
         assert (cluster_sizes[c] > 0)
         assert (cluster_mask_sums[c].max() > 0)
         if op['use_fft']:
-            ind = (cluster_mask_sums[c] >= op['mask_count_threshold'])
-            if ind.sum() == 0:
+            cluster_avg = cluster_accs[c].average_vol(mask_count_threshold=op['mask_count_threshold'])
+            if cluster_avg is None:
                 continue
-            cluster_sums_fft = NF.fftshift(NF.fftn(cluster_sums[c]))
-            cluster_avg = N.zeros(cluster_sums_fft.shape, dtype=N.complex)
-            cluster_avg[ind] = (cluster_sums_fft[ind] / cluster_mask_sums[c][ind])
-            cluster_avg = N.real(NF.ifftn(NF.ifftshift(cluster_avg)))
         else:
             cluster_avg = (cluster_sums[c] / cluster_sizes[c])
         if op['mask_binarize']:
@@ -642,6 +622,7 @@ def cluster_removal_according_to_center_matching_specificity(ci, cis, al, tk, si
             tk_fsc[tk0] = ci0['fsc'].sum()
     non_specific_clusters = []
     wilcoxion_stat = defaultdict(dict)
+    skipped_pairs = 0
     for pass_i in ci:
         for ci_c0 in ci[pass_i]:
             ci0 = ci[pass_i][ci_c0]
@@ -675,6 +656,8 @@ def cluster_removal_according_to_center_matching_specificity(ci, cis, al, tk, si
                 assert (tk_fsc[tk1] > tk_fsc[tk0])
                 ind_t = N.logical_and(N.isfinite(ss[c0]), N.isfinite(ss[c1]))
                 if ind_t.sum() < test_sample_num_min:
+                    # failed alignments, or pairs pruned by the template prefilter, have a nan score
+                    skipped_pairs += 1
                     continue
                 if N.all((ss[c0][ind_t] > ss[c1][ind_t])):
                     continue
@@ -718,6 +701,8 @@ def cluster_removal_according_to_center_matching_specificity(ci, cis, al, tk, si
                 best['template_id'] = c
         al_['best'] = best
     print(len(non_specific_clusters), 'redundant averages detected', none_specific_cluster_ids)
+    if skipped_pairs > 0:
+        print(skipped_pairs, 'template pairs not tested, less than', test_sample_num_min, 'subtomograms with finite scores')
     sys.stdout.flush()
     return {'non_specific_clusters': non_specific_clusters, 'wilcoxion_stat': wilcoxion_stat, }
 
@@ -911,8 +896,31 @@ def align_to_templates__pair_align(c, t_key, v, vm, align_op):
     return at_re
 
 
+def align_to_templates__batch_align(tem_keys, v, vm, align_op):
+    """align v against all templates in one batch, the expansion of v is computed only once"""
+    cs = list(tem_keys.keys())
+    ts = [IV.get_mrc(tem_keys[c]['subtomogram']) for c in cs]
+    tms = [IV.get_mrc(tem_keys[c]['mask']) for c in cs]
+    err = None
+    try:
+        al = AU.align_vols__batch(v1s=ts, m1s=tms, v2s=[v], m2s=[vm], L=align_op['L'], top_n=1)
+    except Exception as e:
+        err = traceback.format_exc()
+        al = [[[]] for _ in cs]
+    align_re = {}
+    for (i, c) in enumerate(cs):
+        if len(al[i][0]) > 0:
+            a = al[i][0][0]
+            align_re[c] = {'angle': a['angle'], 'loc': a['loc'], 'score': a['score'], 'err': err, }
+        else:
+            align_re[c] = {'angle': (N.random.random(3) * (N.pi * 2)), 'loc': N.zeros(3), 'score': float('nan'),
+                           'err': (err if (err is not None) else 'alignment failed'), }
+        align_re[c]['c'] = c
+    return align_re
+
+
 def align_to_templates(self, rec=None, segmentation_tg_op=None, tem_keys=None, template_wedge_cutoff=0.1, align_op=None,
-                       multiprocessing=False):
+                       multiprocessing=False, prefilter=None):
     vi = None
     if align_op['with_missing_wedge']:
         v = self.cache.get_mrc(rec['subtomogram'])
@@ -925,6 +933,14 @@ def align_to_templates(self, rec=None, segmentation_tg_op=None, tem_keys=None, t
                              normalize=True, cache=self.cache)['vi']
     if (segmentation_tg_op is not None) and ('template' in rec) and ('segmentation' in rec['template']):
         v = align_to_templates__segment(rec=rec, v=v, segmentation_tg_op=segmentation_tg_op)['v']
+    tem_keys_all = tem_keys
+    if prefilter is not None:
+        cs = list(prefilter['profiles'].keys())
+        p = AFP.fourier_shell_profile(v=v, m=vm, r_max=(len(prefilter['profiles'][cs[0]]) - 1))
+        rank = [cs[_] for _ in AFP.rank_templates(p, [prefilter['profiles'][c] for c in cs])]
+        if not prefilter['exhaustive']:
+            kept = (set(rank[:prefilter['top_m']]) | set(prefilter.get('required', [])))
+            tem_keys = {c: tem_keys[c] for c in rank if (c in kept)}
     if multiprocessing:
         if self.pool is None:
             self.pool = Pool()
@@ -942,6 +958,15 @@ def align_to_templates(self, rec=None, segmentation_tg_op=None, tem_keys=None, t
                                         repr(tem_keys[c]), repr(align_re[c]['err']))
         self.pool.close()
         self.pool = None
+    elif align_op['with_missing_wedge'] and ('fast_align_and_refine' not in align_op) and ('multires' not in align_op):
+        if self.work_queue.done_tasks_contains(self.task.task_id):
+            raise Exception('Duplicated task')
+        align_re = align_to_templates__batch_align(tem_keys=tem_keys, v=v, vm=vm, align_op=align_op)
+        for c in align_re:
+            if N.isnan(align_re[c]['score']):
+                if self.logger is not None:
+                    self.logger.warning('alignment failed: rec %s, template %s, error %s ', repr(rec),
+                                        repr(tem_keys[c]), repr(align_re[c]['err']))
     else:
         align_re = {}
         for c in tem_keys:
@@ -952,7 +977,14 @@ def align_to_templates(self, rec=None, segmentation_tg_op=None, tem_keys=None, t
                 if self.logger is not None:
                     self.logger.warning('alignment failed: rec %s, template %s, error %s ', repr(rec),
                                         repr(tem_keys[c]), repr(align_re[c]['err']))
-    return {'vol_key': rec, 'align': align_re, }
+    if prefilter is None:
+        return {'vol_key': rec, 'align': align_re, }
+    for c in tem_keys_all:
+        if c in align_re:
+            continue
+        align_re[c] = {'angle': (N.random.random(3) * (N.pi * 2)), 'loc': N.zeros(3), 'score': float('nan'),
+                       'err': None, 'c': c, 'pruned': True, }
+    return {'vol_key': rec, 'align': align_re, 'prefilter': {'rank': rank, 'exhaustive': prefilter['exhaustive'], }, }
 
 
 def align_to_templates__segment(rec, v, segmentation_tg_op):
@@ -972,7 +1004,16 @@ def align_to_templates__segment(rec, v, segmentation_tg_op):
     return {'v': v, 'phi_m': phi_m, 'phi_mr': phi_mr, }
 
 
-def align_to_templates__batch(self, op, data_json, segmentation_tg_op, tmp_dir, tem_keys):
+def align_to_templates__batch(self, op, data_json, segmentation_tg_op, tmp_dir, tem_keys, prefilter_required=None):
+    """
+    op['align']['prefilter'], optional screening of the templates with aitom.align.fast.prefilter:
+        top_m: number of templates aligned against each subtomogram
+        recall_sample_num: expected number of subtomograms aligned against all templates, to measure the recall
+        specificity_sample_num: number of members of each cluster aligned against the templates compared by the
+            specificity test, see align_to_templates__prefilter_required(), default 50
+    prefilter_required: with op['align']['prefilter'], the templates that must be aligned to a subtomogram whatever
+    its screening rank, as {subtomogram: templates}, see align_to_templates__prefilter_required()
+    """
     if ('template' in op) and ('match' in op['template']) and ('priority' in op['template']['match']):
         task_priority = op['template']['match']['priority']
     else:
@@ -995,15 +1036,30 @@ def align_to_templates__batch(self, op, data_json, segmentation_tg_op, tmp_dir,
         print('loaded previous', len(at_ress), ' resutlts')
         sys.stdout.flush()
     completed_subtomogram_set = set([_.result['vol_key']['subtomogram'] for _ in at_ress])
+    prefilter_op = op['align'].get('prefilter')
+    if prefilter_op is not None:
+        # the descriptors of the templates are computed once, the screening itself runs inside the tasks
+        profiles = {c: AFP.fourier_shell_profile(v=IV.get_mrc(tem_keys[c]['subtomogram']),
+                                                 m=IV.get_mrc(tem_keys[c]['mask']), r_max=prefilter_op.get('r_max'))
+                    for c in tem_keys}
+        exhaustive_p = (float(prefilter_op.get('recall_sample_num', 0)) / max(len(data_json), 1))
     tasks = []
     for rec in data_json:
         if rec['subtomogram'] in completed_subtomogram_set:
             continue
+        prefilter = None
+        if prefilter_op is not None:
+            prefilter = {'profiles': profiles, 'top_m': prefilter_op['top_m'],
+                         'exhaustive': bool(N.random.random() < exhaustive_p), }
+            if prefilter_required is not None:
+                prefilter['required'] = sorted(prefilter_required.get(rec['subtomogram'], []))
         tasks.append(
             self.runner.task(priority=task_priority, module='tomominer.pursuit.multi.util', method='align_to_templates',
                              kwargs={'rec': rec, 'segmentation_tg_op': (
                                  segmentation_tg_op if op['template']['match']['use_segmentation_mask'] else None),
-                                     'tem_keys': tem_keys, 'align_op': op['align'], 'multiprocessing': False, }))
+                                     'tem_keys': tem_keys, 'align_op': op['align'], 'multiprocessing': False,
+                                     'prefilter': prefilter, },
+                             data_keys=data_json_keys([rec])))
     for at_ress_t in self.runner.run__except(tasks):
         at_ress.append(at_ress_t)
         res_file = os.path.join(tmp_dir, ('%s.pickle' % at_ress_t.task_id))
@@ -1012,6 +1068,44 @@ def align_to_templates__batch(self, op, data_json, segmentation_tg_op, tmp_dir,
     return at_ress
 
 
+def align_to_templates__prefilter_required(tk, tk_info, sample_num=50):
+    """
+    the templates that the prefilter must not prune, for a random sample of sample_num subtomograms of the cluster of
+    each selected template. cluster_removal_according_to_center_matching_specificity() compares the scores of the
+    members of the cluster of each template c0 against c0 and against every template with a larger fsc sum, and
+    needs at least test_sample_num_min members with both scores. sample_num should be a few times that number,
+    requiring the comparison templates for all members would leave little for the prefilter to prune
+    """
+    fsc = {c: tk_info[tk[c]['subtomogram']]['fsc'].sum() for c in tk}
+    re = defaultdict(set)
+    for c0 in tk:
+        cs = set((c1 for c1 in tk if (fsc[c1] >= fsc[c0])))
+        dj = tk_info[tk[c0]['subtomogram']]['data_json']
+        for i in N.random.permutation(len(dj))[:sample_num]:
+            re[dj[i]['subtomogram']].update(cs)
+    return dict(re)
+
+
+def align_to_templates__prefilter_recall(al):
+    """recall of the template screening, on the subtomograms that have also been aligned against all templates"""
+    ranks = []
+    best = []
+    for r in al:
+        if ('prefilter' not in r) or (not r['prefilter']['exhaustive']):
+            continue
+        cs = [c for c in r['align'] if N.isfinite(r['align'][c]['score'])]
+        if len(cs) == 0:
+            continue
+        ranks.append(r['prefilter']['rank'])
+        best.append(max(cs, key=(lambda _: r['align'][_]['score'])))
+    if len(ranks) == 0:
+        return {}
+    re = AFP.recall(ranks, best)
+    print('template prefilter recall of the best template among the top m, over', len(ranks), 'subtomograms:', re)
+    sys.stdout.flush()
+    return re
+
+
 def cluster_formation_alignment_fsc__by_global_maximum(self, dj, op=None):
     if 'debug' not in op:
         op['debug'] = False
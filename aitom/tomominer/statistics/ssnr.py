@@ -15,6 +15,7 @@ import aitom.image.vol.util as GV
 import aitom.tomominer.io.file as IV
 import aitom.geometry.rotate as GR
 import aitom.geometry.ang_loc as AAL
+from aitom.tomominer.parallel.Task import data_json_keys
 
 
 def ssnr_to_fsc(ssnr):
@@ -84,30 +85,15 @@ def var__global(self, clusters, n_chunk, segmentation_tg_op=None):
         labels_copy_part = labels_copy[:n_chunk]
         tasks.append(self.runner.task(module='tomominer.statistics.ssnr', method='var__local',
                                       kwargs={'data_json': data_json_copy_part, 'labels': labels_copy_part,
-                                              'return_key': True, 'segmentation_tg_op': segmentation_tg_op, }))
+                                              'return_key': False, 'segmentation_tg_op': segmentation_tg_op, },
+                                      data_keys=data_json_keys(data_json_copy_part)))
         data_json_copy = data_json_copy[n_chunk:]
         labels_copy = labels_copy[n_chunk:]
-    sum_global = {}
-    prod_sum = {}
-    mask_sum = {}
-    for res in self.runner.run__except(tasks):
-        with open(res.result['key']) as f:
-            re = pickle.load(f)
-        os.remove(res.result['key'])
-        for l in re['sum']:
-            if l not in sum_global:
-                sum_global[l] = re['sum'][l]
-            else:
-                sum_global[l] += re['sum'][l]
-            if l not in prod_sum:
-                prod_sum[l] = re['prod_sum'][l]
-            else:
-                prod_sum[l] += re['prod_sum'][l]
-            if l not in mask_sum:
-                mask_sum[l] = re['mask_sum'][l]
-            else:
-                mask_sum[l] += re['mask_sum'][l]
-    return {'sum': sum_global, 'prod_sum': prod_sum, 'mask_sum': mask_sum, }
+    # the partial sums are added up on the workers
+    re = self.runner.run__reduce(tasks)
+    if re is None:
+        return {'sum': {}, 'prod_sum': {}, 'mask_sum': {}, }
+    return {'sum': re['sum'], 'prod_sum': re['prod_sum'], 'mask_sum': re['mask_sum'], }
 
 
 def ssnr__get_rad(siz):
@@ -275,7 +261,7 @@ def ssnr_sequential_parallel(self, data_json_dict, op):
             opt['save_tmp_data'] = True
             tasks.append(
                 self.runner.task(module='tomominer.statistics.ssnr', method='ssnr_sequential___batch_data_collect',
-                                 kwargs={'data_json': dj_part, 'op': opt, }))
+                                 kwargs={'data_json': dj_part, 'op': opt, }, data_keys=data_json_keys(dj_part)))
             dj = dj[op['n_chunk']:]
             inds = inds[op['n_chunk']:]
             sequential_id += 1
@@ -21,6 +21,11 @@ link_extra_args = []
 if platform.system() == "Darwin":
     compile_extra_args = ['-std=c++11', "-mmacosx-version-min=10.9"]
     link_extra_args = ["-stdlib=libc++", "-mmacosx-version-min=10.9"]
+else:
+    # the alignment kernels are parallelized with OpenMP, see aitom/tomominer/core/src/parallel.hpp
+    # armadillo's own OpenMP use is disabled so that the thread count of the kernels is the only one that applies
+    compile_extra_args += ['-fopenmp', '-DARMA_DONT_USE_OPENMP']
+    link_extra_args += ['-fopenmp']
 
 
 import os
@@ -39,11 +44,12 @@ cpp_core = Extension('aitom.tomominer.core.core',
                          'aitom/tomominer/core/src/interpolation.cpp',
                          'aitom/tomominer/core/src/io.cpp',
                          'aitom/tomominer/core/src/legendre.cpp',
+                         'aitom/tomominer/core/src/parallel.cpp',
                          'aitom/tomominer/core/src/rotate.cpp',
                          'aitom/tomominer/core/src/sht.cpp',
                          'aitom/tomominer/core/src/wigner.cpp',
                          'aitom/tomominer/core/src/segmentation/watershed/watershed_segmentation.cpp'],
-                     libraries=['m', 'fftw3', 'armadillo', 'blas', 'lapack'],
+                     libraries=['m', 'fftw3', 'fftw3f', 'armadillo', 'blas', 'lapack'],
                      include_dirs=[N.get_include(), '/usr/include',
                                    '/usr/local/include', 'aitom/tomominer/core/src/', os.path.join(script_dir, 'ext', 'include')],      # use script_dir/ext/include to include header files that cannot be installed without root privilege
                      library_dirs=[os.path.join(script_dir, 'ext', 'lib')],     # use script_dir/ext/lib to include library files that cannot be installed without root privilege